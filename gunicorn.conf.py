@@ -0,0 +1,14 @@
+"""
+Gunicorn config, read from the working directory by ``gunicorn quizcards.wsgi``.
+
+Hooks run in each worker process after it's forked, so nothing started there is shared with the master process
+or inherited in a copied state (e.g. a held lock), also with ``--preload``.
+"""
+
+
+def post_fork(server, worker):
+    from main.crypto import crypto
+    from threading import Thread
+
+    # load the RSA keys in the background, instead of while handling the first sensitive request
+    Thread(target=crypto.warm_up, name='CryptoWarmUp', daemon=True).start()
@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def install_triggers(using, **kwargs):
+    from django.db import connections
+    from . import search, storage
+
+    # only for the tables of applied migrations, e.g. migrating back to 0001 drops the image reference table
+    connection = connections[using]
+    tables = connection.introspection.table_names()
+    search.install(connection, [name for name in search.INDEXES if name in tables])
+    if 'main_storedimage' in tables:
+        storage.install(connection)
 
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from . import caching, testgen  # noqa: F401, connects the cache invalidation
+        from . import checks  # noqa: F401, registers the deployment checks
+        from . import cron, imaging, mail  # noqa: F401, registers the background tasks
+
+        # migrations rebuilding the deck or card table drop the full-text index and image reference triggers
+        post_migrate.connect(install_triggers, sender=self)
@@ -0,0 +1,34 @@
+"""
+SQLite tuned for concurrent requests.
+
+With the default rollback journal a writing transaction locks out every reader, so the study and search
+pages stall behind each editor save. In WAL mode readers keep reading the last committed state while a
+transaction writes, and only writers wait for each other.
+
+Django starts transactions with a deferred BEGIN, which takes the write lock only at the first write.
+When two transactions that have both read try to write, SQLite fails one of them at once with "database
+is locked", without waiting for the busy timeout, since waiting could deadlock. The editor saves read
+the deck before writing it, so transactions start with BEGIN IMMEDIATE here. Writers then queue for the
+lock for up to the busy timeout (see SQLITE_TIMEOUT in the settings), and readers aren't affected.
+"""
+
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    'journal_mode': 'wal',          # persistent, stored in the database file
+    'synchronous': 'normal',        # durable in WAL mode, except for the last transactions on power loss
+    'cache_size': -16000,           # KiB, negative values are sizes instead of pages
+    'temp_store': 'memory',
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for pragma, value in PRAGMAS.items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
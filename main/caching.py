@@ -0,0 +1,110 @@
+"""
+Caching of rendered deck fragments and of the public deck listings.
+
+Fragments (see templatetags/fragments.py) are keyed by the deck's uuid, version and last modification,
+so a save of the deck, which bumps its version, makes every fragment of it stale without deleting
+anything. Listing pages are keyed by a generation of their scope, which the deck signals bump once
+the saving or deleting transaction commits: any deck change for the search results, the decks of a
+user for their checkout pages. Generations live in the cache itself, so every process only sees the
+invalidations with a shared backend (e.g. the file based cache or Memcached). Pages are only cached
+with ``CACHE_PAGES``, which is off with the per-process default backend, see checks.py.
+
+With read replicas (see routers.py) the scopes are invalidated again once the replicas caught up, as
+pages rendered from a replica meanwhile may show the decks as they were before the change. A task
+worker does that, which the web processes only notice through the shared cache as well.
+
+Hits and misses are counted per namespace in the cache too, see ``stats``.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.db.transaction import on_commit
+from django.dispatch import receiver
+from datetime import timedelta
+from hashlib import md5
+from .models import Deck
+from .tasks import enqueue, task
+
+FRAGMENT_TIMEOUT = 24 * 60 * 60     # seconds, fragments of unchanged decks are rendered again after this
+PAGE_TIMEOUT = 10 * 60              # seconds
+NAMESPACES = ('fragments', 'pages')
+
+SEARCH_SCOPE = 'search'
+
+
+def checkout_scope(user_id):
+    return f'checkout-{user_id}'
+
+
+def generation(scope):
+    """Current generation of a scope, part of the keys of the pages it contains."""
+
+    cache.add(f'generation:{scope}', 0, None)
+    return cache.get(f'generation:{scope}', 0)
+
+
+@task
+def invalidate(*scopes):
+    for scope in scopes:
+        _increment(f'generation:{scope}')
+
+
+def key(namespace, *parts):
+    """Cache key of a value identified by parts of any type, hashed so any part is valid in any backend."""
+
+    return f'{namespace}:' + md5(repr(parts).encode()).hexdigest()
+
+
+def get_or_set(namespace, key, default, timeout):
+    """Like cache.get_or_set, counting whether the value was cached."""
+
+    value = cache.get(key)
+
+    if value is None:
+        _increment(f'stats:{namespace}:misses')
+        value = default()
+        cache.set(key, value, timeout)
+    else:
+        _increment(f'stats:{namespace}:hits')
+
+    return value
+
+
+def stats():
+    """Hits and misses by namespace, since the counters were last reset."""
+
+    counters = cache.get_many([f'stats:{namespace}:{kind}' for namespace in NAMESPACES for kind in ('hits', 'misses')])
+    return {
+        namespace: {kind: counters.get(f'stats:{namespace}:{kind}', 0) for kind in ('hits', 'misses')}
+        for namespace in NAMESPACES
+    }
+
+
+def reset_stats():
+    cache.delete_many([f'stats:{namespace}:{kind}' for namespace in NAMESPACES for kind in ('hits', 'misses')])
+
+
+def _increment(key):
+    # never expires, unlike the values themselves
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)     # evicted meanwhile
+
+
+@receiver(post_save, sender=Deck)
+@receiver(post_delete, sender=Deck)
+def invalidate_pages(sender, instance, **kwargs):
+    """Every editor save path saves the deck itself too. Waits for the commit, so no stale page is re-cached."""
+
+    if not settings.CACHE_PAGES:
+        return
+
+    scopes = [SEARCH_SCOPE]
+    if instance.user_id is not None:
+        scopes.append(checkout_scope(instance.user_id))
+    on_commit(lambda: invalidate(*scopes))
+    if settings.DATABASE_REPLICAS:
+        enqueue('main.caching.invalidate', scopes, delay=timedelta(seconds=settings.DATABASE_REPLICATION_LAG))
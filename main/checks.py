@@ -0,0 +1,39 @@
+"""
+Checks of the deployment, run by the management commands (see ``manage.py check``) and logged by every web
+process when it starts, see quizcards/wsgi.py. Messages which don't apply to a deployment are silenced with
+the ``SILENCED_SYSTEM_CHECKS`` environment variable, e.g. ``SILENCED_SYSTEM_CHECKS=main.W001``.
+"""
+
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+TAG = 'deployment'
+
+
+@register(TAG)
+def check_task_workers(app_configs, **kwargs):
+    if settings.TASK_WORKERS:
+        return []
+
+    return [Warning(
+        'No task workers run in the web processes.',
+        hint='Mail, image processing and the scheduled jobs only run if "manage.py tasks work" runs too. '
+             'Silence this warning where it does, or set TASK_WORKERS.',
+        id='main.W001',
+    )]
+
+
+@register(TAG)
+def check_page_cache(app_configs, **kwargs):
+    from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+    from django.core.cache.backends.locmem import LocMemCache
+
+    if not settings.CACHE_PAGES or not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+        return []
+
+    return [Error(
+        'Pages are cached in a cache of each process, which misses the invalidations of the others.',
+        hint='Set CACHE_BACKEND to a shared cache (e.g. Memcached, the database or the file based cache), '
+             'or unset CACHE_PAGES. Silence this error if a single process serves the site.',
+        id='main.E001',
+    )]
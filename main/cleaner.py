@@ -1,46 +1,132 @@
 import os
-import threading
 
+from collections import namedtuple
 from django.conf import settings
-from .models import Card
-from .utils import django_thread, validate_datetime
+from django.db.transaction import atomic
+from time import time
+from . import imaging, uploads
+from .models import Card, StoredImage
 
-CLEANUP_THREAD_NAME = 'FileCleanupThread'
+CHUNK_SIZE = 2000
+GRACE_PERIOD = 60 * 60  # seconds, files uploaded more recently may not be saved to a card yet
 
+CleanupReport = namedtuple('CleanupReport', ('scanned', 'removed', 'recent', 'bytes_reclaimed'))
 
-def file_cleanup():
-    images = list()
 
-    for card in Card.objects.all():
-        images.append(os.path.basename(card.term_image.name))
-        images.append(os.path.basename(card.definition_image.name))
+def referenced_images():
+    """Filenames of every card image, streamed from the database in chunks."""
 
-    for filename in os.listdir(settings.MEDIA_ROOT):
-        if filename not in images:
-            file = os.path.join(settings.MEDIA_ROOT, filename)
-            os.remove(file)
+    images = set()
+    rows = Card.objects.values_list('term_image', 'definition_image').iterator(chunk_size=CHUNK_SIZE)
 
+    for term_image, definition_image in rows:
+        if term_image:
+            images.add(os.path.basename(term_image))
+        if definition_image:
+            images.add(os.path.basename(definition_image))
 
-def start_cleanup_thread(day, hour, minute):
-    # raises ValueError if datetime is invalid
-    validate_datetime(day, hour, minute)
+    return images
 
-    def task():
-        from datetime import datetime
-        from time import sleep
 
-        while django_thread().is_alive():
-            now = datetime.now()
-            current_day = (now.date().isoweekday() == day)
-            current_time = (now.hour == hour and now.minute == minute)
+def file_cleanup(dry_run=False, grace_period=GRACE_PERIOD):
+    """
+    Removes images from MEDIA_ROOT which don't belong to any card. Scans every file and card, so it's
+    only needed for files stored before the reference counting, see collect_unreferenced.
 
-            if current_day and current_time:
-                file_cleanup()
-            sleep(60)   # wake up every minute
+    Parameters
+    ----------
+    dry_run : bool
+            Only report what would be removed.
+    grace_period : int
+            Files modified within this many seconds are kept.
 
-    # get the names of running threads
-    threads = map(lambda thread: thread.name, threading.enumerate())
+    Returns
+    -------
+    CleanupReport
+    """
 
-    if CLEANUP_THREAD_NAME not in threads:
-        cleanup_thread = threading.Thread(target=task, name=CLEANUP_THREAD_NAME, daemon=True)
-        cleanup_thread.start()
+    images = referenced_images()
+    deadline = time() - grace_period
+    scanned = removed = recent = reclaimed = 0
+
+    try:
+        entries = os.scandir(settings.MEDIA_ROOT)
+    except FileNotFoundError:
+        return CleanupReport(scanned, removed, recent, reclaimed)
+
+    with entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+
+            scanned += 1
+            if entry.name in images:
+                continue
+
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > deadline:
+                recent += 1
+                continue
+
+            if not dry_run:
+                os.remove(entry.path)
+                imaging.remove(entry.name)
+            removed += 1
+            reclaimed += stat.st_size
+
+    return CleanupReport(scanned, removed, recent, reclaimed)
+
+
+def collect_unreferenced(dry_run=False, grace_period=GRACE_PERIOD):
+    """
+    Removes stored images which no card refers to anymore. Only the unreferenced rows of the reference
+    count table are visited, so the cost doesn't depend on the number of cards or files. Parameters and
+    return value are the same as for file_cleanup, which is used instead where the counts aren't maintained.
+    """
+
+    from datetime import timedelta
+    from django.utils import timezone
+    from . import storage
+
+    if not storage.available():
+        return file_cleanup(dry_run, grace_period)
+
+    deadline = timezone.now() - timedelta(seconds=grace_period)
+    unreferenced = StoredImage.objects.filter(refcount=0, created__lt=deadline)
+    recent = StoredImage.objects.filter(refcount=0, created__gte=deadline).count()
+    scanned = removed = reclaimed = 0
+    last = ''
+
+    while True:
+        names = list(unreferenced.filter(name__gt=last).order_by('name').values_list('name', flat=True)[:CHUNK_SIZE])
+        if not names:
+            break
+        last = names[-1]
+
+        for name in names:
+            scanned += 1
+            path = storage.image_storage.path(name)
+            size = os.path.getsize(path) if os.path.isfile(path) else 0
+
+            if not dry_run:
+                # the conditional delete and the removal are one transaction, which storing the same image again
+                # waits for, see ContentAddressedStorage._store. A card may have started to use the image meanwhile.
+                with atomic():
+                    deleted, _ = unreferenced.filter(name=name).delete()
+                    if not deleted:
+                        continue
+                    if size:
+                        os.remove(path)
+                    imaging.remove(name)
+
+            removed += 1
+            reclaimed += size
+
+    return CleanupReport(scanned, removed, recent, reclaimed)
+
+
+def cleanup():
+    """The weekly cleanup of unused images and uploads, see cron.SCHEDULES."""
+
+    collect_unreferenced()
+    uploads.remove_stale()
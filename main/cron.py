@@ -0,0 +1,191 @@
+"""
+Recurring maintenance jobs with cron-style schedules.
+
+There is no scheduler thread. The task workers (see tasks.py) call ``tick`` while they are idle, and every
+due schedule is advanced to its next run with a conditional update of its ``main_schedule`` row. The row
+acts as a lock: of all the processes noticing a due schedule, only the one whose update succeeds queues
+the run, so each occurrence runs exactly once however many web and worker processes there are. An
+occurrence missed while nothing was running is caught up once, not once per missed occurrence. Every
+run is recorded with its outcome in ``main_jobrun``.
+"""
+
+from datetime import datetime, timedelta
+from django.db import IntegrityError
+from django.db.transaction import atomic
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from time import monotonic
+from .models import JobRun, Schedule
+from .tasks import task
+
+# name: (cron expression, dotted path of the job), expressions are in local time, see TIME_ZONE
+SCHEDULES = {
+    'media-cleanup': ('0 17 * * 5', 'main.cleaner.cleanup'),    # every Friday at 17:00
+}
+
+TICK_INTERVAL = 30                  # seconds, how often a process checks for due schedules
+HISTORY_AGE = timedelta(days=90)    # runs are recorded for this long
+
+# minute, hour, day of month, month, day of week (0 or 7 is Sunday)
+_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+_last_tick = None
+
+
+def parse(expression):
+    """
+    Parameters
+    ----------
+    expression : str
+            Five space separated fields: minute, hour, day of month, month and day of week. Each is "*",
+            a number, a range like "1-5", a step like "*/15" or "0-30/10", or a comma separated list of these.
+
+    Returns
+    -------
+    tuple
+            A set of the matching values for each field, and whether the day fields are restricted.
+    """
+
+    fields = expression.split()
+    if len(fields) != len(_FIELDS):
+        raise ValueError(f'Expected {len(_FIELDS)} fields in {expression!r}.')
+
+    values = []
+    for field, (low, high) in zip(fields, _FIELDS):
+        matching = set()
+
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                first, last = low, high
+            elif '-' in span:
+                first, last = map(int, span.split('-'))
+            else:
+                first = int(span)
+                last = high if step else first     # "5/10" steps from 5 to the end of the range
+
+            if not low <= first <= last <= high:
+                raise ValueError(f'{part!r} is out of range {low}-{high} in {expression!r}.')
+            matching.update(range(first, last + 1, int(step) if step else 1))
+
+        values.append(matching)
+
+    # Sunday is both 0 and 7
+    if 7 in values[4]:
+        values[4] = (values[4] - {7}) | {0}
+
+    return (*values, fields[2] != '*', fields[4] != '*')
+
+
+def next_run(expression, after):
+    """The first time matching the expression strictly after ``after``, an aware datetime."""
+
+    minutes, hours, days, months, weekdays, days_restricted, weekdays_restricted = parse(expression)
+    current = timezone.localtime(after).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+    limit = current + timedelta(days=366 * 5)
+
+    def day_matches(moment):
+        day, weekday = moment.day in days, (moment.isoweekday() % 7) in weekdays
+        # like cron, a day matches either field when both are restricted
+        if days_restricted and weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    while current < limit:
+        if current.month not in months:
+            current = (current.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+        elif not day_matches(current):
+            current = current.replace(hour=0, minute=0) + timedelta(days=1)
+        elif current.hour not in hours:
+            current = current.replace(minute=0) + timedelta(hours=1)
+        elif current.minute not in minutes:
+            current += timedelta(minutes=1)
+        else:
+            return timezone.make_aware(current)
+
+    raise ValueError(f'{expression!r} never matches.')
+
+
+def sync(now=None):
+    """Creates the rows of new schedules, and reschedules those whose expression changed."""
+
+    now = now or timezone.now()
+    schedules = Schedule.objects.in_bulk(SCHEDULES.keys())
+
+    for name, (expression, _) in SCHEDULES.items():
+        schedule = schedules.get(name)
+        if schedule is None:
+            Schedule.objects.bulk_create(
+                [Schedule(name=name, expression=expression, next_run=next_run(expression, now))],
+                ignore_conflicts=True
+            )
+        elif schedule.expression != expression:
+            Schedule.objects.filter(name=name).update(expression=expression, next_run=next_run(expression, now))
+
+
+def tick(now=None, force=False):
+    """
+    Queues the runs of the due schedules. Cheap enough to call often, only every ``TICK_INTERVAL``
+    seconds it checks the database, unless forced.
+
+    Returns
+    -------
+    list
+            Names of the schedules this call queued a run of.
+    """
+
+    global _last_tick
+
+    if not force and _last_tick is not None and monotonic() - _last_tick < TICK_INTERVAL:
+        return []
+
+    if _last_tick is None:
+        sync(now)
+    _last_tick = monotonic()
+
+    now = now or timezone.now()
+    queued = []
+
+    for schedule in Schedule.objects.filter(name__in=SCHEDULES.keys(), next_run__lte=now):
+        # only one process advances the schedule from this occurrence, and it queues the run in the same
+        # transaction, so the occurrence isn't lost if the process dies in between
+        with atomic():
+            advanced = Schedule.objects.filter(name=schedule.name, next_run=schedule.next_run) \
+                .update(next_run=next_run(schedule.expression, now))
+            if advanced:
+                run_job.delay(schedule.name, schedule.next_run.isoformat())
+        if advanced:
+            queued.append(schedule.name)
+
+    return queued
+
+
+@task(max_attempts=1)
+def run_job(name, scheduled_for):
+    """Runs a scheduled job once and records the outcome. Not retried, the next occurrence will come."""
+
+    import traceback
+
+    try:
+        with atomic():
+            run = JobRun.objects.create(schedule_id=name, scheduled_for=datetime.fromisoformat(scheduled_for))
+    except IntegrityError:
+        return  # the task was delivered twice, e.g. after its worker was presumed dead
+
+    try:
+        import_string(SCHEDULES[name][1])()
+    except Exception:
+        run.error = traceback.format_exc()
+        raise
+    finally:
+        run.finished = timezone.now()
+        run.save(update_fields=['finished', 'error'])
+        JobRun.objects.filter(schedule_id=name, started__lt=timezone.now() - HISTORY_AGE).delete()
+
+
+def run_now(name):
+    """Queues a run of a schedule outside of its schedule."""
+
+    if name not in SCHEDULES:
+        raise LookupError(f'Unknown schedule {name!r}.')
+    sync()
+    run_job.delay(name, timezone.now().isoformat())
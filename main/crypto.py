@@ -1,35 +1,327 @@
-from Crypto import Random
+"""
+RSA encryption of sensitive form fields.
+
+Keys are loaded lazily, on first use or ahead of it by ``warm_up``, so importing the module never blocks on
+reading, decrypting or generating a key. Processes may share an unencrypted copy of the keys in
+``RSA_KEY_CACHE`` (e.g. a directory on tmpfs), which saves decrypting the passphrase-protected file on every
+start. ``rotate`` replaces the current key with a new one, while the previous key keeps being accepted, so
+forms encrypted just before a rotation still work. Other processes pick up a rotation within
+``RELOAD_INTERVAL`` seconds, or as soon as they see a ciphertext of the new key. Ciphertexts are prefixed with
+the id of their key.
+
+Where the browser supports it, RSA is only used once per session: the browser sends a random secret
+encrypted with the public key, both sides derive an AES key from it (see ``open_session``), and the browser
+encrypts later sensitive fields with AES-GCM, which is orders of magnitude cheaper to decrypt than an RSA
+private key operation.
+"""
+
+import json
+import os
 from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_v1_5
-from base64 import b64decode
+from Crypto.Cipher import AES, PKCS1_v1_5
+from Crypto.Random import get_random_bytes
+from base64 import b64decode, b64encode
+from binascii import Error as Base64Error
+from collections import namedtuple
 from decouple import config
-from os.path import isfile
+from hashlib import sha256
+from secrets import token_hex
+from os.path import basename, getmtime, isfile, join
+from tempfile import mkstemp
+from threading import Lock
+from time import monotonic, perf_counter
+
+PREVIOUS_SUFFIX = '.previous'
+SESSION_KEY = 'field_key'   # the AES key of the session
+SESSION_KEY_ID = 'field_key_id'
+FIELD_PREFIX = 'aes:'       # of the fields encrypted with the session's AES key
+GCM_TAG_SIZE = 16           # bytes, appended to the ciphertext by WebCrypto
+RELOAD_INTERVAL = 10   # seconds, how often the key file is checked for a rotation, and unknown key ids reload
+
+# everything not depending on the ciphertext is prepared once and shared by all requests
+Key = namedtuple('Key', ('id', 'keypair', 'cipher', 'sentinel', 'public_key'))
 
 
 class Crypto:
     RSA_KEY = config('RSA_KEY')
+    RSA_KEY_CACHE = config('RSA_KEY_CACHE', default='')
 
     def __init__(self, size):
-        passphrase = config('RSA_PASSPHRASE')
+        self.size = size
+        self._keys = None   # by id, the current key first
+        self._loaded_at = None
+        self._checked_at = None
+        self._modified = None   # of the current key file when the keys were loaded
+        self._load_lock = Lock()
+
+        self._lock = Lock()
+        self._calls = 0
+        self._failures = 0
+        self._seconds = 0.0
+        self._slowest = 0.0
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self.warm_up()
+        elif monotonic() - self._checked_at > RELOAD_INTERVAL:
+            # another process may have rotated the keys
+            self._checked_at = monotonic()
+            if self._modification_time() != self._modified:
+                self.reload()
+        return self._keys
+
+    @property
+    def current(self):
+        return next(iter(self.keys.values()))
+
+    @property
+    def keypair(self):
+        return self.current.keypair
+
+    def warm_up(self):
+        """Loads the keys unless they are loaded already, generating the first key if there is none yet."""
+
+        with self._load_lock:
+            if self._keys is None:
+                self._keys = self._load()
+                self._loaded_at = self._checked_at = monotonic()
+        return self
+
+    def reload(self):
+        """Loads the keys again, e.g. after another process rotated them."""
 
-        # generate keypair if doesn't exist
-        if not isfile(Crypto.RSA_KEY):
-            keypair = RSA.generate(size)
-            with open(Crypto.RSA_KEY, 'wb') as file:
-                key = keypair.export_key(passphrase=passphrase)
-                file.write(key)
+        with self._load_lock:
+            self._keys = self._load()
+            self._loaded_at = self._checked_at = monotonic()
 
-        self.keypair = RSA.import_key(open(Crypto.RSA_KEY).read(), passphrase=passphrase)
+    def rotate(self):
+        """Generates a new current key. The current key becomes the previous one, the previous one is dropped."""
+
+        with self._load_lock:
+            current = Crypto.RSA_KEY
+            if isfile(current):
+                with open(current, 'rb') as file:
+                    # the current key file is replaced, never removed, so other processes can always load it
+                    self._write(current + PREVIOUS_SUFFIX, file.read(), replace=True)
+            self._write(current, self._generate(), replace=True)
+            self._keys = self._load()
+            self._loaded_at = self._checked_at = monotonic()
 
     def decrypt(self, encrypted_text):
-        cipher = PKCS1_v1_5.new(self.keypair)
-        size = self.keypair.size_in_bits() // 8
-        sentinel = Random.new().read(size)
-        plaintext = cipher.decrypt(b64decode(encrypted_text), sentinel).decode()
-        return plaintext
+        """Raises ValueError if the text wasn't encrypted with one of the public keys."""
+
+        return self.decrypt_many([encrypted_text])[0]
+
+    def decrypt_many(self, encrypted_texts):
+        """Decrypts several values, e.g. every password field of a form. Raises ValueError if any is invalid."""
+
+        plaintexts = []
+        timings = []
+
+        try:
+            for encrypted_text in encrypted_texts:
+                start = perf_counter()
+                try:
+                    key, ciphertext = self._split(encrypted_text)
+                    plaintext = key.cipher.decrypt(b64decode(ciphertext), key.sentinel)
+                    if plaintext is key.sentinel:
+                        raise ValueError('Invalid padding.')
+                    plaintexts.append(plaintext.decode())
+                except (Base64Error, ValueError) as e:
+                    raise ValueError('Invalid ciphertext.') from e
+                finally:
+                    timings.append(perf_counter() - start)
+        finally:
+            self._record(timings, failures=len(timings) - len(plaintexts))
+
+        return plaintexts
+
+    def derive_key(self, encrypted_secret):
+        """
+        SHA-256 of a secret encrypted with one of the public keys. If the padding is invalid the key is derived
+        from the key's sentinel instead, without telling, so the result can't serve as a padding oracle
+        (Bleichenbacher's attack). Raises ValueError only for ciphertexts invalid regardless of the private key.
+        """
+
+        start = perf_counter()
+        derived = None
+        try:
+            key, ciphertext = self._split(encrypted_secret)
+            try:
+                ciphertext = b64decode(ciphertext, validate=True)
+            except Base64Error as e:
+                raise ValueError('Invalid ciphertext.') from e
+            derived = sha256(key.cipher.decrypt(ciphertext, key.sentinel)).digest()
+        finally:
+            self._record([perf_counter() - start], failures=int(derived is None))
+        return derived
 
     def public_key(self):
-        return self.keypair.public_key().export_key().decode()
+        return self.current.public_key
+
+    def public_keys(self):
+        """Ids and PEM encoded public keys of the accepted keys, the current one first."""
+
+        return [{'id': key.id, 'key': key.public_key} for key in self.keys.values()]
+
+    def metrics(self):
+        """Decryption timings of this process since it started."""
+
+        with self._lock:
+            return {
+                'decryptions': self._calls,
+                'failures': self._failures,
+                'total_seconds': self._seconds,
+                'average_seconds': self._seconds / self._calls if self._calls else 0.0,
+                'slowest_seconds': self._slowest,
+            }
+
+    def _split(self, encrypted_text):
+        """The key of a ciphertext and the ciphertext without its key id. Unprefixed ones use the current key."""
+
+        key_id, separator, ciphertext = encrypted_text.rpartition(':')
+        if not separator:
+            return self.current, ciphertext
+
+        if key_id not in self.keys and monotonic() - self._loaded_at > RELOAD_INTERVAL:
+            # the keys may have been rotated by another process
+            self.reload()
+        if key_id not in self.keys:
+            raise ValueError(f'Unknown key {key_id!r}.')
+        return self.keys[key_id], ciphertext
+
+    def _load(self):
+        current = Crypto.RSA_KEY
+        if not isfile(current):
+            # another process may be quicker, then its key is used
+            self._write(current, self._generate(), replace=False)
+
+        # before reading the files, a rotation meanwhile makes the next check reload
+        self._modified = self._modification_time()
+        keys = dict()
+        for path in (current, current + PREVIOUS_SUFFIX):
+            if isfile(path):
+                key = self._import(path)
+                keys.setdefault(key.id, key)
+        return keys
+
+    def _modification_time(self):
+        try:
+            return os.stat(Crypto.RSA_KEY).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _import(self, path):
+        passphrase = config('RSA_PASSPHRASE')
+        cache = join(Crypto.RSA_KEY_CACHE, basename(path) + '.json') if Crypto.RSA_KEY_CACHE else None
+
+        if cache and isfile(cache) and getmtime(cache) >= getmtime(path):
+            with open(cache) as file:
+                # written from an imported, thus verified key, so the costly consistency check is skipped
+                keypair = RSA.construct([int(number) for number in json.load(file)], consistency_check=False)
+        else:
+            with open(path) as file:
+                keypair = RSA.import_key(file.read(), passphrase=passphrase)
+            if cache:
+                os.makedirs(Crypto.RSA_KEY_CACHE, mode=0o700, exist_ok=True)
+                numbers = [str(getattr(keypair, name)) for name in ('n', 'e', 'd', 'p', 'q', 'u')]
+                self._write(cache, json.dumps(numbers).encode(), replace=True)
+
+        public_key = keypair.public_key()
+        return Key(
+            id=sha256(public_key.export_key(format='DER')).hexdigest()[:16],
+            keypair=keypair,
+            cipher=PKCS1_v1_5.new(keypair),
+            # returned by the cipher instead of raising on invalid padding, see PKCS1_v1_5.PKCS115_Cipher.decrypt
+            sentinel=get_random_bytes(keypair.size_in_bytes()),
+            public_key=public_key.export_key().decode(),
+        )
+
+    def _generate(self):
+        return RSA.generate(self.size).export_key(passphrase=config('RSA_PASSPHRASE'))
+
+    def _write(self, path, content, replace):
+        """Writes a key file atomically, readable by the owner only. Without replace an existing file is kept."""
+
+        descriptor, temporary = mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(content)
+            if replace:
+                os.replace(temporary, path)
+            else:
+                os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def _record(self, timings, failures):
+        with self._lock:
+            self._calls += len(timings)
+            self._failures += failures
+            self._seconds += sum(timings)
+            self._slowest = max(self._slowest, *timings, 0.0)
+
+
+crypto = Crypto(config('RSA_KEY_SIZE', default=2048, cast=int))
+
+
+def open_session(session, encrypted_key):
+    """
+    Stores the AES key encrypting the sensitive fields of this session, the SHA-256 of a secret the browser chose.
+
+    Parameters
+    ----------
+    session : SessionBase
+            The session of the request.
+    encrypted_key : str
+            The secret, encrypted with one of the public RSA keys. A secret which can't be decrypted gives a key
+            the browser doesn't know, so its fields fail to decrypt later, see Crypto.derive_key.
+
+    Returns
+    -------
+    str
+            Random id of the key, for the browser to tell whether the session still has its key. Unlike an id
+            derived from the key it tells nothing about the decrypted secret.
+    """
+
+    session[SESSION_KEY] = b64encode(crypto.derive_key(encrypted_key)).decode()
+    session[SESSION_KEY_ID] = token_hex(8)
+    return session[SESSION_KEY_ID]
+
+
+def session_key_id(session):
+    return session.get(SESSION_KEY_ID, '')
+
+
+def decrypt_fields(session, fields):
+    """
+    Decrypts the values of a dict of form fields. Values prefixed with ``FIELD_PREFIX`` are "aes:<nonce>:<ciphertext>"
+    encrypted with the session's AES key in GCM mode, with the field name as associated data so values can't be
+    swapped between fields. Other values are decrypted with RSA, in a single batch. Raises ValueError if any fails.
+    """
+
+    decrypted = dict()
+    session_key = session.get(SESSION_KEY)
+
+    for name, value in fields.items():
+        if not value.startswith(FIELD_PREFIX):
+            continue
+        if session_key is None:
+            raise ValueError('The session has no field key.')
 
+        try:
+            nonce, ciphertext = (b64decode(part, validate=True) for part in value[len(FIELD_PREFIX):].split(':'))
+            cipher = AES.new(b64decode(session_key), AES.MODE_GCM, nonce=nonce)
+            cipher.update(name.encode())
+            plaintext = cipher.decrypt_and_verify(ciphertext[:-GCM_TAG_SIZE], ciphertext[-GCM_TAG_SIZE:])
+            decrypted[name] = plaintext.decode()
+        except (Base64Error, ValueError) as e:
+            raise ValueError('Invalid ciphertext.') from e
 
-crypto = Crypto(2048)
+    remaining = [name for name in fields if name not in decrypted]
+    decrypted.update(zip(remaining, crypto.decrypt_many(fields[name] for name in remaining)))
+    return decrypted
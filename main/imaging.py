@@ -0,0 +1,133 @@
+"""
+Responsive variants of the card images.
+
+Every stored image is decoded once and re-encoded as WebP and JPEG at a few capped widths, the smallest of
+which doubles as the thumbnail. Variants are written to ``VARIANTS_DIR/<image name>/<width>.<extension>``
+by a background task, off the request thread. The directory only appears once all of its variants
+are complete, and since stored images are content-addressed it never changes afterwards.
+
+Requires Pillow. Without it images are served as uploaded.
+"""
+
+import os
+import shutil
+from functools import lru_cache
+from tempfile import mkdtemp
+from .storage import image_storage
+from .tasks import task
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+VARIANTS_DIR = 'variants'
+WIDTHS = (128, 320, 640, 1280)  # pixels, smaller originals aren't scaled up
+QUALITY = 80
+
+# extension: Pillow format
+FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+
+
+def available():
+    return Image is not None
+
+
+def variants_path(name):
+    return image_storage.path(os.path.join(VARIANTS_DIR, os.path.basename(name)))
+
+
+@task
+def process(name):
+    """
+    Creates every variant of a stored image, unless they already exist.
+
+    Parameters
+    ----------
+    name : str
+            Name of the image in the image storage.
+
+    Returns
+    -------
+    bool
+            Whether variants were created.
+    """
+
+    destination = variants_path(name)
+    if not available() or os.path.isdir(destination):
+        return False
+
+    parent = os.path.dirname(destination)
+    os.makedirs(parent, exist_ok=True)
+    temporary = mkdtemp(dir=parent, prefix='.variants-')
+
+    try:
+        with Image.open(image_storage.path(name)) as original:
+            # lets the JPEG decoder downscale while decoding, when the original is much larger
+            original.draft('RGB', (WIDTHS[-1], WIDTHS[-1]))
+            image = ImageOps.exif_transpose(original)
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        # largest first, every smaller variant is resized from the previous one
+        saved = set()
+        for width in reversed(WIDTHS):
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            if image.width not in saved:
+                _save_variant(image, os.path.join(temporary, str(image.width)))
+                saved.add(image.width)
+
+        os.replace(temporary, destination)
+        return True
+    except (OSError, Image.DecompressionBombError):
+        # not an image Pillow can read, it's served as uploaded
+        return False
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def _save_variant(image, path):
+    for extension, image_format in FORMATS.items():
+        # JPEG has no alpha channel, transparent areas become white
+        if image_format == 'JPEG' and image.mode == 'RGBA':
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            variant = background
+        else:
+            variant = image
+
+        variant.save(f'{path}.{extension}', image_format, quality=QUALITY, optimize=True, progressive=True)
+
+
+def submit(name):
+    """Queues an image for processing by the task workers."""
+
+    if available():
+        process.delay(name)
+
+
+def remove(name):
+    shutil.rmtree(variants_path(name), ignore_errors=True)
+
+
+@lru_cache(maxsize=4096)
+def _widths(name):
+    # exceptions aren't cached, so images still being processed are looked up again next time
+    entries = os.listdir(variants_path(name))
+    return tuple(sorted({int(entry.split('.')[0]) for entry in entries}))
+
+
+def widths(name):
+    """Widths of the finished variants of an image, empty if there are none (yet)."""
+
+    try:
+        return _widths(os.path.basename(name))
+    except (FileNotFoundError, ValueError):
+        return ()
+
+
+def url(name, width, extension):
+    return image_storage.url(f'{VARIANTS_DIR}/{os.path.basename(name)}/{width}.{extension}')
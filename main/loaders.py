@@ -0,0 +1,40 @@
+"""
+Request-scoped identity map of decks.
+
+The views and helpers handling a request often need the same deck, e.g. a study view and the base class
+rendering its navigation. ``deck`` fetches each deck once per request and hands the same instance to
+every later caller, instead of each of them querying it again.
+"""
+
+from uuid import UUID
+from .models import Deck
+
+# what the study pages show of a deck, besides its cards
+STUDY_FIELDS = ('pk', 'user', 'uuid', 'name', 'version', 'last_modified')
+
+
+def deck(request, uuid, *fields):
+    """
+    Parameters
+    ----------
+    request : HttpRequest
+            The request the deck is cached on.
+    uuid : str or UUID
+            The deck to fetch. Raises Deck.DoesNotExist if there is none.
+    *fields :
+            Only fetch these fields, the others are loaded on first access. Applies to the first fetch only.
+
+    Returns
+    -------
+    Deck
+            The same instance for every call of the request.
+    """
+
+    decks = request.__dict__.setdefault('_decks', dict())
+    key = UUID(str(uuid))
+
+    if key not in decks:
+        queryset = Deck.objects.only(*fields) if fields else Deck.objects.all()
+        decks[key] = queryset.get(uuid=key)
+
+    return decks[key]
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db.transaction import atomic
+from django.utils.translation import gettext as _
+from .models import User
+from .tasks import task
+from .utils import random_string
+
+
+@task
+def send_new_password(user_id):
+    """
+    Refreshes the user's password and mails them the new one. A retry after a failed delivery refreshes the
+    password again, so the only password that works is always the one in the last mail.
+    """
+
+    with atomic():
+        user = User.objects.select_for_update().get(pk=user_id)
+        new_password = random_string(32)
+        user.set_password(new_password)
+        user.save()
+
+    # inform user about the changes, after the row lock has been released
+    send_mail(
+        'Password Recovery',
+        _('Dear %s!\nWe\'ve refreshed your password.\nYou can login with: %s\n\nSincerely\nQuizcards Support')
+        % (user.username, new_password),   # format string
+        from_email=settings.EMAIL_HOST_USER,
+        recipient_list=[user.email],
+    )
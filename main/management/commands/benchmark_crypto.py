@@ -0,0 +1,59 @@
+from Crypto.Cipher import AES, PKCS1_v1_5
+from Crypto.Random import get_random_bytes
+from base64 import b64decode, b64encode
+from django.core.management.base import BaseCommand
+from timeit import repeat
+from main.crypto import FIELD_PREFIX, SESSION_KEY, crypto, decrypt_fields
+
+
+class Command(BaseCommand):
+    help = 'Compares decrypting password fields with RSA, per call and shared ciphers, and with a session AES key.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fields', type=int, default=2, help='Password fields per form.')
+        parser.add_argument('--forms', type=int, default=200, help='Forms decrypted per run.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement, the best one counts.')
+
+    def handle(self, *args, **options):
+        fields, forms, runs = options['fields'], options['forms'], options['repeat']
+        encrypt = PKCS1_v1_5.new(crypto.keypair.public_key())
+        form = [b64encode(encrypt.encrypt(f'password {i}'.encode())).decode() for i in range(fields)]
+
+        # the same form, encrypted like the browser does with a session key
+        key = get_random_bytes(32)
+        session = {SESSION_KEY: b64encode(key).decode()}
+        aes_form = dict()
+        for i in range(fields):
+            nonce = get_random_bytes(12)
+            cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+            cipher.update(f'password{i}'.encode())
+            ciphertext, tag = cipher.encrypt_and_digest(f'password {i}'.encode())
+            aes_form[f'password{i}'] = f'{FIELD_PREFIX}{b64encode(nonce).decode()}:{b64encode(ciphertext + tag).decode()}'
+
+        def per_call():
+            # what every decryption used to cost
+            for value in form:
+                cipher = PKCS1_v1_5.new(crypto.keypair)
+                sentinel = get_random_bytes(crypto.keypair.size_in_bytes())
+                cipher.decrypt(b64decode(value), sentinel).decode()
+
+        measurements = (
+            ('new cipher per field', lambda: [per_call() for _ in range(forms)]),
+            ('shared cipher, per field', lambda: [[crypto.decrypt(value) for value in form] for _ in range(forms)]),
+            ('shared cipher, batched', lambda: [crypto.decrypt_many(form) for _ in range(forms)]),
+            ('session AES key', lambda: [decrypt_fields(session, aes_form) for _ in range(forms)]),
+        )
+
+        self.stdout.write(f'{forms} forms with {fields} password fields, best of {runs} runs')
+        baseline = None
+
+        for name, function in measurements:
+            best = min(repeat(function, number=1, repeat=runs))
+            baseline = baseline or best
+            self.stdout.write(f'{name:<32}{forms / best:>10.0f} forms/s{baseline / best:>8.2f}x')
+
+        metrics = crypto.metrics()
+        self.stdout.write(
+            f'{metrics["decryptions"]} decryptions, {metrics["average_seconds"] * 1000:.3f} ms on average, '
+            f'{metrics["slowest_seconds"] * 1000:.3f} ms at worst'
+        )
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+from django.core.management.base import BaseCommand
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter, sleep
+from main.backends.sqlite3.base import PRAGMAS
+
+SCHEMA = (
+    'CREATE TABLE deck (id INTEGER PRIMARY KEY, name TEXT, last_modified INTEGER, version INTEGER)',
+    'CREATE TABLE card (id INTEGER PRIMARY KEY, deck_id INTEGER, term TEXT, definition TEXT, position INTEGER)',
+    'CREATE INDEX card_deck ON card (deck_id, position)',
+    'CREATE INDEX deck_listing ON deck (last_modified)',
+)
+
+
+class Command(BaseCommand):
+    help = 'Measures read and write throughput of SQLite under mixed load, with the default and the tuned settings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='Threads reading deck listings and decks.')
+        parser.add_argument('--writers', type=int, default=2, help='Threads saving decks like the editor does.')
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each measurement.')
+        parser.add_argument('--decks', type=int, default=500, help='Size of the synthetic database.')
+        parser.add_argument('--cards', type=int, default=50, help='Cards per deck.')
+
+    def handle(self, *args, **options):
+        directory = mkdtemp(prefix='benchmark-database-')
+        configurations = (
+            # what Django's own backend does: a rollback journal, deferred transactions and a 5 second busy timeout
+            ('default', dict(), 'BEGIN', 5),
+            ('tuned', PRAGMAS, 'BEGIN IMMEDIATE', 20),
+        )
+
+        self.stdout.write(
+            f'{options["readers"]} readers, {options["writers"]} writers, {options["seconds"]} s each, '
+            f'{options["decks"]} decks of {options["cards"]} cards'
+        )
+
+        for name, pragmas, begin, timeout in configurations:
+            path = os.path.join(directory, f'{name}.sqlite3')
+            self.populate(path, options['decks'], options['cards'])
+            result = self.measure(path, pragmas, begin, timeout, options)
+            self.stdout.write(
+                f'{name:<10}{result["reads"] / options["seconds"]:>10.0f} reads/s'
+                f'{result["writes"] / options["seconds"]:>10.0f} writes/s'
+                f'{result["slowest_read"] * 1000:>10.1f} ms slowest read'
+                f'{result["failed_reads"]:>8} failed reads{result["failed_writes"]:>8} failed writes'
+            )
+
+        for entry in os.listdir(directory):
+            os.remove(os.path.join(directory, entry))
+        os.rmdir(directory)
+
+    def populate(self, path, decks, cards):
+        connection = sqlite3.connect(path)
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.executemany('INSERT INTO deck VALUES (?, ?, ?, 0)', ((i, f'deck {i}', i) for i in range(decks)))
+            connection.executemany(
+                'INSERT INTO card (deck_id, term, definition, position) VALUES (?, ?, ?, ?)',
+                ((deck, f'term {i}', f'definition {i}', i) for deck in range(decks) for i in range(cards))
+            )
+        connection.close()
+
+    def measure(self, path, pragmas, begin, timeout, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        result = {'reads': 0, 'writes': 0, 'failed_reads': 0, 'failed_writes': 0, 'slowest_read': 0.0}
+
+        def connect():
+            connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+            for pragma, value in pragmas.items():
+                connection.execute(f'PRAGMA {pragma} = {value}')
+            return connection
+
+        def read(seed):
+            connection, rng = connect(), Random(seed)
+            while not stop.is_set():
+                start = perf_counter()
+                try:
+                    # a listing page, then a deck to study
+                    connection.execute('SELECT * FROM deck ORDER BY last_modified DESC LIMIT 10').fetchall()
+                    deck = rng.randrange(options['decks'])
+                    connection.execute('SELECT * FROM card WHERE deck_id = ? ORDER BY position', [deck]).fetchall()
+                    outcome, elapsed = 'reads', perf_counter() - start
+                except sqlite3.OperationalError:
+                    outcome, elapsed = 'failed_reads', 0.0
+                with lock:
+                    result[outcome] += 1
+                    result['slowest_read'] = max(result['slowest_read'], elapsed)
+            connection.close()
+
+        def write(seed):
+            connection, rng = connect(), Random(seed)
+            while not stop.is_set():
+                deck = rng.randrange(options['decks'])
+                try:
+                    # like EditorView.update_deck, the deck is read in the transaction before it's written
+                    connection.execute(begin)
+                    connection.execute('SELECT version FROM deck WHERE id = ?', [deck]).fetchone()
+                    connection.execute(
+                        'UPDATE deck SET version = version + 1, last_modified = last_modified + 1 WHERE id = ?', [deck]
+                    )
+                    connection.execute('DELETE FROM card WHERE deck_id = ? AND position = 0', [deck])
+                    connection.execute(
+                        'INSERT INTO card (deck_id, term, definition, position) VALUES (?, ?, ?, 0)',
+                        [deck, 'term', 'definition']
+                    )
+                    connection.execute('COMMIT')
+                    outcome = 'writes'
+                except sqlite3.OperationalError:
+                    if connection.in_transaction:
+                        connection.execute('ROLLBACK')
+                    outcome = 'failed_writes'
+                with lock:
+                    result[outcome] += 1
+            connection.close()
+
+        threads = [threading.Thread(target=read, args=(i, )) for i in range(options['readers'])]
+        threads += [threading.Thread(target=write, args=(-i - 1, )) for i in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return result
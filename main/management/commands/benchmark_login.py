@@ -0,0 +1,97 @@
+import tracemalloc
+from copy import copy
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from base64 import b64encode
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+from django.test import RequestFactory
+from time import perf_counter
+from urllib.parse import urlencode
+from main.crypto import FIELD_PREFIX, SESSION_KEY, decrypt_fields
+from main.utils import decrypt_post
+
+
+class Command(BaseCommand):
+    help = 'Compares ways of decrypting the POST data of the login form: a query string, a copy or in place.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forms', type=int, default=10000, help='Forms decrypted per run.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement, the best one counts.')
+
+    def handle(self, *args, **options):
+        forms, runs = options['forms'], options['repeat']
+        password = 'p&ss=w+rd 1'
+
+        # the login form as the browser sends it, encrypted with a session key so decryption doesn't dominate
+        key = get_random_bytes(32)
+        nonce = get_random_bytes(12)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(b'password')
+        ciphertext, tag = cipher.encrypt_and_digest(password.encode())
+
+        template = RequestFactory().post('/login/', urlencode({
+            'csrfmiddlewaretoken': 'x' * 64,
+            'username': 'username',
+            'password': f'{FIELD_PREFIX}{b64encode(nonce).decode()}:{b64encode(ciphertext + tag).decode()}',
+        }), content_type='application/x-www-form-urlencoded')
+        session = {SESSION_KEY: b64encode(key).decode()}
+
+        def login_requests():
+            """Requests with their POST data parsed, like by the CSRF middleware before the view runs."""
+
+            requests = []
+            for _ in range(forms):
+                request = copy(template)
+                request.POST = QueryDict(template.body)
+                request.session = session
+                requests.append(request)
+            return requests
+
+        def round_trip(request):
+            # what utils.sensitive used to do
+            post = dict(request.POST.items())
+            keys = [key for key in post.keys() if 'password' in key]
+            post.update(decrypt_fields(request.session, {key: post[key] for key in keys}))
+            return QueryDict('&'.join(map(lambda pair: '='.join(pair), post.items())))
+
+        def copied(request):
+            # what utils.decrypt_post did at first
+            post = copy(request.POST)
+            encrypted = {key: post[key] for key in post if 'password' in key}
+            for key, value in decrypt_fields(request.session, encrypted).items():
+                post[key] = value
+            post._mutable = False
+            return post
+
+        measurements = (
+            ('query string round trip', round_trip),
+            ('copied QueryDict', copied),
+            ('decrypted in place', decrypt_post),
+        )
+
+        self.stdout.write(f'{forms} login forms, best of {runs} runs, bytes allocated per form')
+        baseline = None
+
+        for name, function in measurements:
+            best = float('inf')
+            for _ in range(runs):
+                requests = login_requests()
+                start = perf_counter()
+                for request in requests:
+                    function(request)
+                best = min(best, perf_counter() - start)
+            baseline = baseline or best
+
+            # the memory still held by the decrypted forms, e.g. until their requests are finished
+            requests = login_requests()
+            tracemalloc.start()
+            posts = [function(request) for request in requests]
+            allocated = tracemalloc.get_traced_memory()[0] // forms
+            tracemalloc.stop()
+
+            correct = posts[0]['password'] == password
+            self.stdout.write(
+                f'{name:<28}{forms / best:>10.0f} forms/s{baseline / best:>8.2f}x{allocated:>8} B/form'
+                f'{"" if correct else "  corrupted the password"}'
+            )
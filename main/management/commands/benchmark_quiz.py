@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from timeit import repeat
+from main import testgen
+
+
+class Command(BaseCommand):
+    help = 'Compares the pure Python and the numpy quiz generators on a synthetic deck.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=20000, help='Size of the synthetic deck.')
+        parser.add_argument('--rendered', type=int, default=20, help='Questions materialized per quiz page.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement, the best one counts.')
+
+    def handle(self, *args, **options):
+        if testgen.numpy is None:
+            raise CommandError('numpy is not installed.')
+
+        size, rendered, runs = options['cards'], options['rendered'], options['repeat']
+        deck = testgen.CompiledDeck(
+            pks=tuple(range(size)),
+            term=tuple(f'term {i}' for i in range(size)),
+            term_image=('', ) * size,
+            definition=tuple(f'definition {i}' for i in range(size)),
+            definition_image=('', ) * size,
+        )
+
+        measurements = (
+            ('python, whole quiz', lambda: list(testgen.Questions(deck, 'term'))),
+            (f'python, first {rendered} questions', lambda: testgen.Questions(deck, 'term')[:rendered]),
+            ('numpy, draw only', lambda: testgen.QuestionBatch(deck, 'term')),
+            (f'numpy, first {rendered} questions', lambda: testgen.QuestionBatch(deck, 'term')[:rendered]),
+            ('numpy, whole quiz', lambda: list(testgen.QuestionBatch(deck, 'term'))),
+        )
+
+        self.stdout.write(f'{size} cards, best of {runs} runs')
+        baseline = None
+
+        for name, function in measurements:
+            best = min(repeat(function, number=1, repeat=runs))
+            baseline = baseline or best
+            self.stdout.write(f'{name:<32}{best * 1000:>10.2f} ms{baseline / best:>8.1f}x')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from main import caching
+
+
+class Command(BaseCommand):
+    help = 'Shows the hits and misses of the fragment and page caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after showing them.')
+
+    def handle(self, *args, **options):
+        for namespace, counters in caching.stats().items():
+            total = counters['hits'] + counters['misses']
+            ratio = counters['hits'] / total if total else 0.0
+            self.stdout.write(f'{namespace:<12}{counters["hits"]:>10} hits{counters["misses"]:>10} misses{ratio:>8.1%}')
+
+        if options['reset']:
+            caching.reset_stats()
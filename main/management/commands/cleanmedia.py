@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from main import cleaner, storage, uploads
+
+
+class Command(BaseCommand):
+    help = 'Removes uploaded images which no longer belong to any card.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed.')
+        parser.add_argument(
+            '--grace-period', type=int, default=cleaner.GRACE_PERIOD,
+            help='Keep files modified within this many seconds (default: %(default)s).'
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Scan every file in MEDIA_ROOT instead of the unreferenced images only, e.g. for legacy uploads.'
+        )
+        parser.add_argument('--recount', action='store_true', help='Rebuild the image reference counts first.')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            storage.recount()
+
+        cleanup = cleaner.file_cleanup if options['full'] else cleaner.collect_unreferenced
+        report = cleanup(options['dry_run'], options['grace_period'])
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+
+        if not options['dry_run']:
+            self.stdout.write(f'Removed {uploads.remove_stale()} stale chunked uploads.')
+
+        self.stdout.write(
+            f'Scanned {report.scanned} images. {verb} {report.removed}, reclaiming {report.bytes_reclaimed} bytes. '
+            f'Kept {report.recent} unreferenced images still within the grace period.'
+        )
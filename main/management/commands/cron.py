@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from main import cron
+from main.models import JobRun, Schedule
+
+
+class Command(BaseCommand):
+    help = 'Lists the scheduled jobs with their next and recent runs, or queues a run of one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', metavar='NAME', help='Queue a run of the schedule now.')
+        parser.add_argument('--history', type=int, default=5, help='Recent runs shown per schedule.')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            try:
+                cron.run_now(options['run'])
+            except LookupError as e:
+                raise CommandError(e)
+            self.stdout.write(f'Queued a run of {options["run"]}.')
+            return
+
+        cron.sync()
+
+        for schedule in Schedule.objects.filter(name__in=cron.SCHEDULES.keys()).order_by('name'):
+            next_run = timezone.localtime(schedule.next_run)
+            self.stdout.write(f'{schedule.name} ({schedule.expression}), next run at {next_run:%Y-%m-%d %H:%M}')
+
+            runs = JobRun.objects.filter(schedule=schedule).order_by('-started')[:options['history']]
+            for run in runs:
+                if run.finished is None:
+                    outcome = 'running'
+                elif run.error:
+                    outcome = 'failed: ' + run.error.strip().splitlines()[-1]
+                else:
+                    outcome = f'succeeded in {(run.finished - run.started).total_seconds():.1f} s'
+                self.stdout.write(f'    {timezone.localtime(run.started):%Y-%m-%d %H:%M} {outcome}')
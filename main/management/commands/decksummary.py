@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from main import summaries
+
+
+class Command(BaseCommand):
+    help = 'Fills in the card counts, previews and image sizes shown in the deck listings, or verifies them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report the decks out of sync, and exit with an error if there are any.'
+        )
+
+    def handle(self, *args, **options):
+        stale = summaries.verify(fix=not options['verify'])
+
+        if options['verify'] and stale:
+            raise CommandError(f'{len(stale)} decks are out of sync: {", ".join(map(str, stale))}.')
+
+        verb = 'Found' if options['verify'] else 'Updated'
+        self.stdout.write(f'{verb} {len(stale)} decks out of sync.')
@@ -0,0 +1,27 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from main import imaging
+
+
+class Command(BaseCommand):
+    help = 'Creates the missing responsive variants of the stored images, e.g. of images uploaded before.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Images processed in parallel.')
+
+    def handle(self, *args, **options):
+        if not imaging.available():
+            raise CommandError('Pillow is not installed.')
+
+        try:
+            with os.scandir(settings.MEDIA_ROOT) as entries:
+                names = [entry.name for entry in entries if entry.is_file() and not entry.name.startswith('.')]
+        except FileNotFoundError:
+            names = []
+
+        with ThreadPoolExecutor(options['workers']) as executor:
+            processed = sum(executor.map(imaging.process, names))
+
+        self.stdout.write(f'Processed {processed} of {len(names)} images.')
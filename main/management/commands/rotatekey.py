@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from main.crypto import crypto
+
+
+class Command(BaseCommand):
+    help = (
+        'Replaces the RSA key encrypting sensitive form fields with a new one. The previous key stays valid '
+        'until the next rotation. Running processes pick up the new key when the first form encrypted with it arrives.'
+    )
+
+    def handle(self, *args, **options):
+        crypto.rotate()
+        for key, role in zip(crypto.public_keys(), ('current', 'previous')):
+            self.stdout.write(f'{role} key: {key["id"]}')
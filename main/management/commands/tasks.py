@@ -0,0 +1,53 @@
+import threading
+from django.core.management.base import BaseCommand
+from main import tasks
+
+
+class Command(BaseCommand):
+    help = 'Runs background task workers, or shows the depth of the task queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('work', 'status', 'retry'), help=(
+            'work: run workers until interrupted, '
+            'status: show the queued tasks by state, '
+            'retry: queue the failed tasks again.'
+        ))
+        parser.add_argument('--workers', type=int, default=2, help='Worker threads to run (default: %(default)s).')
+        parser.add_argument('--burst', action='store_true', help='Stop the workers once the queue is empty.')
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])(options)
+
+    def work(self, options):
+        stop = threading.Event()
+        counts = [0] * options['workers']
+
+        def worker(index):
+            counts[index] = tasks.work(stop, burst=options['burst'])
+
+        threads = [threading.Thread(target=worker, args=(index, )) for index in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # running tasks are finished first
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(f'Ran {sum(counts)} tasks.')
+
+    def status(self, options):
+        rows = list(tasks.depth())
+        columns = ('due', 'scheduled', 'running', 'failed')
+
+        self.stdout.write(f'{"task":<48}' + ''.join(f'{column:>10}' for column in columns))
+        for row in rows:
+            self.stdout.write(f'{row["name"]:<48}' + ''.join(f'{row[column]:>10}' for column in columns))
+        self.stdout.write(f'{"total":<48}' + ''.join(f'{sum(row[c] for row in rows):>10}' for c in columns))
+
+    def retry(self, options):
+        self.stdout.write(f'Queued {tasks.retry_failed()} failed tasks again.')
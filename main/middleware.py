@@ -0,0 +1,43 @@
+import logging
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_QUERIES_HEADER = 'X-Duplicate-Queries'
+
+
+class DuplicateQueryMiddleware:
+    """
+    Flags the requests which run the same query with the same parameters more than once, which is
+    usually a model fetched again instead of passed along, or a query per row of a listing. Every
+    repeated query is logged as a warning, and the response tells their number in a header.
+    Only enabled with DEBUG.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        executed = Counter()
+
+        def count(execute, sql, params, many, context):
+            executed[context['connection'].alias, sql, repr(params)] += 1
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count))
+            response = self.get_response(request)
+
+        duplicates = {query: times for query, times in executed.items() if times > 1}
+        for (alias, sql, params), times in duplicates.items():
+            logger.warning('%s %s ran %d times on %r: %s %s', request.method, request.path, times, alias, sql, params)
+
+        response[DUPLICATE_QUERIES_HEADER] = sum(duplicates.values()) - len(duplicates)
+        return response
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import main.models
+
+
+def install(apps, schema_editor):
+    from main import search
+    search.install(schema_editor.connection, ['main_deck_fts'])
+
+
+def uninstall(apps, schema_editor):
+    from main import search
+    search.uninstall(schema_editor.connection, ['main_deck_fts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeckIndex',
+            fields=[
+                ('deck', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='main.deck')),
+                ('document', main.models.SearchField(db_column='main_deck_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'main_deck_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
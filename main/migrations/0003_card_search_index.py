@@ -0,0 +1,36 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import main.models
+
+
+def install(apps, schema_editor):
+    from main import search
+    search.install(schema_editor.connection, ['main_card_fts'])
+
+
+def uninstall(apps, schema_editor):
+    from main import search
+    search.uninstall(schema_editor.connection, ['main_card_fts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_deck_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardIndex',
+            fields=[
+                ('card', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='main.card')),
+                ('document', main.models.SearchField(db_column='main_card_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'main_card_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_deck_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='card',
+            options={'ordering': ['position', 'pk']},
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+import django.utils.timezone
+import main.models
+import main.storage
+
+
+def install(apps, schema_editor):
+    from main import storage
+    storage.install(schema_editor.connection)
+    # count the images of existing cards
+    storage.recount(apps, schema_editor.connection.alias)
+
+
+def uninstall(apps, schema_editor):
+    from main import storage
+    storage.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_review'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('name', models.CharField(max_length=128, primary_key=True, serialize=False)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='definition_image',
+            field=main.models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='term_image',
+            field=main.models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AddIndex(
+            model_name='storedimage',
+            index=models.Index(condition=models.Q(('refcount', 0)), fields=['created'], name='unreferenced_images'),
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+import main.models
+import main.storage
+
+
+def backfill(apps, schema_editor):
+    """Card counts and previews of the existing decks. The image sizes are summed up by 0013_storedimage_size."""
+
+    from django.db.models import Count, OuterRef, Subquery, Value
+    from django.db.models.functions import Coalesce, NullIf
+
+    Card = apps.get_model('main', 'Card')
+    Deck = apps.get_model('main', 'Deck')
+    alias = schema_editor.connection.alias
+
+    cards = Card.objects.using(alias).filter(deck=OuterRef('pk'))
+    first = cards.order_by('position', 'pk')
+    Deck.objects.using(alias).update(
+        card_count=Coalesce(Subquery(cards.order_by().values('deck').annotate(count=Count('pk')).values('count')), 0),
+        preview_term=Coalesce(Subquery(first.values('term')[:1]), Value('')),
+        preview_image=NullIf(Subquery(first.values('term_image')[:1]), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='card_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='image_bytes',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='preview_image',
+            field=main.models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='preview_term',
+            field=models.CharField(blank=True, default='', max_length=512),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_deck_summary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deck',
+            name='uuid',
+            field=models.UUIDField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['deck', 'position'], name='main_card_deck_id_77340f_idx'),
+        ),
+    ]
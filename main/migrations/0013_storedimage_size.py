@@ -0,0 +1,60 @@
+from django.db import migrations, models
+
+
+def install(apps, schema_editor):
+    from main import storage
+    storage.install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from main import storage
+    # the triggers on the card table refer to the image table, which is rebuilt to add the column
+    storage.uninstall(schema_editor.connection)
+
+
+def backfill(apps, schema_editor):
+    from main.storage import image_storage
+
+    StoredImage = apps.get_model('main', 'StoredImage')
+    images = StoredImage.objects.using(schema_editor.connection.alias)
+    for image in images.filter(size=None).iterator():
+        if image_storage.exists(image.name):
+            images.filter(pk=image.pk).update(size=image_storage.size(image.name))
+
+
+def summarize(apps, schema_editor):
+    """Image sizes of the existing decks, from the stored sizes like summaries.compute."""
+
+    from django.db.models import Q, Sum
+
+    Card = apps.get_model('main', 'Card')
+    Deck = apps.get_model('main', 'Deck')
+    StoredImage = apps.get_model('main', 'StoredImage')
+    alias = schema_editor.connection.alias
+
+    for pk in list(Deck.objects.using(alias).values_list('pk', flat=True)):
+        cards = Card.objects.using(alias).filter(deck_id=pk).order_by()
+        images = StoredImage.objects.using(alias).filter(
+            Q(name__in=cards.values('term_image')) | Q(name__in=cards.values('definition_image'))
+        )
+        size = images.aggregate(size=Sum('size'))['size'] or 0
+        Deck.objects.using(alias).filter(pk=pk).update(image_bytes=size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_deck_uuid_card_position'),
+    ]
+
+    operations = [
+        migrations.RunPython(uninstall, install),
+        migrations.AddField(
+            model_name='storedimage',
+            name='size',
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.RunPython(summarize, migrations.RunPython.noop),
+        migrations.RunPython(install, uninstall),
+    ]
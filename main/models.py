@@ -1,7 +1,8 @@
-from django.conf import settings
 from django.db.models import *
 from django.db.models.fields.files import FieldFile
+from django.utils import timezone
 from os.path import basename, join
+from .storage import image_storage
 
 # used as default user model
 from django.contrib.auth.models import User
@@ -21,18 +22,175 @@ class ImageField(FileField):
     attr_class = FieldImage
 
 
+class SearchField(TextField):
+    """
+    The hidden column of an FTS5 virtual table, which shares its name with the table.
+    Used as the left-hand side of the ``match`` lookup.
+    """
+
+
+@SearchField.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
 class Deck(Model):
     user = ForeignKey(User, on_delete=SET_NULL, null=True)
     name = CharField(max_length=SHORT_LENGTH)
     description = CharField(max_length=LONG_LENGTH, null=True, default='')
-    uuid = UUIDField()
+    uuid = UUIDField(unique=True)   # decks are looked up by it when shared, edited or studied
     date_created = DateField()
     last_modified = DateField()
+    version = PositiveIntegerField(default=0)   # bumped on every save, for optimistic concurrency in the editor
+
+    # denormalized for the deck listings, kept up to date by the editor, see summaries.py
+    card_count = PositiveIntegerField(default=0)
+    preview_term = CharField(max_length=LONG_LENGTH, blank=True, default='')
+    preview_image = ImageField(storage=image_storage, null=True, blank=True)
+    image_bytes = PositiveBigIntegerField(default=0)    # of the distinct images of the cards
+
+    class Meta:
+        indexes = [
+            # keyset pagination of deck listings, see paging.py
+            Index(fields=['user', 'last_modified']),
+            Index(fields=['last_modified']),
+        ]
 
 
 class Card(Model):
     deck = ForeignKey(Deck, on_delete=CASCADE)
     term = CharField(max_length=LONG_LENGTH)
-    term_image = ImageField(upload_to=settings.MEDIA_ROOT, null=True, blank=True)
+    term_image = ImageField(storage=image_storage, null=True, blank=True)
     definition = CharField(max_length=LONG_LENGTH)
-    definition_image = ImageField(upload_to=settings.MEDIA_ROOT, null=True, blank=True)
+    definition_image = ImageField(storage=image_storage, null=True, blank=True)
+    position = PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['position', 'pk']
+        indexes = [
+            # the cards of a deck are read in editor order
+            Index(fields=['deck', 'position']),
+        ]
+
+
+class StoredImage(Model):
+    """Number of card references to a stored image file. Maintained by triggers, see ``storage.install``."""
+
+    name = CharField(max_length=SHORT_LENGTH, primary_key=True)
+    refcount = PositiveIntegerField(default=0)
+    created = DateTimeField(default=timezone.now)
+    size = PositiveBigIntegerField(null=True)   # bytes, unknown for a file referenced before it was stored
+
+    class Meta:
+        indexes = [
+            # garbage collection only looks at unreferenced images
+            Index(fields=['created'], name='unreferenced_images', condition=Q(refcount=0)),
+        ]
+
+
+class Upload(Model):
+    """An image uploaded in chunks by the editor, see uploads.py."""
+
+    user = ForeignKey(User, on_delete=CASCADE)
+    uuid = UUIDField(unique=True)
+    name = CharField(max_length=SHORT_LENGTH)   # as uploaded, the extension is kept
+    size = PositiveIntegerField()
+    image = CharField(max_length=SHORT_LENGTH, blank=True, default='')  # stored image, once complete
+    created = DateTimeField(default=timezone.now)
+
+
+class Task(Model):
+    """A queued function call, see tasks.py."""
+
+    PENDING = 'pending'
+    FAILED = 'failed'
+
+    name = CharField(max_length=SHORT_LENGTH)
+    arguments = TextField()     # JSON
+    status = CharField(max_length=16, default=PENDING)
+    run_at = DateTimeField()
+    locked_until = DateTimeField(null=True)
+    attempts = PositiveIntegerField(default=0)
+    error = TextField(blank=True, default='')
+    created = DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # workers look for the earliest due pending tasks
+            Index(fields=['status', 'run_at']),
+        ]
+
+
+class Schedule(Model):
+    """A recurring job, see cron.py. Its row is the lock deciding which process queues the next run."""
+
+    name = CharField(max_length=SHORT_LENGTH, primary_key=True)
+    expression = CharField(max_length=SHORT_LENGTH)
+    next_run = DateTimeField()
+
+
+class JobRun(Model):
+    """Run history of the scheduled jobs."""
+
+    schedule = ForeignKey(Schedule, on_delete=CASCADE)
+    scheduled_for = DateTimeField()
+    started = DateTimeField(default=timezone.now)
+    finished = DateTimeField(null=True)
+    error = TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            # each occurrence runs once, even if its task is delivered twice
+            UniqueConstraint(fields=['schedule', 'scheduled_for'], name='unique_job_run'),
+        ]
+
+
+class Review(Model):
+    """Spaced repetition state of a card for a user, see scheduler.py."""
+
+    user = ForeignKey(User, on_delete=CASCADE)
+    card = ForeignKey(Card, on_delete=CASCADE)
+    due_at = DateTimeField()
+    interval = FloatField(default=0)    # days
+    ease = FloatField(default=2.5)
+    repetitions = PositiveIntegerField(default=0)
+    lapses = PositiveIntegerField(default=0)
+    last_reviewed = DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'card'], name='unique_review'),
+        ]
+        indexes = [
+            # the due queue of a user is a range scan on this index
+            Index(fields=['user', 'due_at']),
+        ]
+
+
+class DeckIndex(Model):
+    """Full-text index of deck names and descriptions. The table is maintained by triggers, see ``search.install``."""
+
+    deck = OneToOneField(Deck, on_delete=DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_index')
+    document = SearchField(db_column='main_deck_fts')
+    rank = FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'main_deck_fts'
+
+
+class CardIndex(Model):
+    """Full-text index of card terms and definitions. The table is maintained by triggers, see ``search.install``."""
+
+    card = OneToOneField(Card, on_delete=DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_index')
+    document = SearchField(db_column='main_card_fts')
+    rank = FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'main_card_fts'
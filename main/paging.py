@@ -0,0 +1,124 @@
+"""
+Keyset (cursor) pagination for deck listings.
+
+Pages are ordered by ``(last_modified, id)`` descending. Instead of a page number, each page links to
+its neighbours with an opaque cursor holding the sort key of the first or last deck on the page, so
+fetching a page is a single indexed range scan however deep the user goes. The interface mirrors
+Django's ``Paginator`` and ``Page`` closely enough for the existing templates to work unchanged.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+from hashlib import md5
+from django.core.cache import cache
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+
+FIRST_PAGE = '1'
+COUNT_CACHE_TIMEOUT = 60    # seconds
+
+_NEXT = 'n'
+_PREVIOUS = 'p'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def encode_cursor(direction, deck):
+    raw = f'{direction}{deck.last_modified.isoformat()}.{deck.pk}'
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direction, key = raw[0], raw[1:]
+        last_modified, pk = key.split('.')
+        if direction not in (_NEXT, _PREVIOUS):
+            raise ValueError(direction)
+        return direction, date.fromisoformat(last_modified), int(pk)
+    except (ValueError, IndexError, UnicodeDecodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+class KeysetPage:
+    def __init__(self, object_list, previous_cursor, next_cursor, paginator):
+        self.object_list = object_list
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+        self.paginator = paginator
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self)} objects>'
+
+    def __getstate__(self):
+        # cached pages leave their paginator behind, pickling its queryset would fetch every row
+        return {**self.__dict__, 'paginator': None}
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    # named after the Page methods, so templates can use either kind of page to build links
+
+    def next_page_number(self):
+        return self.next_cursor
+
+    def previous_page_number(self):
+        return self.previous_cursor
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+    def page(self, cursor):
+        """Returns the first page for ``FIRST_PAGE``, otherwise the page a cursor points to."""
+
+        if str(cursor) == FIRST_PAGE:
+            decks = list(self.queryset.order_by('-last_modified', '-pk')[:self.per_page + 1])
+            return self._create_page(decks, has_previous=False, has_next=len(decks) > self.per_page)
+
+        direction, last_modified, pk = decode_cursor(cursor)
+
+        if direction == _NEXT:
+            after = Q(last_modified__lt=last_modified) | Q(last_modified=last_modified, pk__lt=pk)
+            decks = list(self.queryset.filter(after).order_by('-last_modified', '-pk')[:self.per_page + 1])
+            return self._create_page(decks, has_previous=True, has_next=len(decks) > self.per_page)
+        else:
+            before = Q(last_modified__gt=last_modified) | Q(last_modified=last_modified, pk__gt=pk)
+            decks = list(self.queryset.filter(before).order_by('last_modified', 'pk')[:self.per_page + 1])
+            has_previous = len(decks) > self.per_page
+            decks = decks[:self.per_page]
+            decks.reverse()
+            return self._create_page(decks, has_previous=has_previous, has_next=True)
+
+    def _create_page(self, decks, has_previous, has_next):
+        decks = decks[:self.per_page]
+        previous_cursor = encode_cursor(_PREVIOUS, decks[0]) if has_previous and decks else None
+        next_cursor = encode_cursor(_NEXT, decks[-1]) if has_next and decks else None
+        return KeysetPage(decks, previous_cursor, next_cursor, self)
+
+    @property
+    def count(self):
+        """Total number of objects. Not needed to paginate, so it's computed on demand and cached for a while."""
+
+        key = 'paging-count-' + md5(str(self.queryset.query).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.queryset.count()
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
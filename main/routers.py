@@ -0,0 +1,66 @@
+"""
+Routing of the read-only study, search and browsing views to read replicas.
+
+Within ``replica_reads`` the decks and cards are read from one of ``settings.DATABASE_REPLICAS``, the same
+one for the whole request so its queries see a consistent state. Every other model (sessions, users,
+the review history), every write and every read inside a transaction go to the default database.
+
+Replicas lag behind the default database, so after saving or deleting a deck the user is pinned to the
+default database for ``settings.DATABASE_REPLICATION_LAG`` seconds (see ``pin``) and sees their own
+changes. Other users may see the previous version of the deck until the replicas catch up.
+"""
+
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from random import choice
+from threading import local
+from time import time
+
+PIN_KEY = 'replica_pin'     # session key, until when the user reads from the default database
+REPLICATED_MODELS = {'main.deck', 'main.card', 'main.deckindex', 'main.cardindex'}
+
+# the replica of the request being handled by this thread
+_state = local()
+
+
+def pin(request):
+    """Reads of the user's requests go to the default database until the replicas have their latest writes."""
+
+    request.session[PIN_KEY] = time() + settings.DATABASE_REPLICATION_LAG
+
+
+def pinned(request):
+    return request.session.get(PIN_KEY, 0) > time()
+
+
+@contextmanager
+def replica_reads(request):
+    """Routes the deck and card reads of the block to a random replica, unless the user is pinned."""
+
+    previous = getattr(_state, 'replica', None)
+    if settings.DATABASE_REPLICAS and not pinned(request):
+        _state.replica = choice(settings.DATABASE_REPLICAS)
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if replica is None or model._meta.label_lower not in REPLICATED_MODELS:
+            # also the relations of a deck read from a replica, e.g. its owner
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # reads of a transaction are part of it, e.g. the deck checked before it's updated
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the default database
+        return True
@@ -0,0 +1,114 @@
+"""
+Spaced repetition scheduling with the SM-2 algorithm.
+
+Every answer is graded from 0 (complete blackout) to 5 (perfect recall). Grades of 3 and above grow the
+card's interval by its ease factor, lower grades send the card back for relearning shortly.
+"""
+
+from datetime import timedelta
+from django.db.models import Exists, OuterRef
+from django.db.transaction import atomic
+from django.utils import timezone
+from .models import Card, Review
+
+GRADES = range(6)
+PASSING_GRADE = 3
+MIN_EASE = 1.3
+RELEARN_DELAY = timedelta(minutes=10)
+
+REVIEW_LIMIT = 50       # cards per review session
+NEW_CARDS_LIMIT = 20    # never reviewed cards introduced per session
+
+
+def schedule(review, grade, now=None):
+    """Applies an SM-2 step to the review, without saving it."""
+
+    now = now or timezone.now()
+
+    if grade < PASSING_GRADE:
+        review.repetitions = 0
+        review.interval = 0
+        review.lapses += 1
+    else:
+        if review.repetitions == 0:
+            review.interval = 1
+        elif review.repetitions == 1:
+            review.interval = 6
+        else:
+            review.interval = round(review.interval * review.ease)
+        review.repetitions += 1
+
+    review.ease = max(MIN_EASE, review.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    review.due_at = now + (timedelta(days=review.interval) if review.interval else RELEARN_DELAY)
+    review.last_reviewed = now
+    return review
+
+
+@atomic
+def record(user, answers):
+    """
+    Parameters
+    ----------
+    user : User
+            The user who answered.
+    answers : list
+            Dicts with the "card" primary key and the "grade", in the order they were answered.
+
+    Returns
+    -------
+    int
+            Number of answers recorded. Answers to missing cards are skipped.
+    """
+
+    answers = [(int(answer['card']), int(answer['grade'])) for answer in answers]
+    if any(grade not in GRADES for _, grade in answers):
+        raise ValueError('Grades range from 0 to 5.')
+
+    pks = {card for card, _ in answers}
+    existing = set(Card.objects.filter(pk__in=pks).values_list('pk', flat=True))
+    reviews = {
+        review.card_id: review
+        for review in Review.objects.select_for_update().filter(user=user, card__in=existing)
+    }
+    created = dict()
+    now = timezone.now()
+    recorded = 0
+
+    for card, grade in answers:
+        if card not in existing:
+            continue
+
+        review = reviews.get(card) or created.get(card)
+        if review is None:
+            review = created[card] = Review(user=user, card_id=card)
+
+        schedule(review, grade, now)
+        recorded += 1
+
+    fields = ('due_at', 'interval', 'ease', 'repetitions', 'lapses', 'last_reviewed')
+    Review.objects.bulk_update(reviews.values(), fields)
+    # another batch may have reviewed the same new card meanwhile, that one wins
+    Review.objects.bulk_create(created.values(), ignore_conflicts=True)
+    return recorded
+
+
+def due(user, deck=None, limit=REVIEW_LIMIT, now=None):
+    """Reviews due by now, most overdue first. Served by the (user, due_at) index."""
+
+    reviews = Review.objects.filter(user=user, due_at__lte=now or timezone.now())
+    if deck is not None:
+        reviews = reviews.filter(card__deck=deck)
+    return reviews.select_related('card').order_by('due_at')[:limit]
+
+
+def due_cards(user, deck, limit=REVIEW_LIMIT, new_limit=NEW_CARDS_LIMIT):
+    """Cards to study in a review session of the deck: the due ones first, then some never reviewed ones."""
+
+    cards = [review.card for review in due(user, deck, limit)]
+    new_limit = min(new_limit, limit - len(cards))
+
+    if new_limit > 0:
+        reviewed = Review.objects.filter(user=user, card=OuterRef('pk'))
+        cards += Card.objects.filter(~Exists(reviewed), deck=deck)[:new_limit]
+
+    return cards
@@ -0,0 +1,210 @@
+"""
+Full-text deck search backed by SQLite FTS5.
+
+Both indexes are external content tables over ``main_deck`` and ``main_card``, so they store only the
+inverted index and read the original text from the indexed table. Triggers keep them in sync with
+every insert, update and delete, including bulk queryset operations that bypass model signals.
+"""
+
+import re
+from django.db import connection
+from django.db.models import Q
+from .models import Card, Deck
+
+# name: (content table, indexed columns)
+INDEXES = {
+    'main_deck_fts': ('main_deck', ('name', 'description')),
+    'main_card_fts': ('main_card', ('term', 'definition')),
+}
+
+# number of matching cards shown along with each deck
+MATCHING_CARDS = 3
+
+_TOKEN = re.compile(r'\w+')
+
+
+def available(conn=connection):
+    return conn.vendor == 'sqlite'
+
+
+def install(conn=connection, names=tuple(INDEXES)):
+    """Create the index tables and their triggers if missing. Safe to call after every migration."""
+
+    if not available(conn):
+        return
+
+    with conn.cursor() as cursor:
+        for name in names:
+            table, columns = INDEXES[name]
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [name])
+            created = cursor.fetchone() is None
+
+            cols = ', '.join(columns)
+            new = ', '.join('new.' + column for column in columns)
+            old = ', '.join('old.' + column for column in columns)
+            insert = f'INSERT INTO {name}(rowid, {cols}) VALUES (new.id, {new});'
+            delete = f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+                f"{cols}, content='{table}', content_rowid='id', prefix='2 3')"
+            )
+            # triggers are dropped whenever a migration has to rebuild the content table
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {table} BEGIN {insert} END')
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {table} BEGIN {delete} END')
+            cursor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {cols} ON {table} '
+                f'BEGIN {delete} {insert} END'
+            )
+
+            if created:
+                # index already existing rows
+                cursor.execute(f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+
+
+def uninstall(conn=connection, names=tuple(INDEXES)):
+    if not available(conn):
+        return
+
+    with conn.cursor() as cursor:
+        for name in names:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {name}')
+
+
+def match_expression(query):
+    """
+    Translate free text into an FTS5 query, which matches documents containing every word of the query
+    as a prefix. Returns None if the query contains no searchable words.
+    """
+
+    words = _TOKEN.findall(query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class SearchResults:
+    """
+    Decks matching a query, ranked by their number of hits. Every matching card is a hit, and so is the
+    deck's own name and description. Hits are combined, ranked and paginated by the database, so only the
+    decks of the slices actually being displayed, and their matching cards, are loaded. A page costs three
+    queries besides counting the matches.
+    """
+
+    def __init__(self, expression, *filters):
+        self.expression = expression
+        self.filters = filters
+        self._count = None
+
+    def _hits(self, select, suffix='', params=()):
+        """Runs a query over the hits grouped by deck, with columns deck_id, hits and rank."""
+
+        from django.db import connections, router
+
+        using = router.db_for_read(Deck)
+        decks = ''
+        filter_params = []
+        if self.filters:
+            sql, filter_params = Deck.objects.filter(*self.filters).values('pk').query.sql_with_params()
+            decks = f'WHERE deck_id IN ({sql})'
+
+        # the bm25 rank of name and description breaks ties between hit counts, decks without one come last
+        query = (
+            f'SELECT {select} FROM ('
+            '    SELECT deck_id, SUM(hits) AS hits, MIN(rank) AS rank FROM ('
+            '        SELECT rowid AS deck_id, 1 AS hits, rank FROM main_deck_fts WHERE main_deck_fts MATCH %s'
+            '        UNION ALL'
+            '        SELECT main_card.deck_id, COUNT(*), NULL'
+            '        FROM main_card_fts INNER JOIN main_card ON main_card.id = main_card_fts.rowid'
+            '        WHERE main_card_fts MATCH %s GROUP BY main_card.deck_id'
+            f'    ) {decks} GROUP BY deck_id'
+            f') {suffix}'
+        )
+
+        with connections[using].cursor() as cursor:
+            cursor.execute(query, [self.expression, self.expression, *filter_params, *params])
+            return cursor.fetchall()
+
+    def ranking(self, start, stop):
+        """Primary keys of the matching decks from start to stop, best matches first."""
+
+        if stop is not None and stop <= start:
+            return []
+        rows = self._hits(
+            'deck_id', 'ORDER BY hits DESC, rank IS NULL, rank, deck_id LIMIT %s OFFSET %s',
+            [-1 if stop is None else stop - start, start]
+        )
+        return [deck_id for deck_id, in rows]
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._hits('COUNT(*)')[0][0]
+        return self._count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        if index.step is not None or (index.start or 0) < 0 or (index.stop or 0) < 0:
+            raise ValueError('Only forward slices without a step are supported.')
+        ids = self.ranking(index.start or 0, index.stop)
+        decks = Deck.objects.select_related('user').in_bulk(ids)
+        cards = self.matching_cards(ids)
+
+        for pk, deck in decks.items():
+            deck.matching_cards = cards.get(pk, [])
+
+        return [decks[pk] for pk in ids if pk in decks]
+
+    def matching_cards(self, deck_ids, limit=MATCHING_CARDS):
+        """Best matching cards of each deck, at most ``limit`` per deck, in a single query."""
+
+        cards = dict()
+        if not deck_ids:
+            return cards
+
+        placeholders = ', '.join(['%s'] * len(deck_ids))
+        query = Card.objects.raw(
+            'SELECT * FROM ('
+            '    SELECT main_card.*, ROW_NUMBER() OVER (PARTITION BY main_card.deck_id ORDER BY main_card_fts.rank) AS n'
+            '    FROM main_card INNER JOIN main_card_fts ON main_card.id = main_card_fts.rowid'
+            f'   WHERE main_card_fts MATCH %s AND main_card.deck_id IN ({placeholders})'
+            ') WHERE n <= %s ORDER BY deck_id, n',
+            [self.expression, *deck_ids, limit]
+        )
+
+        for card in query:
+            cards.setdefault(card.deck_id, []).append(card)
+        return cards
+
+
+def decks(query, *filters):
+    """
+    Parameters
+    ----------
+    query : str
+            Free text typed in by the user. None or an empty query matches every deck.
+    *filters :
+            Q objects narrowing down the searched decks (e.g. by owner).
+
+    Returns
+    -------
+    QuerySet or SearchResults
+            Matching decks, best matches first.
+    """
+
+    # the owner is shown in the listings
+    result = Deck.objects.filter(*filters).select_related('user')
+    if not query:
+        return result
+
+    if not available():
+        return result.filter(Q(name__icontains=query) | Q(description__icontains=query))
+
+    expression = match_expression(query)
+    if expression is None:
+        return result.none()
+
+    return SearchResults(expression, *filters)
@@ -0,0 +1,38 @@
+/** Collects study answers and sends them to the spaced repetition scheduler in batches. */
+class AnswerRecorder {
+
+    constructor(batchSize=10) {
+        this.batchSize = batchSize
+        this.pending = []
+
+        // send whatever is left when the user leaves the page
+        window.addEventListener('pagehide', () => this.flush())
+    }
+
+    /** @param {number} grade - from 0 (complete blackout) to 5 (perfect recall) */
+    record(card, grade) {
+        this.pending.push({'card': parseInt(card), 'grade': grade})
+
+        if(this.pending.length >= this.batchSize) {
+            this.flush()
+        }
+    }
+
+    flush() {
+        if(this.pending.length === 0) {
+            return
+        }
+
+        // a beacon survives page unloads, the csrf token has to go in the form body
+        const form = new FormData()
+        form.append('csrfmiddlewaretoken', shortcuts.getCSRFToken())
+        form.append('answers', JSON.stringify(this.pending))
+        navigator.sendBeacon(`${window.location.origin}/review/answers/`, form)
+
+        this.pending = []
+    }
+
+}
+
+// AnswerRecorder instance shared by the study modes
+const recorder = new AnswerRecorder()
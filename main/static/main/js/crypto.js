@@ -1,14 +1,19 @@
+const FIELD_KEY_STORAGE = 'fieldKey'  // the secret of the session's AES key, see crypto.open_session
+const FIELD_KEY_SIZE = 32   // bytes, of the secret
+const NONCE_SIZE = 12   // bytes
+
 // encrypt on submit
 $('#sensitive').submit((event) => {
     event.preventDefault()  // prevents form submission before encryption
     RSAEncrypt()
 })
 
-function encryptForm(crypto) {
+function encryptForm(crypto, keyId) {
     const form = document.getElementById('sensitive')
     Array.from(form.getElementsByTagName('input')).forEach(input => {
         if(input.type == 'password') {
-            input.value = crypto.encrypt(input.value)
+            // the id tells the server which key to decrypt with, in case it's rotated meanwhile
+            input.value = keyId + ':' + crypto.encrypt(input.value)
         }
     });
 }
@@ -19,17 +24,76 @@ function RSAEncrypt() {
 
     xhttp.open('PUT', `${window.location.origin}/key/`)
     xhttp.setRequestHeader('X-CSRFToken', shortcuts.getCSRFToken())
-    
+
     xhttp.onreadystatechange = () => {
         if(xhttp.readyState == 4 && xhttp.status == 200) {
-            // key retrieved, encrypt credentials
+            // keys retrieved, encrypt credentials with the current one
+            const response = JSON.parse(xhttp.response)
+            const key = response.keys[0]
             const crypto = new JSEncrypt()
-            crypto.setKey(xhttp.response)
-            encryptForm(crypto)
+            crypto.setKey(key.key)
+
+            if(!window.crypto || !window.crypto.subtle) {
+                // no WebCrypto (e.g. not served over HTTPS), every field is encrypted with RSA
+                encryptForm(crypto, key.id)
+                document.getElementById('sensitive').submit()
+                return
+            }
 
-            // submit form
-            document.getElementById('sensitive').submit()
+            getFieldKey(crypto, key.id, response.session)
+                .then(fieldKey => AESEncryptForm(fieldKey))
+                .catch(() => encryptForm(crypto, key.id))
+                .then(() => document.getElementById('sensitive').submit())
         }
     }
     xhttp.send()
 }
+
+async function getFieldKey(crypto, keyId, sessionKeyId) {
+    // the secret is sent to the server once per session, encrypted with RSA
+    const stored = JSON.parse(sessionStorage.getItem(FIELD_KEY_STORAGE))
+    let secret = stored && stored.id == sessionKeyId ? stored.key : null
+
+    if(!secret) {
+        secret = toBase64(window.crypto.getRandomValues(new Uint8Array(FIELD_KEY_SIZE)))
+
+        const data = new FormData()
+        data.append('key', keyId + ':' + crypto.encrypt(secret))
+        const response = await fetch(`${window.location.origin}/key/session/`, {
+            method: 'POST',
+            headers: {'X-CSRFToken': shortcuts.getCSRFToken()},
+            body: data,
+        })
+        if(!response.ok) {
+            throw new Error('The session key was rejected.')
+        }
+
+        const id = (await response.json()).id
+        sessionStorage.setItem(FIELD_KEY_STORAGE, JSON.stringify({id: id, key: secret}))
+    }
+
+    // the AES key is the SHA-256 of the secret, like the server derives it
+    const fieldKey = await window.crypto.subtle.digest('SHA-256', new TextEncoder().encode(secret))
+    return window.crypto.subtle.importKey('raw', fieldKey, 'AES-GCM', false, ['encrypt'])
+}
+
+async function AESEncryptForm(fieldKey) {
+    const form = document.getElementById('sensitive')
+    const encoder = new TextEncoder()
+    const inputs = Array.from(form.getElementsByTagName('input')).filter(input => input.type == 'password')
+
+    // encrypt every field before changing any, so a failure leaves the form as it was
+    const values = await Promise.all(inputs.map(async input => {
+        const nonce = window.crypto.getRandomValues(new Uint8Array(NONCE_SIZE))
+        // the field name is authenticated too, so values can't be swapped between fields
+        const algorithm = {name: 'AES-GCM', iv: nonce, additionalData: encoder.encode(input.name)}
+        const ciphertext = await window.crypto.subtle.encrypt(algorithm, fieldKey, encoder.encode(input.value))
+        return 'aes:' + toBase64(nonce) + ':' + toBase64(new Uint8Array(ciphertext))
+    }))
+
+    inputs.forEach((input, i) => input.value = values[i])
+}
+
+function toBase64(bytes) {
+    return btoa(String.fromCharCode(...bytes))
+}
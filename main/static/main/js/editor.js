@@ -1,5 +1,11 @@
 var warn = true
 var saveButtonListener = null
+// state of the deck as loaded, so only the changes have to be sent when saving
+const snapshot = {'deck': {}, 'cards': {}, 'texts': {}}
+
+const UPLOAD_CHUNK = 1024 * 1024    // bytes
+const PARALLEL_UPLOADS = 3
+const UPLOAD_RETRIES = 3            // per image
 
 init()
 
@@ -9,6 +15,7 @@ function init() {
     document.getElementById('new-card-btn').onclick = addNewCard
     document.getElementById('save-btn').onclick = save
     saveButtonListener = setInterval(canSave, 100)
+    takeSnapshot()
     initEditor()
 }
 
@@ -35,6 +42,9 @@ function getTinyMCEConfig(type) {
         plugins: ['textcolor', 'lists'],
         toolbar: 'undo redo | bold italic underline strikethrough | forecolor backcolor | alignright aligncenter alignleft alignjustify | numlist bullist | subscript superscript',
         statusbar: false,
+        init_instance_callback: editor => {
+            snapshot.texts[editor.id] = editor.getContent()
+        },
     }
 }
 
@@ -117,6 +127,8 @@ function initImageButtons(type) {
     document.getElementsByName(imageName).forEach(input => {
         if(input.onchange == null) {
             input.onchange = () => {
+                // a previous upload of the input is outdated
+                delete input.dataset.upload
                 if(input.files) {
                     // get corresponging image preview node
                     const img = Array.from(input.parentElement.childNodes).filter(element => element.name == previewName)[0]
@@ -135,7 +147,9 @@ function initImageButtons(type) {
                 const file = Array.from(btn.parentElement.childNodes).filter(element => element.name == imageName)[0]
                 const preview = Array.from(btn.parentElement.childNodes).filter(element => element.name == previewName)[0]
                 file.value = ''
+                delete file.dataset.upload
                 preview.src = ''
+                preview.removeAttribute('data-image')
                 hideOrShowImageControls(imageName, previewName, deleteBtnName)
             }
         }
@@ -199,18 +213,32 @@ function save() {
     warn = false
     clearInterval(saveButtonListener)
 
-    // checks for an update flag (are we editing an existing deck)
-    let update = (document.getElementById('uuid').value !== '')
+    uploadImages().then(() => {
+        // checks for an update flag (are we editing an existing deck)
+        let update = (document.getElementById('uuid').value !== '')
 
-    // initialize deck data
-    const deck = document.createElement('input')
-    deck.setAttribute('type', 'hidden')
-    deck.setAttribute('name', 'deck')
-    deck.setAttribute('value', getDeckJson(update))
-    
-    const form = document.getElementById('editor')
-    form.appendChild(deck)
-    form.submit()
+        if(update) {
+            patchDeck()
+            return
+        }
+
+        // initialize deck data
+        const deck = document.createElement('input')
+        deck.setAttribute('type', 'hidden')
+        deck.setAttribute('name', 'deck')
+        deck.setAttribute('value', getDeckJson(update))
+
+        // the images are referred to by their upload ids, don't send them again
+        document.querySelectorAll('input[type=file]').forEach(input => input.disabled = true)
+
+        const form = document.getElementById('editor')
+        form.appendChild(deck)
+        form.submit()
+    }, () => {
+        alert('Uploading the images failed.')
+        warn = true
+        saveButtonListener = setInterval(canSave, 100)
+    })
 }
 
 /** @param {boolean} addPrimaryKey - used when editing an existing deck */
@@ -222,6 +250,10 @@ function getDeckJson(addPrimaryKey) {
         'cards': []
     }
 
+    if(addPrimaryKey) {
+        deck.version = parseInt(document.getElementById('version').value)
+    }
+
     // save contents to selector
     tinymce.triggerSave()
 
@@ -229,8 +261,10 @@ function getDeckJson(addPrimaryKey) {
         const card = {
             'term': getText(element, 'term'),
             'term_image': getImage(element, 'term'),
+            'term_upload': getUpload(element, 'term'),
             'definition': getText(element, 'definition'),
-            'definition_image': getImage(element, 'definition')
+            'definition_image': getImage(element, 'definition'),
+            'definition_upload': getUpload(element, 'definition')
         }
         deck.cards.push(card)
     })
@@ -245,9 +279,12 @@ function getDeckJson(addPrimaryKey) {
     return JSON.stringify(deck)
 }
 
+function getFace(node, type) {
+    return Array.from(shortcuts.getAllChildNodes(node)).filter(child => child.getAttribute('data-label') == type)[0]
+}
+
 function getText(node, type) {
-    const text = Array.from(shortcuts.getAllChildNodes(node)).filter(child => child.getAttribute('data-label') == type)[0]
-    return text.innerHTML
+    return getFace(node, type).innerHTML
 }
 
 function getImage(node, type) {
@@ -261,11 +298,190 @@ function getImage(node, type) {
     }
 
     // check preview img tag in case of preloaded images (used when editing an existing deck)
+    // the preview may show a thumbnail, the stored image is named by its data-image attribute
     image = Array.from(node.getElementsByTagName('img')).filter(img => img.getAttribute('name') == previewName)[0]
-    return getFilename(image.getAttribute('src'))
+    return getFilename(image.dataset.image || image.getAttribute('src'))
+}
+
+/** Id of the chunked upload of a newly selected image, undefined if there is none. */
+function getUpload(node, type) {
+    const inputName = type + '-image'
+    const input = Array.from(node.getElementsByTagName('input')).filter(input => input.getAttribute('name') == inputName)[0]
+    return input.dataset.upload
 }
 
 function getFilename(path) {
     // {~/path/to/file/}filename.ext - everything in {} is replaced
     return path.replace(/.*(\/|\\)/g, '')
 }
+
+
+
+/* INCREMENTAL SAVE */
+
+function takeSnapshot() {
+    snapshot.deck = {
+        'name': document.getElementById('name').value,
+        'description': document.getElementById('description').value,
+    }
+
+    shortcuts.getElementsByLabel('card').forEach((element, position) => {
+        const pk = element.getAttribute('id')
+        if(pk !== null) {
+            snapshot.cards[pk] = {
+                'term_image': getImage(element, 'term'),
+                'definition_image': getImage(element, 'definition'),
+                'position': position,
+            }
+        }
+    })
+}
+
+/** Diffs the editor against the snapshot, see EditorView.apply_operations for the operation format. */
+function getOperations() {
+    const operations = []
+    const positions = {}
+    const present = new Set()
+
+    shortcuts.getElementsByLabel('card').forEach((element, position) => {
+        const pk = element.getAttribute('id')
+
+        if(pk === null) {
+            operations.push({
+                'op': 'add',
+                'term': tinymce.get(getFace(element, 'term').id).getContent(),
+                'term_upload': getUpload(element, 'term'),
+                'definition': tinymce.get(getFace(element, 'definition').id).getContent(),
+                'definition_upload': getUpload(element, 'definition'),
+                'position': position,
+            })
+            return
+        }
+
+        present.add(pk)
+        const original = snapshot.cards[pk]
+        const update = {'op': 'update', 'pk': parseInt(pk)}
+        const types = ['term', 'definition']
+
+        types.forEach(type => {
+            const editor = tinymce.get(getFace(element, type).id)
+            const content = editor.getContent()
+            if(content !== snapshot.texts[editor.id]) {
+                update[type] = content
+            }
+
+            const image = getImage(element, type)
+            if(getUpload(element, type) !== undefined) {
+                update[type + '_upload'] = getUpload(element, type)
+            }
+            else if(image !== original[type + '_image']) {
+                update[type + '_image'] = image
+            }
+        })
+
+        if(Object.keys(update).length > 2) {
+            operations.push(update)
+        }
+        if(position !== original.position) {
+            positions[pk] = position
+        }
+    })
+
+    Object.keys(snapshot.cards)
+        .filter(pk => !present.has(pk))
+        .forEach(pk => operations.push({'op': 'remove', 'pk': parseInt(pk)}))
+
+    if(Object.keys(positions).length > 0) {
+        operations.push({'op': 'reorder', 'positions': positions})
+    }
+
+    return operations
+}
+
+function patchDeck() {
+    const body = {
+        'uuid': document.getElementById('uuid').value,
+        'version': parseInt(document.getElementById('version').value),
+        'operations': getOperations(),
+    }
+
+    Object.keys(snapshot.deck).forEach(key => {
+        const value = document.getElementById(key).value
+        if(value !== snapshot.deck[key]) {
+            body[key] = value
+        }
+    })
+
+    const xhttp = new XMLHttpRequest()
+
+    xhttp.open('PATCH', `${window.location.origin}/editor/`)
+    xhttp.setRequestHeader('X-CSRFToken', shortcuts.getCSRFToken())
+    xhttp.setRequestHeader('Content-Type', 'application/json')
+
+    xhttp.onreadystatechange = () => {
+        if(xhttp.readyState == 4) {
+            if(xhttp.status == 200 && !xhttp.responseURL.includes('/login')) {
+                window.location.assign('/user/')
+            }
+            else {
+                // keep the changes in the editor, so the user can copy them
+                alert(xhttp.status == 409 ? JSON.parse(xhttp.response).error : 'Saving the deck failed.')
+                warn = true
+                saveButtonListener = setInterval(canSave, 100)
+            }
+        }
+    }
+    xhttp.send(JSON.stringify(body))
+}
+
+
+
+/* CHUNKED UPLOAD */
+
+/** Uploads every newly selected image, a few at a time, see UploadView. */
+function uploadImages() {
+    const inputs = Array.from(document.querySelectorAll('input[type=file]'))
+        .filter(input => input.files.length > 0 && input.dataset.upload === undefined)
+    let next = 0
+
+    // each worker takes the next image once its previous one is done
+    const worker = () => next < inputs.length ? uploadImage(inputs[next++]).then(worker) : Promise.resolve()
+    return Promise.all(Array.from({'length': PARALLEL_UPLOADS}, worker))
+}
+
+/** Uploads the image of a file input in chunks, then stores the upload id in its data-upload attribute. */
+function uploadImage(input) {
+    const file = input.files[0]
+    const body = JSON.stringify({'name': file.name, 'size': file.size})
+
+    return uploadRequest('POST', '/editor/uploads/', body, {'Content-Type': 'application/json'})
+        .then(upload => sendChunks(upload.id, file, upload.offset, UPLOAD_RETRIES))
+        .then(id => input.dataset.upload = id)
+}
+
+function sendChunks(id, file, offset, retries) {
+    if(offset >= file.size) {
+        return Promise.resolve(id)
+    }
+
+    const end = Math.min(offset + UPLOAD_CHUNK, file.size)
+    const range = `bytes ${offset}-${end - 1}/${file.size}`
+
+    return uploadRequest('PUT', `/editor/uploads/${id}/`, file.slice(offset, end), {'Content-Range': range})
+        .catch(error => {
+            if(retries === 0) {
+                throw error
+            }
+            retries--
+            // resume from wherever the server got to
+            return uploadRequest('GET', `/editor/uploads/${id}/`)
+        })
+        .then(status => sendChunks(id, file, status.offset, retries))
+}
+
+function uploadRequest(method, url, body=null, headers={}) {
+    headers['X-CSRFToken'] = shortcuts.getCSRFToken()
+
+    return fetch(window.location.origin + url, {'method': method, 'body': body, 'headers': headers})
+        .then(response => response.ok ? response.json() : Promise.reject(response.status))
+}
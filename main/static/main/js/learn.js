@@ -1,4 +1,9 @@
 var activeId = 0
+var questions = []      // rendered html of the questions fetched so far
+var total = null        // number of questions in the quiz, known after the first fetch
+var loading = null      // pending fetch, if any
+
+const PREFETCH = 3      // fetch the next page when this many questions are left to show
 
 init()
 
@@ -16,27 +21,68 @@ function init() {
     const retryButton = document.getElementById('retry-btn')
     shortcuts.hideElement(retryButton)
 
-    showNextQuestion()
+    loadQuestions().then(showNextQuestion).catch(showError)
+}
+
+/** Fetches the next page of questions of the quiz session. A failed fetch is tried again on the next call. */
+function loadQuestions() {
+    if(loading === null) {
+        loading = fetch(`${window.location.origin}/learn/questions/?start=${questions.length}`)
+            .then(response => {
+                if(!response.ok) {
+                    throw new Error(`Loading the questions failed (${response.status}).`)
+                }
+                return response.json()
+            })
+            .then(page => {
+                questions = questions.concat(page.questions)
+                total = page.total
+            })
+            .finally(() => loading = null)
+    }
+
+    return loading
+}
+
+/** Replaces the quiz with an error message, retrying starts a new quiz session. */
+function showError(error) {
+    const wrapper = document.getElementById('wrapper')
+    wrapper.innerHTML = '<div class="alert alert-danger"></div>'
+    wrapper.firstChild.textContent = error.message
+
+    shortcuts.hideElement(document.getElementById('next-btn'))
+    shortcuts.showElement(document.getElementById('retry-btn'))
 }
 
 /** Displays the next question in the quiz. */
 function showNextQuestion() {
-    const wrapper = document.getElementById('wrapper')
-    const questions = shortcuts.getElementsByLabel('question')
+    if(activeId >= total) {
+        return
+    }
+    if(activeId >= questions.length) {
+        // next page hasn't arrived yet
+        loadQuestions().then(showNextQuestion).catch(showError)
+        return
+    }
 
-    wrapper.innerHTML = questions[activeId].innerHTML
-    bind(questions[activeId])
+    const wrapper = document.getElementById('wrapper')
+    wrapper.innerHTML = questions[activeId]
+    bind()
     
     activeId++
+
+    if(questions.length - activeId < PREFETCH && questions.length < total) {
+        // failures surface once the questions are needed
+        loadQuestions().catch(() => {})
+    }
 }
 
 /** Displays "next button" of "retry button" depending on quiz progression. */
 function showNav() {
     const nextButton = document.getElementById('next-btn')
     const retryButton = document.getElementById('retry-btn')
-    const questions = shortcuts.getElementsByLabel('question')
     
-    if(activeId + 1 < questions.length) {
+    if(activeId < total) {
         shortcuts.showElement(nextButton)
     }
     else {
@@ -45,17 +91,19 @@ function showNav() {
 }
 
 /** Adds onclick funtionality to answer nodes, so user can choose and click an answer. */
-function bind(quiz) {
+function bind() {
     const answers = document.getElementsByName('answer')
 
     answers.forEach(answer => {
         answer.onclick = () => {
+            recordAnswer(answer.value == 'True')
+
             if(answer.value == 'True') {
                 success(answer)
             }
             else {
                 fail(answer)
-                success(findCorrectAnswer(quiz))
+                success(findCorrectAnswer())
             }
 
             unbind(answers)
@@ -64,6 +112,14 @@ function bind(quiz) {
     })
 }
 
+/** Feeds the answer to the spaced repetition scheduler, if the user is logged in. */
+function recordAnswer(correct) {
+    if(typeof recorder !== 'undefined') {
+        const card = document.querySelector('#wrapper [data-card]').getAttribute('data-card')
+        recorder.record(card, correct ? 4 : 1)
+    }
+}
+
 /** After answering unbind any functionality from answer nodes. */
 function unbind(answers) {
     answers.forEach(answer => {
@@ -84,7 +140,7 @@ function fail(answer) {
 }
 
 /** Finds the correct answer node which matches the question. */
-function findCorrectAnswer(quiz) {
+function findCorrectAnswer() {
     const answers = Array.from(document.getElementsByName('answer'))
 
     for(let i=0; i < answers.length; i++) {
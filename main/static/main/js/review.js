@@ -0,0 +1,28 @@
+initGrades()
+
+
+function initGrades() {
+    document.getElementsByName('grade-btn').forEach(button => {
+        button.onclick = () => {
+            recorder.record(button.getAttribute('data-card'), parseInt(button.value))
+            showNextCard()
+        }
+    })
+}
+
+/** Steps the carousel forward, the session is over after the last card. */
+function showNextCard() {
+    const items = Array.from(document.getElementsByClassName('carousel-item'))
+    const active = items.findIndex(item => item.classList.contains('active'))
+
+    items[active].classList.remove('active')
+
+    if(active + 1 < items.length) {
+        items[active + 1].classList.add('active')
+    }
+    else {
+        recorder.flush()
+        shortcuts.hideElement(document.getElementById('carousel'))
+        shortcuts.showElement(document.getElementById('done'))
+    }
+}
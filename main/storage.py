@@ -0,0 +1,152 @@
+"""
+Content-addressed, reference-counted storage for card images.
+
+Uploads are hashed while they are streamed to disk and stored under their SHA-256 digest, so identical
+images are kept only once however many cards use them. The ``main_storedimage`` table counts the card
+references of every stored file. On SQLite, triggers on ``main_card`` keep the counts current through
+every insert, update and delete, bulk queryset operations included. Garbage collection then only has
+to look at the unreferenced rows, see ``cleaner.collect_unreferenced``.
+"""
+
+import os
+from hashlib import sha256
+from tempfile import mkstemp
+from django.core.files.storage import FileSystemStorage
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.transaction import atomic
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+IMAGE_FIELDS = ('term_image', 'definition_image')
+CHUNK_SIZE = 64 * 1024
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # the name is decided by the content in _save, identical content may share the file
+        return name
+
+    def _save(self, name, content):
+        os.makedirs(self.location, exist_ok=True)
+        descriptor, temporary = mkstemp(dir=self.location, prefix='.upload-')
+        digest = sha256()
+
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+
+            return self._store(temporary, digest.hexdigest() + os.path.splitext(name)[1].lower())
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def adopt(self, path, name):
+        """
+        Moves a complete file into the storage without copying it, e.g. a finished chunked upload.
+        The file has to be on the same filesystem. Returns the name it is stored under.
+        """
+
+        digest = sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return self._store(path, digest.hexdigest() + os.path.splitext(name)[1].lower())
+
+    def _store(self, temporary, name):
+        from . import imaging
+        from .models import StoredImage
+
+        # the collector removes files in a transaction too, so it can't remove the file between the refresh of
+        # the row, which makes the grace period protect the file from later collections, and the existence check
+        size = os.path.getsize(temporary)
+        with atomic():
+            StoredImage.objects.update_or_create(name=name, defaults={'created': timezone.now(), 'size': size})
+
+            if self.exists(name):
+                os.remove(temporary)
+            else:
+                os.replace(temporary, self.path(name))
+                if self.file_permissions_mode is not None:
+                    os.chmod(self.path(name), self.file_permissions_mode)
+                imaging.submit(name)
+
+        return name
+
+
+image_storage = ContentAddressedStorage()
+
+
+def available(conn=connection):
+    return conn.vendor == 'sqlite'
+
+
+def install(conn=connection):
+    """Create the reference counting triggers if missing. Safe to call after every migration."""
+
+    if not available(conn):
+        return
+
+    increment = ' '.join(
+        f"INSERT INTO main_storedimage(name, refcount, created) "
+        f"SELECT new.{field}, 1, CURRENT_TIMESTAMP WHERE new.{field} <> '' "
+        f"ON CONFLICT(name) DO UPDATE SET refcount = refcount + 1;"
+        for field in IMAGE_FIELDS
+    )
+    decrement = ' '.join(
+        f"UPDATE main_storedimage SET refcount = refcount - 1 WHERE name = old.{field} AND refcount > 0;"
+        for field in IMAGE_FIELDS
+    )
+    fields = ', '.join(IMAGE_FIELDS)
+
+    with conn.cursor() as cursor:
+        # triggers are dropped whenever a migration has to rebuild the card table
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS main_storedimage_ai AFTER INSERT ON main_card BEGIN {increment} END')
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS main_storedimage_ad AFTER DELETE ON main_card BEGIN {decrement} END')
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS main_storedimage_au AFTER UPDATE OF {fields} ON main_card '
+            f'BEGIN {decrement} {increment} END'
+        )
+
+
+def uninstall(conn=connection):
+    if not available(conn):
+        return
+
+    with conn.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS main_storedimage_{suffix}')
+
+
+def recount(apps=None, using=DEFAULT_DB_ALIAS):
+    """
+    Rebuilds every reference count from the cards, e.g. after the triggers were missing.
+
+    Parameters
+    ----------
+    apps : Apps
+            The app registry of a migration, by default the installed models are used.
+    using : str
+            Alias of the database.
+    """
+
+    from collections import Counter
+    from django.apps import apps as installed_apps
+
+    Card = (apps or installed_apps).get_model('main', 'Card')
+    StoredImage = (apps or installed_apps).get_model('main', 'StoredImage')
+    counts = Counter()
+
+    with atomic(using=using):
+        for images in Card.objects.using(using).values_list(*IMAGE_FIELDS).iterator():
+            counts.update(name for name in images if name)
+
+        StoredImage.objects.using(using).update(refcount=0)
+        images = [StoredImage(name=name, refcount=count) for name, count in counts.items()]
+        StoredImage.objects.using(using).bulk_create(images, ignore_conflicts=True)
+        StoredImage.objects.using(using).bulk_update(images, ['refcount'])
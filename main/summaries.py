@@ -0,0 +1,72 @@
+"""
+Denormalized summaries of the decks for the deck listings.
+
+Every deck carries its number of cards, a preview of its first card and the total size of its images, so
+a page of decks renders from the deck rows alone, without a count or a join per deck. The editor refreshes
+the summary in the transaction saving the cards, so it's never out of sync with them. It's summed up in
+SQL, from the sizes stored along with the reference counts of the images, without touching the files. Decks
+saved before the summary existed are filled in by ``manage.py decksummary``, which can also verify every summary.
+"""
+
+from django.db.models import Count, Q, Sum
+from .models import Card, Deck, StoredImage
+
+FIELDS = ('card_count', 'preview_term', 'preview_image', 'image_bytes')
+
+
+def compute(deck_id):
+    """The summary of a deck as stored in its row, computed from its cards in three queries."""
+
+    cards = Card.objects.filter(deck_id=deck_id)
+    first = cards.order_by('position', 'pk').values('term', 'term_image').first() or {}
+
+    # images are content-addressed, a file shared by several cards takes up space once
+    unordered = cards.order_by()
+    images = StoredImage.objects.filter(
+        Q(name__in=unordered.values('term_image')) | Q(name__in=unordered.values('definition_image'))
+    )
+
+    return {
+        'card_count': cards.aggregate(count=Count('pk'))['count'],
+        'preview_term': first.get('term', ''),
+        'preview_image': first.get('term_image') or None,
+        'image_bytes': images.aggregate(size=Sum('size'))['size'] or 0,
+    }
+
+
+def refresh(deck):
+    """Stores the current summary of a deck, and sets it on the instance too. Call it after saving the cards."""
+
+    summary = compute(deck.pk)
+    Deck.objects.filter(pk=deck.pk).update(**summary)
+
+    for field, value in summary.items():
+        setattr(deck, field, value)
+
+
+def verify(fix=False):
+    """
+    Parameters
+    ----------
+    fix : bool
+            Store the correct summary of the decks found out of sync.
+
+    Returns
+    -------
+    list
+            Primary keys of the decks whose stored summary differs from their cards.
+    """
+
+    stale = []
+
+    for deck in Deck.objects.only('pk', *FIELDS).iterator():
+        summary = compute(deck.pk)
+        stored = {field: getattr(deck, field) for field in FIELDS}
+        stored['preview_image'] = stored['preview_image'].name or None
+
+        if stored != summary:
+            stale.append(deck.pk)
+            if fix:
+                Deck.objects.filter(pk=deck.pk).update(**summary)
+
+    return stale
@@ -0,0 +1,179 @@
+"""
+A lightweight job queue backed by the database.
+
+Slow side effects like sending mail or processing images are moved off the request thread by decorating
+them with ``@task`` and calling ``function.delay(*args)`` instead of the function itself. That stores the
+call as a ``main_task`` row, in the caller's transaction, so a task is never run for changes that were
+rolled back. Worker threads, in the web process or in ``manage.py tasks work``, claim due tasks with a
+conditional update, so any number of them may share the queue. Failed tasks are retried with exponential
+backoff, and kept for inspection once they run out of attempts. Idle workers also queue the recurring
+jobs, see cron.py.
+"""
+
+import json
+import threading
+import traceback
+from datetime import timedelta
+from django.db import close_old_connections
+from django.db.models import Count, F, Q
+from django.db.transaction import on_commit
+from django.utils import timezone
+from .models import Task
+
+MAX_ATTEMPTS = 5
+BACKOFF = timedelta(seconds=30)     # doubled after every failed attempt
+MAX_BACKOFF = timedelta(hours=1)
+LEASE = timedelta(minutes=10)       # a claimed task is handed to another worker after this, in case its worker died
+POLL_INTERVAL = 2                   # seconds
+CLAIM_CANDIDATES = 10               # due tasks tried per claim, others may be claimed concurrently
+
+WORKER_THREAD_NAME = 'TaskWorker'
+
+_registry = dict()
+_wakeup = threading.Event()
+
+
+def task(function=None, *, max_attempts=MAX_ATTEMPTS):
+    """
+    Registers a function as a task. The function can still be called directly, and gains a
+    ``delay(*args, **kwargs)`` method queueing a call. Arguments have to be JSON serializable.
+    """
+
+    def decorator(function):
+        name = f'{function.__module__}.{function.__qualname__}'
+        _registry[name] = function
+        function.max_attempts = max_attempts
+        function.delay = lambda *args, **kwargs: enqueue(name, args, kwargs)
+        return function
+
+    return decorator(function) if function is not None else decorator
+
+
+def enqueue(name, args=(), kwargs=None, delay=None):
+    if name not in _registry:
+        raise LookupError(f'Unknown task {name!r}.')
+
+    job = Task.objects.create(
+        name=name,
+        arguments=json.dumps([list(args), kwargs or {}]),
+        run_at=timezone.now() + (delay or timedelta()),
+    )
+    # wake up the local workers once the task is visible to them
+    on_commit(_wakeup.set)
+    return job
+
+
+def claim(now=None):
+    """Claims a due task for the calling worker. Returns None if there is none."""
+
+    now = now or timezone.now()
+    unlocked = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    due = Task.objects.filter(unlocked, status=Task.PENDING, run_at__lte=now).order_by('run_at')
+
+    for job in due[:CLAIM_CANDIDATES]:
+        # succeeds only if no other worker claimed the task since it was read
+        claimed = Task.objects.filter(pk=job.pk, locked_until=job.locked_until, status=Task.PENDING) \
+            .update(locked_until=now + LEASE, attempts=F('attempts') + 1)
+        if claimed:
+            job.attempts += 1
+            return job
+
+    return None
+
+
+def run(job):
+    """Runs a claimed task. Returns whether it succeeded."""
+
+    function = _registry.get(job.name)
+
+    try:
+        if function is None:
+            raise LookupError(f'Unknown task {job.name!r}.')
+        args, kwargs = json.loads(job.arguments)
+        function(*args, **kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        tasks = Task.objects.filter(pk=job.pk)
+
+        if function is None or job.attempts >= function.max_attempts:
+            tasks.update(status=Task.FAILED, locked_until=None, error=error)
+        else:
+            backoff = min(BACKOFF * 2 ** (job.attempts - 1), MAX_BACKOFF)
+            tasks.update(run_at=timezone.now() + backoff, locked_until=None, error=error)
+        return False
+
+    Task.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def work(stop=None, burst=False):
+    """
+    Runs tasks until ``stop`` is set.
+
+    Parameters
+    ----------
+    stop : threading.Event
+            Stops the worker once set. None runs it forever.
+    burst : bool
+            Return as soon as there are no due tasks left instead.
+
+    Returns
+    -------
+    int
+            Number of tasks run.
+    """
+
+    from . import cron
+
+    stop = stop or threading.Event()
+    count = 0
+
+    while not stop.is_set():
+        close_old_connections()
+        job = claim()
+
+        if job is None:
+            if burst:
+                break
+            # the idle workers double as the scheduler of the recurring jobs
+            if cron.tick():
+                continue
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        run(job)
+        count += 1
+
+    close_old_connections()
+    return count
+
+
+def start_workers(count, stop=None):
+    """Starts worker threads in the current process, unless they are already running."""
+
+    running = sum(thread.name.startswith(WORKER_THREAD_NAME) for thread in threading.enumerate())
+
+    for index in range(running, count):
+        worker = threading.Thread(target=work, args=(stop, ), name=f'{WORKER_THREAD_NAME}-{index}', daemon=True)
+        worker.start()
+
+
+def depth():
+    """Number of queued tasks by name and state: due, scheduled (backing off or delayed), running and failed."""
+
+    now = timezone.now()
+    locked = Q(locked_until__gte=now)
+
+    return Task.objects.values('name').annotate(
+        due=Count('pk', filter=Q(status=Task.PENDING, run_at__lte=now) & ~locked),
+        scheduled=Count('pk', filter=Q(status=Task.PENDING, run_at__gt=now) & ~locked),
+        running=Count('pk', filter=Q(status=Task.PENDING) & locked),
+        failed=Count('pk', filter=Q(status=Task.FAILED)),
+    ).order_by('name')
+
+
+def retry_failed():
+    """Queues the failed tasks again, with fresh attempts. Returns their number."""
+
+    return Task.objects.filter(status=Task.FAILED).update(status=Task.PENDING, attempts=0, run_at=timezone.now())
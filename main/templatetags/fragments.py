@@ -0,0 +1,38 @@
+from django.template import Library, Node, TemplateSyntaxError
+from main import caching
+
+register = Library()
+
+
+class FragmentNode(Node):
+    def __init__(self, nodelist, name, deck, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.deck = deck
+        self.vary_on = vary_on
+
+    def render(self, context):
+        deck = self.deck.resolve(context)
+        vary_on = [variable.resolve(context) for variable in self.vary_on]
+        key = caching.key('fragments', self.name, str(deck.uuid), deck.version, deck.last_modified, *vary_on)
+        return caching.get_or_set('fragments', key, lambda: self.nodelist.render(context), caching.FRAGMENT_TIMEOUT)
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    Caches the enclosed part of a template until the deck it shows is saved again, see caching.py.
+
+        {% fragment "name" deck [vary_on ...] %} ... {% endfragment %}
+
+    The fragment may only depend on the deck and the ``vary_on`` values, those are part of the cache key.
+    """
+
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise TemplateSyntaxError(f'{bits[0]!r} takes a name and a deck, at least.')
+
+    nodelist = parser.parse(('endfragment', ))
+    parser.delete_first_token()
+    name = bits[1].strip('"\'')
+    return FragmentNode(nodelist, name, parser.compile_filter(bits[2]), [parser.compile_filter(bit) for bit in bits[3:]])
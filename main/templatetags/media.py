@@ -1,10 +1,32 @@
 from django.conf import settings
 from django.template import Library
 from os.path import basename
+from main import imaging
 
 register = Library()
 
 
 @register.simple_tag
-def media(image):
+def media(image, variant=None):
+    """
+    Parameters
+    ----------
+    image : FieldFile
+            Card image.
+    variant : str
+            None for the url of the original image, "thumbnail" for the url of its smallest variant,
+            or an extension of imaging.FORMATS for a srcset of its variants in that format.
+
+    Returns
+    -------
+    str
+            Falls back to the original image (or an empty srcset) while there are no variants.
+    """
+
+    widths = imaging.widths(image.name) if variant else ()
+
+    if variant == 'thumbnail' and widths:
+        return imaging.url(image.name, widths[0], 'jpg')
+    if variant in imaging.FORMATS:
+        return ', '.join(f'{imaging.url(image.name, width, variant)} {width}w' for width in widths)
     return settings.MEDIA_URL + basename(image.name)
@@ -1,12 +1,37 @@
-from random import sample, shuffle
+from collections import namedtuple
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.db.transaction import on_commit
+from django.dispatch import receiver
+from os.path import basename
+from random import Random
 from .models import Card, Deck
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 _DEFAULT_SETTINGS = {
     'start_with': 'definition',
     'answer_with': 'term',
     'show_images': True,
 }
 
+QUIZ_CACHE_TIMEOUT = 60 * 60    # seconds
+VECTORIZE_THRESHOLD = 1000      # decks from this size on use the numpy generator, if numpy is installed
+
+# parallel tuples indexed by the card's position in the deck
+CompiledDeck = namedtuple('CompiledDeck', ('pks', 'term', 'term_image', 'definition', 'definition_image'))
+
+
+class Image(namedtuple('Image', ('name', ))):
+    """Stands in for the card's image field in the quiz templates."""
+
+    @property
+    def alt(self):
+        return basename(self.name)
+
 
 def get_settings(post=None):
     if not post:
@@ -19,42 +44,143 @@ def get_settings(post=None):
     }
 
 
-def _construct(card, face, **kwargs):
+def _cache_key(uuid, version):
+    return f'quiz-{uuid}-{version}'
+
+
+def compile_deck(uuid, version):
+    """
+    Returns the cached compact form of the deck, fetching the cards only on a cache miss. Every save bumps the
+    version of the deck, so a process never reads the cards of an older version, even from a cache of its own.
+    """
+
+    key = _cache_key(uuid, version)
+    deck = cache.get(key)
+
+    if deck is None:
+        fields = CompiledDeck._fields[1:]
+        rows = Card.objects.filter(deck__uuid=uuid).values_list('pk', *fields)
+        columns = tuple(zip(*rows)) or ((), ) * len(CompiledDeck._fields)
+        deck = CompiledDeck(*columns)
+        cache.set(key, deck, QUIZ_CACHE_TIMEOUT)
+
+    return deck
+
+
+@receiver(post_save, sender=Deck)
+@receiver(post_delete, sender=Deck)
+def invalidate(sender, instance, **kwargs):
+    """Frees the entries of the saved version and the one it replaced, once the transaction commits."""
+
+    keys = [_cache_key(instance.uuid, version) for version in (instance.version, instance.version - 1)]
+    on_commit(lambda: cache.delete_many(keys))
+
+
+def _construct(deck, face, index, **kwargs):
+    image = getattr(deck, face + '_image')[index]
     struct = {
-        'text': getattr(card, face),
-        'image': getattr(card, face + '_image')
+        'text': getattr(deck, face)[index],
+        'image': Image(image) if image else None,
     }
     struct.update(kwargs)
     return struct
 
 
-def generate_questions(uuid, answer_with):
-    deck = Deck.objects.get(uuid=uuid)
-    cards = list(Card.objects.filter(deck=deck))  # has to be list in order to work with the random module
+def generate_questions(uuid, version, answer_with, seed=None):
+    """
+    Returns a lazy sequence of questions. The same seed always produces the same quiz for a version of the deck,
+    so it can be delivered page by page.
+    """
 
-    questions = list()
-    num_of_choices = min(len(cards), 4)
-    opposite_face = 'definition' if answer_with == 'term' else 'term'
+    deck = compile_deck(uuid, version)
 
-    for card in cards:
-        question = {
-            'question': _construct(card, opposite_face),
+    if numpy is not None and len(deck.pks) >= VECTORIZE_THRESHOLD:
+        return QuestionBatch(deck, answer_with, seed)
+    return Questions(deck, answer_with, seed)
+
+
+class Questions:
+    """
+    Quiz over a deck. Only the question order is drawn up front, each question is built when accessed
+    from its own random generator derived from the seed. So any page of the quiz can be served without
+    building the questions before it.
+    """
+
+    def __init__(self, deck, answer_with, seed=None):
+        rng = Random(seed)
+        size = len(deck.pks)
+
+        self.deck = deck
+        self.answer_with = answer_with
+        self.opposite_face = 'definition' if answer_with == 'term' else 'term'
+        self.num_of_choices = min(size, 4)
+        self.order = list(range(size))
+        self.seed = rng.getrandbits(64)
+        rng.shuffle(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        card = self.order[index]
+        return {
+            'card': self.deck.pks[card],
+            'question': _construct(self.deck, self.opposite_face, card),
             'answers': [
-                _construct(card, answer_with, correct=True),
+                _construct(self.deck, self.answer_with, answer, correct=correct)
+                for answer, correct in self.answers(card)
             ]
         }
 
-        # do-while would be perfect
-        wrong_answers = sample(cards, num_of_choices - 1)
-        while card in wrong_answers:
-            wrong_answers = sample(cards, num_of_choices - 1)
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def answers(self, card):
+        """Card indexes of the shuffled answers, paired with whether they are the correct one."""
+
+        rng = Random((self.seed << 32) | card)
+        answers = [(card, True)]
+
+        # draw from every other card: indexes past the current one are shifted by one, no retries needed
+        for other in rng.sample(range(len(self) - 1), self.num_of_choices - 1):
+            answers.append((other + (other >= card), False))
+
+        rng.shuffle(answers)
+        return answers
+
+
+class QuestionBatch(Questions):
+    """
+    Quiz over a large deck, drawn with numpy. The question order, the distractors and the answer order are
+    all drawn for the whole deck at once as index arrays.
+    """
+
+    def __init__(self, deck, answer_with, seed=None):
+        rng = numpy.random.default_rng(seed)
+        size = len(deck.pks)
+        num_of_wrong_answers = max(min(size, 4) - 1, 0)
+
+        self.deck = deck
+        self.answer_with = answer_with
+        self.opposite_face = 'definition' if answer_with == 'term' else 'term'
+        self.order = rng.permutation(size)
 
-        for wrong_card in wrong_answers:
-            wrong_answer = _construct(wrong_card, answer_with, correct=False)
-            question['answers'].append(wrong_answer)
+        # distinct non-zero offsets from each card, so no card is ever its own distractor
+        offsets = numpy.empty((size, num_of_wrong_answers), dtype=numpy.int64)
+        for column in range(num_of_wrong_answers):
+            # draw from the offsets left, then step over the ones already taken in ascending order
+            drawn = rng.integers(1, size - column, size=size)
+            for taken in numpy.sort(offsets[:, :column], axis=1).T:
+                drawn += (drawn >= taken)
+            offsets[:, column] = drawn
 
-        shuffle(question['answers'])
-        questions.append(question)
+        cards = numpy.arange(size)
+        answers = numpy.concatenate((cards[:, None], (cards[:, None] + offsets) % size), axis=1)
+        self.answer_matrix = rng.permuted(answers, axis=1)
+        self.correct = self.answer_matrix == cards[:, None]
 
-    shuffle(questions)
-    return questions
+    def answers(self, card):
+        return zip(self.answer_matrix[card].tolist(), self.correct[card].tolist())
@@ -1,3 +1,1444 @@
-from django.test import TestCase
+"""
+Query and latency budgets of the views, and the routing of reads to replicas.
 
-# Create your tests here.
+Every URL of main/urls.py is requested against a seeded dataset of ``USERS * DECKS_PER_USER`` decks, with
+a deck of ``STUDY_DECK_CARDS`` cards to edit and study, and has to stay within its budget of queries and
+seconds, without running any query twice. The query budgets don't depend on the size of the data, so a
+view growing an N+1 query fails here. A URL without a budget fails too, so new views get one.
+
+The routing tests need replicas, each one is a separate SQLite database in the tests:
+
+    DATABASE_REPLICAS=replica1.sqlite3,replica2.sqlite3 python manage.py test main
+"""
+
+from collections import Counter, namedtuple
+from contextlib import ExitStack, contextmanager
+from datetime import date
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern
+from functools import partial
+from time import perf_counter
+from unittest import skipUnless
+from uuid import uuid4
+from . import imaging, testgen
+from .crypto import crypto
+from .models import Card, Deck, Task, Upload, User
+from .routers import PIN_KEY
+from .tasks import task
+from .urls import urlpatterns
+
+USERS = 20
+DECKS_PER_USER = 50
+CARDS_PER_DECK = 20
+STUDY_DECK_CARDS = 2000
+LATENCY = 0.5   # seconds, the default latency budget of a request
+
+# paths, data and setup requests are formatted with the seeded objects, see QueryBudgetTest.format,
+# data is either form fields or a JSON body
+Budget = namedtuple('Budget', ('method', 'path', 'queries', 'data', 'setup', 'seconds'))
+Budget.__new__.__defaults__ = (None, (), LATENCY)
+
+# by route, the setup requests put the session into the state the view expects
+BUDGETS = {
+    '': Budget('get', '/', 2),
+    'login/': Budget('get', '/login/', 2),
+    'register/': Budget('get', '/register/', 2),
+    'recovery/': Budget('get', '/recovery/', 2),
+    'search/<page>': Budget('post', '/search/1', 9, {'query': 'term'}),
+    'user/': Budget('get', '/user/', 3),
+    'user/<page>': Budget('get', '/user/1', 3),
+    'user/search/<page>': Budget(
+        'get', '/user/search/1', 6, setup=(('post', '/user/1', {'search': 'search', 'query': 'term'}), )
+    ),
+    'user/manage/': Budget('get', '/user/manage/', 2),
+    'checkout/': Budget('get', '/checkout/?checkout={other.username}', 5),
+    'checkout/<page>': Budget('get', '/checkout/1', 3, setup=(('get', '/checkout/?checkout={other.username}'), )),
+    'editor/': Budget('get', '/editor/', 4, setup=(('get', '/editor/?uuid={deck.uuid}'), ), seconds=2 * LATENCY),
+    'editor/uploads/': Budget('post', '/editor/uploads/', 3, '{{"name": "image.png", "size": 1024}}'),
+    'editor/uploads/<uuid:uuid>/': Budget('get', '/editor/uploads/{upload.uuid}/', 3),
+    'flashcards/': Budget(
+        'get', '/flashcards/', 7, setup=(('get', '/flashcards/?uuid={deck.uuid}'), ), seconds=2 * LATENCY
+    ),
+    'learn/': Budget('get', '/learn/', 6, setup=(('get', '/learn/?uuid={deck.uuid}'), )),
+    'learn/questions/': Budget(
+        'get', '/learn/questions/', 2, setup=(('get', '/learn/?uuid={deck.uuid}'), ('get', '/learn/'))
+    ),
+    'review/': Budget('get', '/review/', 8, setup=(('get', '/review/?uuid={deck.uuid}'), ), seconds=2 * LATENCY),
+    'review/answers/': Budget('post', '/review/answers/', 7, {'answers': '[{{"card": {card.pk}, "grade": 4}}]'}),
+    'key/': Budget('put', '/key/', 1),
+    'key/session/': Budget('post', '/key/session/', 4, {'key': '{session_key}'}),
+}
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from datetime import timedelta
+
+        # SQLite doesn't return the primary keys of bulk created rows, so they are read back
+        User.objects.bulk_create(User(username=f'user{i}', password='!') for i in range(USERS))
+        users = list(User.objects.order_by('pk'))
+        cls.user, cls.other = users[:2]
+
+        Deck.objects.bulk_create(
+            Deck(
+                user=user,
+                name=f'deck {i}',
+                description=f'description {i}',
+                uuid=uuid4(),
+                date_created=date(2021, 1, 1),
+                last_modified=date(2021, 1, 1) + timedelta(days=i),
+                card_count=CARDS_PER_DECK,
+            )
+            for user in users for i in range(DECKS_PER_USER)
+        )
+        Card.objects.bulk_create(
+            Card(deck_id=pk, term=f'term {i}', definition=f'definition {i}', position=i)
+            for pk in Deck.objects.values_list('pk', flat=True) for i in range(CARDS_PER_DECK)
+        )
+
+        cls.deck = Deck.objects.create(
+            user=cls.user, name='study', uuid=uuid4(), date_created=date(2021, 1, 1),
+            last_modified=date(2021, 1, 1), card_count=STUDY_DECK_CARDS
+        )
+        Card.objects.bulk_create(
+            Card(deck=cls.deck, term=f'term {i}', definition=f'definition {i}', position=i)
+            for i in range(STUDY_DECK_CARDS)
+        )
+        cls.card = Card.objects.filter(deck=cls.deck).first()
+        cls.upload = Upload.objects.create(user=cls.user, uuid=uuid4(), name='image.png', size=1024)
+
+        # loading, or even generating, the RSA keys doesn't count against the first request needing them
+        crypto.warm_up()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_every_url_has_a_budget(self):
+        routes = {str(pattern.pattern) for pattern in urlpatterns if isinstance(pattern, URLPattern)}
+        self.assertFalse(routes - BUDGETS.keys(), 'URLs without a budget')
+
+    def test_budgets(self):
+        for route, budget in BUDGETS.items():
+            with self.subTest(route=route):
+                self.client.logout()
+                self.client.force_login(self.user)
+                for method, path, *data in budget.setup:
+                    getattr(self.client, method)(self.format(path), *data)
+
+                request = partial(getattr(self.client, budget.method), self.format(budget.path))
+                if isinstance(budget.data, str):
+                    request = partial(request, self.format(budget.data), content_type='application/json')
+                elif budget.data:
+                    request = partial(request, {key: self.format(value) for key, value in budget.data.items()})
+
+                with CaptureQueriesContext(connection) as queries:
+                    start = perf_counter()
+                    response = request()
+                    elapsed = perf_counter() - start
+
+                self.assertLess(response.status_code, 400, response.content[:500])
+                self.assertLessEqual(
+                    len(queries), budget.queries,
+                    '\n'.join(query['sql'] for query in queries.captured_queries)
+                )
+                self.assertLessEqual(elapsed, budget.seconds)
+
+                executed = Counter(query['sql'] for query in queries.captured_queries)
+                self.assertFalse([sql for sql, times in executed.items() if times > 1], 'Repeated queries')
+
+    def format(self, text):
+        return text.format(
+            user=self.user, other=self.other, deck=self.deck, card=self.card, upload=self.upload,
+            session_key=self.session_key() if '{session_key}' in text else None,
+        )
+
+    def session_key(self):
+        """A field key encrypted like the browser does, see crypto.js."""
+
+        from Crypto.Cipher import PKCS1_v1_5
+        from base64 import b64encode
+
+        key = crypto.current
+        ciphertext = PKCS1_v1_5.new(key.keypair.public_key()).encrypt(b64encode(bytes(32)))
+        return f'{key.id}:{b64encode(ciphertext).decode()}'
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'No read replicas configured.')
+class ReplicaRoutingTest(TransactionTestCase):
+    """The replicas get a copy of the data with the decks renamed, so the pages tell where they were read from."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.user = User.objects.create(username='user', password='!')
+        self.other = User.objects.create(username='other', password='!')
+        self.deck, self.own = (
+            Deck.objects.create(
+                user=user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+            )
+            for user in (self.other, self.user)
+        )
+        Card.objects.bulk_create(Card(deck=deck, term='term', definition='definition') for deck in (self.deck, self.own))
+        self.replicate(name='replicated deck')
+        self.client.force_login(self.user)
+
+    def replicate(self, **changes):
+        for alias in settings.DATABASE_REPLICAS:
+            for model in (User, Deck, Card):
+                model.objects.using(alias).bulk_create(model.objects.using(DEFAULT_DB_ALIAS).all())
+            Deck.objects.using(alias).update(**changes)
+
+    def test_read_only_views_read_decks_from_a_replica(self):
+        pages = (
+            ('get', '/flashcards/?uuid={uuid}', '/flashcards/'),
+            ('get', '/learn/?uuid={uuid}', '/learn/'),
+            ('get', '/checkout/?checkout=other', '/checkout/1'),
+        )
+
+        for method, setup, path in pages:
+            with self.subTest(path=path):
+                getattr(self.client, method)(setup.format(uuid=self.deck.uuid))
+                with self.capture() as queries:
+                    response = self.client.get(path)
+
+                self.assertContains(response, 'replicated deck')
+                self.assertReadFromReplica(queries)
+
+        with self.capture() as queries:
+            response = self.client.post('/search/1', {'query': 'term'})
+        self.assertContains(response, 'replicated deck')
+        self.assertReadFromReplica(queries)
+
+    def test_saving_a_deck_pins_the_user_to_the_default_database(self):
+        with self.settings(CACHE_PAGES=True):
+            response = self.client.patch(
+                '/editor/', f'{{"uuid": "{self.own.uuid}", "version": 0, "name": "saved deck"}}',
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(Task.objects.filter(name='main.caching.invalidate').exists(), 'Pages cached meanwhile are kept')
+
+        self.client.get(f'/flashcards/?uuid={self.own.uuid}')
+        self.assertContains(self.client.get('/flashcards/'), 'saved deck')
+
+        # other users read from the replicas, which haven't caught up yet
+        other = self.client_class()
+        other.force_login(self.other)
+        other.get(f'/flashcards/?uuid={self.own.uuid}')
+        self.assertContains(other.get('/flashcards/'), 'replicated deck')
+
+        session = self.client.session
+        session[PIN_KEY] = 0
+        session.save()
+        self.assertContains(self.client.get('/flashcards/'), 'replicated deck')
+
+    @contextmanager
+    def capture(self):
+        """The queries of every database, by alias."""
+
+        with ExitStack() as stack:
+            yield {alias: stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections}
+
+    def assertReadFromReplica(self, queries):
+        def deck_queries(alias):
+            return [query['sql'] for query in queries[alias].captured_queries if 'main_deck' in query['sql']]
+
+        self.assertFalse(deck_queries(DEFAULT_DB_ALIAS))
+        self.assertTrue(any(deck_queries(alias) for alias in settings.DATABASE_REPLICAS))
+
+
+class SQLiteBackendTest(SimpleTestCase):
+    """The backend of main/backends/sqlite3 on a database file, the test database lives in memory without a journal."""
+
+    ALIAS = 'sqlite-file'
+
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_dict = {
+            **connection.settings_dict,
+            'ENGINE': 'main.backends.sqlite3', 'NAME': f'{directory.name}/db.sqlite3', 'OPTIONS': {'timeout': 5},
+        }
+
+        with self.connect() as cursor:
+            cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY)')
+
+    @contextmanager
+    def connect(self, backend=None):
+        """Cursor of a new connection of this thread, with the backend of the database or another one."""
+
+        from django.db.utils import load_backend
+
+        backend = backend or load_backend(self.settings_dict['ENGINE'])
+        connections[self.ALIAS] = backend.DatabaseWrapper(self.settings_dict, self.ALIAS)
+        try:
+            with connections[self.ALIAS].cursor() as cursor:
+                yield cursor
+        finally:
+            connections[self.ALIAS].close()
+            del connections[self.ALIAS]
+
+    def write_concurrently(self, backend=None):
+        """Errors of two transactions which both read before they write."""
+
+        from django.db import OperationalError
+        from django.db.transaction import atomic
+        from threading import Barrier, BrokenBarrierError, Thread
+
+        barrier = Barrier(2)
+        errors = []
+
+        def write():
+            try:
+                with self.connect(backend) as cursor, atomic(using=self.ALIAS):
+                    cursor.execute('SELECT COUNT(*) FROM counter')
+                    try:
+                        barrier.wait(timeout=0.5)   # the other transaction may be waiting for the lock meanwhile
+                    except BrokenBarrierError:
+                        pass
+                    cursor.execute('INSERT INTO counter DEFAULT VALUES')
+            except OperationalError as error:
+                errors.append(str(error))
+
+        threads = [Thread(target=write) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return errors
+
+    def test_journal_is_written_ahead(self):
+        with self.connect() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_concurrent_writers_wait_for_each_other(self):
+        from django.db.backends.sqlite3 import base
+
+        self.assertEqual(self.write_concurrently(), [])
+        with self.connect() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM counter')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+        # with a deferred BEGIN one of them fails at once instead
+        self.assertEqual(self.write_concurrently(base), ['database is locked'])
+
+
+class DeckLoaderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.deck = Deck.objects.create(
+            user=cls.user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        Card.objects.bulk_create(
+            Card(deck=cls.deck, term=f'term {i}', definition=f'definition {i}', position=i) for i in range(5)
+        )
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_decks_are_fetched_once_per_request(self):
+        from django.test import RequestFactory
+        from . import loaders
+
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(1):
+            deck = loaders.deck(request, self.deck.uuid, *loaders.STUDY_FIELDS)
+            self.assertIs(loaders.deck(request, str(self.deck.uuid)), deck)
+        self.assertIn('description', deck.get_deferred_fields())
+
+        with self.assertNumQueries(1):
+            self.assertIsNot(loaders.deck(RequestFactory().get('/'), self.deck.uuid), deck)
+        with self.assertRaises(Deck.DoesNotExist):
+            loaders.deck(request, uuid4())
+
+    def test_study_views_fetch_the_deck_once(self):
+        for path in ('/flashcards/', '/learn/', '/review/'):
+            with self.subTest(path=path):
+                self.client.get(f'{path}?uuid={self.deck.uuid}')
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(self.client.get(path).status_code, 200)
+                deck_queries = [query for query in queries.captured_queries if 'FROM "main_deck"' in query['sql']]
+                self.assertEqual(len(deck_queries), 1, deck_queries)
+
+    def test_repeated_queries_are_flagged(self):
+        from django.test import Client, RequestFactory
+        from django.http import HttpResponse
+        from .middleware import DUPLICATE_QUERIES_HEADER, DuplicateQueryMiddleware
+
+        def view(request):
+            for _ in range(3):
+                Deck.objects.filter(pk=self.deck.pk).exists()
+            return HttpResponse()
+
+        with self.settings(DEBUG=True):
+            client = Client()   # loads the middleware with the settings of the test
+            client.force_login(self.user)
+            client.get(f'/flashcards/?uuid={self.deck.uuid}')
+            self.assertEqual(client.get('/flashcards/')[DUPLICATE_QUERIES_HEADER], '0')
+
+            with self.assertLogs('main.middleware', 'WARNING') as logs:
+                response = DuplicateQueryMiddleware(view)(RequestFactory().get('/flashcards/'))
+            self.assertEqual(response[DUPLICATE_QUERIES_HEADER], '2')
+            self.assertIn('ran 3 times', logs.output[0])
+
+        self.client.get(f'/flashcards/?uuid={self.deck.uuid}')
+        self.assertNotIn(DUPLICATE_QUERIES_HEADER, self.client.get('/flashcards/'))
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.other = User.objects.create(username='other', password='!')
+        cls.verbs = Deck.objects.create(
+            user=cls.other, name='Spanish verbs', description='irregular', uuid=uuid4(),
+            date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        cls.own = Deck.objects.create(
+            user=cls.user, name='Spanish nouns', uuid=uuid4(), date_created=date(2021, 1, 1),
+            last_modified=date(2021, 1, 1)
+        )
+
+    def search(self, query, *filters):
+        from . import search
+        return [deck.pk for deck in search.decks(query, *filters)[:]]
+
+    def test_match_expression(self):
+        from .search import match_expression
+
+        self.assertEqual(match_expression('spa  "verbs"!'), '"spa"* "verbs"*')
+        self.assertIsNone(match_expression('?! -'))
+
+    def test_matches_every_word_as_prefix(self):
+        self.assertEqual(self.search('span verb'), [self.verbs.pk])
+        self.assertEqual(self.search('irreg'), [self.verbs.pk])
+        self.assertEqual(self.search('german'), [])
+        self.assertEqual(self.search('"'), [])
+
+    def test_filters(self):
+        from django.db.models import Q
+
+        self.assertEqual(self.search('spanish', ~Q(user=self.user)), [self.verbs.pk])
+        self.assertEqual(self.search('spanish', Q(user=self.user)), [self.own.pk])
+
+    def test_ranks_decks_by_hits(self):
+        from . import search
+
+        Card.objects.bulk_create([
+            Card(deck=self.own, term='hablar', definition='to speak', position=0),
+            Card(deck=self.own, term='comer', definition='to eat', position=1),
+            Card(deck=self.verbs, term='vivir', definition='to live', position=0),
+        ])
+        # the name of a deck is a hit too, and of two decks with as many hits the better bm25 rank wins
+        self.assertEqual(self.search('to'), [self.own.pk, self.verbs.pk])
+        self.assertEqual(self.search('verbs'), [self.verbs.pk])
+
+        results = search.decks('spanish')
+        self.assertEqual(len(results), 2)
+        self.assertEqual([deck.pk for deck in results[1:]], self.search('spanish')[1:])
+        self.assertEqual(results[2:], [])
+
+        deck, = search.decks('speak')[:]
+        self.assertEqual([card.term for card in deck.matching_cards], ['hablar'])
+
+    def test_triggers_keep_the_index_in_sync(self):
+        self.verbs.name = 'French verbs'
+        self.verbs.save()
+        self.assertEqual(self.search('french'), [self.verbs.pk])
+        self.assertEqual(self.search('spanish'), [self.own.pk])
+
+        # bulk updates bypass the model signals
+        Deck.objects.filter(pk=self.own.pk).update(name='German nouns')
+        self.assertEqual(self.search('german'), [self.own.pk])
+
+        self.verbs.delete()
+        self.assertEqual(self.search('french'), [])
+
+
+class KeysetPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        # pairs of decks modified on the same day, so the id has to break ties
+        Deck.objects.bulk_create(
+            Deck(
+                user=cls.user, name=f'deck {i}', uuid=uuid4(), date_created=date(2021, 1, 1),
+                last_modified=date(2021, 1, 1 + i // 2)
+            )
+            for i in range(11)
+        )
+        cls.ordered = list(Deck.objects.order_by('-last_modified', '-pk').values_list('pk', flat=True))
+
+    def test_pages_forward_and_back(self):
+        from .paging import FIRST_PAGE, KeysetPaginator
+
+        paginator = KeysetPaginator(Deck.objects.all(), 3)
+        pages = [paginator.page(FIRST_PAGE)]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_page_number()))
+
+        self.assertEqual([deck.pk for page in pages for deck in page], self.ordered)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 2])
+        self.assertFalse(pages[0].has_previous())
+
+        back = [pages[-1]]
+        while back[-1].has_previous():
+            back.append(paginator.page(back[-1].previous_page_number()))
+        self.assertEqual([[deck.pk for deck in page] for page in reversed(back)], [[d.pk for d in p] for p in pages])
+        self.assertEqual(paginator.count, 11)
+
+    def test_invalid_cursor(self):
+        from django.core.paginator import InvalidPage
+        from .paging import KeysetPaginator, encode_cursor
+
+        paginator = KeysetPaginator(Deck.objects.all(), 3)
+        for cursor in ('garbage', encode_cursor('x', Deck.objects.first()), '2'):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidPage):
+                paginator.page(cursor)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/user/garbage').status_code, 404)
+
+
+class EditorPatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.other = User.objects.create(username='other', password='!')
+        cls.deck = Deck.objects.create(
+            user=cls.user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1),
+            version=3
+        )
+        Card.objects.bulk_create(
+            Card(deck=cls.deck, term=f'term {i}', definition=f'definition {i}', position=i) for i in range(3)
+        )
+        cls.cards = list(Card.objects.filter(deck=cls.deck))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def patch(self, **data):
+        from json import dumps
+        data = dumps({'uuid': str(self.deck.uuid), **data})
+        return self.client.patch('/editor/', data, content_type='application/json')
+
+    def test_applies_the_operations(self):
+        first, second, third = self.cards
+        response = self.patch(version=3, name='renamed', operations=[
+            {'op': 'add', 'term': 'new', 'definition': 'card', 'position': 0},
+            {'op': 'update', 'pk': first.pk, 'definition': 'changed'},
+            {'op': 'remove', 'pk': second.pk},
+            {'op': 'reorder', 'positions': {str(first.pk): 2, str(third.pk): 1}},
+        ])
+
+        self.assertEqual(response.json(), {'version': 4})
+        self.deck.refresh_from_db()
+        self.assertEqual((self.deck.name, self.deck.version), ('renamed', 4))
+        self.assertEqual(
+            list(Card.objects.filter(deck=self.deck).values_list('term', 'definition')),
+            [('new', 'card'), ('term 2', 'definition 2'), ('term 0', 'changed')]
+        )
+
+    def test_stale_version_conflicts(self):
+        response = self.patch(version=2, operations=[{'op': 'remove', 'pk': self.cards[0].pk}])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 3)
+        self.assertEqual(Card.objects.filter(deck=self.deck).count(), 3)
+
+    def test_only_cards_of_own_decks_change(self):
+        other = Deck.objects.create(
+            user=self.other, name='other', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        card = Card.objects.create(deck=other, term='term', definition='definition')
+
+        self.assertEqual(self.patch(version=3, operations=[{'op': 'remove', 'pk': card.pk}]).status_code, 200)
+        self.assertTrue(Card.objects.filter(pk=card.pk).exists())
+
+        self.deck = other
+        self.assertEqual(self.patch(version=0).status_code, 404)
+
+    def test_invalid_requests(self):
+        invalid = ({}, {'version': 3, 'operations': [{'op': 'rename'}]}, {'version': 3, 'operations': [{'op': 'remove'}]})
+        for data in invalid:
+            with self.subTest(data=data):
+                self.assertEqual(self.patch(**data).status_code, 400)
+        self.assertEqual(Card.objects.filter(deck=self.deck).count(), 3)
+
+
+class QuizCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.deck = Deck.objects.create(
+            user=cls.user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        Card.objects.bulk_create(
+            Card(deck=cls.deck, term=f'term {i}', definition=f'definition {i}', position=i) for i in range(5)
+        )
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_compiled_decks_are_cached_by_version(self):
+        from . import testgen
+
+        compiled = testgen.compile_deck(self.deck.uuid, self.deck.version)
+        self.assertEqual(compiled.term, tuple(f'term {i}' for i in range(5)))
+        with self.assertNumQueries(0):
+            self.assertEqual(testgen.compile_deck(self.deck.uuid, self.deck.version), compiled)
+
+        # another process saving the deck doesn't delete the entries of this one, the new version isn't cached yet
+        Card.objects.filter(deck=self.deck, position=0).update(term='changed')
+        Deck.objects.filter(pk=self.deck.pk).update(version=self.deck.version + 1)
+        self.assertEqual(testgen.compile_deck(self.deck.uuid, self.deck.version + 1).term[0], 'changed')
+
+    def test_saving_frees_the_cached_versions(self):
+        from django.core.cache import cache
+        from . import testgen
+
+        testgen.compile_deck(self.deck.uuid, self.deck.version)
+        self.deck.version += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            self.deck.save()
+        self.assertIsNone(cache.get(testgen._cache_key(self.deck.uuid, self.deck.version - 1)))
+
+    def test_questions_follow_the_version_of_the_learn_session(self):
+        from json import dumps
+
+        self.client.get(f'/learn/?uuid={self.deck.uuid}')
+        self.client.get('/learn/')
+        self.assertEqual(self.client.get('/learn/questions/').json()['total'], 5)
+
+        self.client.patch('/editor/', dumps({
+            'uuid': str(self.deck.uuid),
+            'version': 0,
+            'operations': [{'op': 'add', 'term': 'term', 'definition': 'definition', 'position': 5}],
+        }), content_type='application/json')
+        self.client.get('/learn/')
+        self.assertEqual(self.client.get('/learn/questions/').json()['total'], 6)
+
+    def test_questions_need_a_learn_session(self):
+        self.assertEqual(self.client.get('/learn/questions/').status_code, 404)
+
+
+class PageCacheTest(TestCase):
+    """The pages are cached with a single process in the tests, the invalidations reach it without a shared cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.other = User.objects.create(username='other', password='!')
+        cls.deck = Deck.objects.create(
+            user=cls.other, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        Card.objects.create(deck=cls.deck, term='term', definition='definition')
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def stats(self, namespace):
+        from .caching import stats
+        return stats()[namespace]
+
+    def save(self, **changes):
+        deck = Deck.objects.get(pk=self.deck.pk)
+        for field, value in {'version': deck.version + 1, **changes}.items():
+            setattr(deck, field, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            deck.save()
+
+    def test_fragments_are_keyed_by_the_deck_version_and_modification(self):
+        self.client.get('/checkout/?checkout=other')
+        self.client.get('/checkout/1')
+        self.assertContains(self.client.get('/checkout/1'), 'deck')
+        self.assertEqual(self.stats('fragments'), {'hits': 1, 'misses': 1})
+
+        self.save(name='renamed deck')
+        self.assertContains(self.client.get('/checkout/1'), 'renamed deck')
+        self.assertEqual(self.stats('fragments'), {'hits': 1, 'misses': 2})
+
+        Deck.objects.filter(pk=self.deck.pk).update(name='touched deck', last_modified=date(2021, 1, 2))
+        self.assertContains(self.client.get('/checkout/1'), 'touched deck')
+        self.assertEqual(self.stats('fragments'), {'hits': 1, 'misses': 3})
+
+        # the search results show matching cards and the owner, so they don't share the fragment of the listing
+        self.client.post('/search/1', {'query': 'term'})
+        self.assertEqual(self.stats('fragments'), {'hits': 1, 'misses': 4})
+
+    def test_pages_are_invalidated_on_save_and_delete(self):
+        from django.core.cache import cache
+
+        pages = (
+            ('checkout', lambda: self.client.get('/checkout/?checkout=other'), lambda: self.client.get('/checkout/1')),
+            ('search', lambda: self.client.post('/search/1', {'query': 'term'}), lambda: self.client.get('/search/1')),
+        )
+
+        with self.settings(CACHE_PAGES=True):
+            for name, setup, request in pages:
+                with self.subTest(page=name):
+                    setup()
+                    cache.clear()
+
+                    self.assertContains(request(), 'deck')
+                    self.assertContains(request(), 'deck')
+                    self.assertEqual(self.stats('pages'), {'hits': 1, 'misses': 1})
+
+                    self.save(name='renamed deck')
+                    self.assertContains(request(), 'renamed deck')
+                    self.assertEqual(self.stats('pages'), {'hits': 1, 'misses': 2})
+
+                    with self.captureOnCommitCallbacks(execute=True):
+                        Deck.objects.filter(pk=self.deck.pk).delete()
+                    self.assertNotContains(request(), 'renamed deck')
+                    self.assertEqual(self.stats('pages'), {'hits': 1, 'misses': 3})
+
+                    # restored for the next page
+                    self.deck.save()
+                    Card.objects.create(deck=self.deck, term='term', definition='definition')
+
+    def test_pages_are_not_cached_by_default(self):
+        self.client.get('/checkout/?checkout=other')
+        self.client.get('/checkout/1')
+        self.client.get('/checkout/1')
+        self.assertEqual(self.stats('pages'), {'hits': 0, 'misses': 0})
+
+    def test_invalidation_does_not_query_the_owner(self):
+        deck = Deck.objects.get(pk=self.deck.pk)
+        with self.settings(CACHE_PAGES=True, DATABASE_REPLICAS=[]), self.assertNumQueries(1):
+            deck.save()
+
+    def test_pages_are_invalidated_again_once_the_replicas_caught_up(self):
+        from django.utils import timezone
+        from . import caching, tasks
+
+        with self.settings(DATABASE_REPLICAS=['replica1']):
+            self.save()
+            self.assertFalse(Task.objects.exists(), 'Nothing to invalidate without cached pages')
+
+            with self.settings(CACHE_PAGES=True):
+                self.save()
+                generation = caching.generation(caching.SEARCH_SCOPE)
+                job = Task.objects.get(name='main.caching.invalidate')
+                self.assertGreater(job.run_at, timezone.now())
+
+                self.assertTrue(tasks.run(tasks.claim(job.run_at)))
+                self.assertEqual(caching.generation(caching.SEARCH_SCOPE), generation + 1)
+
+    def test_pages_need_a_shared_cache(self):
+        from tempfile import TemporaryDirectory
+        from .checks import check_page_cache
+
+        with self.settings(CACHE_PAGES=True):
+            self.assertEqual([message.id for message in check_page_cache(None)], ['main.E001'])
+
+        with TemporaryDirectory() as location, self.settings(CACHE_PAGES=True, CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        }}):
+            self.assertEqual(check_page_cache(None), [])
+
+
+class QuestionGeneratorTest(TestCase):
+    SIZES = (1, 2, 3, 10, 57)    # decks with fewer cards than choices too
+
+    def compile(self, size):
+        from .testgen import CompiledDeck
+        return CompiledDeck(
+            pks=tuple(range(100, 100 + size)), term=tuple(f'term {i}' for i in range(size)), term_image=(None, ) * size,
+            definition=tuple(f'definition {i}' for i in range(size)), definition_image=(None, ) * size,
+        )
+
+    def assertValidQuiz(self, questions, deck):
+        size = len(deck.pks)
+        self.assertEqual(len(questions), size)
+        self.assertEqual(sorted(question['card'] for question in questions), list(deck.pks))
+
+        for question in questions:
+            card = deck.pks.index(question['card'])
+            answers = question['answers']
+            self.assertEqual(question['question']['text'], deck.definition[card])
+            self.assertEqual(len(answers), min(size, 4))
+            self.assertEqual([answer['text'] for answer in answers if answer['correct']], [deck.term[card]])
+            # no distractor is the correct answer, or another distractor
+            self.assertEqual(len({answer['text'] for answer in answers}), len(answers))
+
+    def test_questions(self):
+        from .testgen import Questions
+
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                deck = self.compile(size)
+                questions = Questions(deck, 'term', seed=1)
+                self.assertValidQuiz(list(questions), deck)
+                self.assertEqual(questions[:], Questions(deck, 'term', seed=1)[:])
+
+    @skipUnless(testgen.numpy, 'numpy is not installed.')
+    def test_question_batch(self):
+        from .testgen import QuestionBatch
+
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                deck = self.compile(size)
+                batch = QuestionBatch(deck, 'term', seed=1)
+                self.assertEqual(batch.answer_matrix.shape, (size, min(size, 4)))
+                self.assertEqual(batch.correct.shape, batch.answer_matrix.shape)
+                self.assertEqual(batch.correct.sum(axis=1).tolist(), [1] * size)
+                self.assertEqual(sorted(batch.order.tolist()), list(range(size)))
+
+                self.assertValidQuiz(list(batch), deck)
+                # a page is built without the questions before it, and the same seed gives the same quiz
+                self.assertEqual(batch[size // 2:], list(QuestionBatch(deck, 'term', seed=1))[size // 2:])
+
+
+class SchedulerTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.deck = Deck.objects.create(
+            user=cls.user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        Card.objects.bulk_create(
+            Card(deck=cls.deck, term=f'term {i}', definition=f'definition {i}', position=i) for i in range(4)
+        )
+        cls.cards = list(Card.objects.filter(deck=cls.deck))
+
+    def test_sm2_steps(self):
+        from datetime import datetime, timedelta, timezone
+        from .models import Review
+        from .scheduler import MIN_EASE, RELEARN_DELAY, schedule
+
+        now = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        review = Review()
+        steps = [(schedule(review, 5, now).interval, review.repetitions) for _ in range(3)]
+        # the interval grows by the ease before the answer
+        self.assertEqual(steps, [(1, 1), (6, 2), (round(6 * 2.7), 3)])
+        self.assertAlmostEqual(review.ease, 2.8)
+        self.assertEqual(review.due_at, now + timedelta(days=review.interval))
+
+        schedule(review, 1, now)
+        self.assertEqual((review.interval, review.repetitions, review.lapses), (0, 0, 1))
+        self.assertEqual(review.due_at, now + RELEARN_DELAY)
+
+        for _ in range(10):
+            schedule(review, 0, now)
+        self.assertEqual(review.ease, MIN_EASE)
+
+    def test_due_cards(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import scheduler
+
+        first, second, *new = self.cards
+        answers = [{'card': first.pk, 'grade': 1}, {'card': second.pk, 'grade': 5}]
+        self.assertEqual(scheduler.record(self.user, answers), 2)
+
+        # the failed card is due again after the relearn delay, the passed one tomorrow
+        later = timezone.now() + scheduler.RELEARN_DELAY + timedelta(seconds=1)
+        self.assertEqual([review.card for review in scheduler.due(self.user, self.deck, now=later)], [first])
+        self.assertEqual(scheduler.due_cards(self.user, self.deck), new)
+        self.assertEqual(scheduler.due_cards(self.user, self.deck, new_limit=1), new[:1])
+
+    def test_answers(self):
+        self.client.force_login(self.user)
+        card = self.cards[0]
+
+        answers = f'[{{"card": {card.pk}, "grade": 4}}, {{"card": 0, "grade": 4}}]'
+        self.assertEqual(self.client.post('/review/answers/', {'answers': answers}).json(), {'recorded': 1})
+        self.client.post('/review/answers/', {'answers': f'[{{"card": {card.pk}, "grade": 4}}]'})
+        self.assertEqual(card.review_set.get().repetitions, 2)
+
+        for answers in ('[{"card": 1, "grade": 6}]', '[{"card": 1}]', 'garbage'):
+            with self.subTest(answers=answers):
+                self.assertEqual(self.client.post('/review/answers/', {'answers': answers}).status_code, 400)
+
+        self.client.logout()
+        self.assertEqual(self.client.post('/review/answers/', {'answers': '[]'}).status_code, 403)
+
+
+class TemporaryMediaMixin:
+    """Stores the files of every test in a directory of its own."""
+
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+
+        super().setUp()
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class ImageStorageTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.deck = Deck.objects.create(
+            user=cls.user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+
+    def store(self, content, name='image.png'):
+        from django.core.files.base import ContentFile
+        from .storage import image_storage
+        return image_storage.save(name, ContentFile(content))
+
+    def refcount(self, name):
+        from .models import StoredImage
+        return StoredImage.objects.get(name=name).refcount
+
+    def test_identical_images_are_stored_once(self):
+        from hashlib import sha256
+        from .storage import image_storage
+
+        name = self.store(b'image')
+        self.assertEqual(name, sha256(b'image').hexdigest() + '.png')
+        self.assertEqual(self.store(b'image', 'copy.PNG'), name)
+        self.assertNotEqual(self.store(b'other'), name)
+        self.assertEqual(sorted(image_storage.listdir('')[1]), sorted([name, self.store(b'other')]))
+
+    def test_triggers_count_references(self):
+        from .models import StoredImage
+        from .storage import recount
+
+        name, other = self.store(b'image'), self.store(b'other')
+        first = Card.objects.create(deck=self.deck, term='term', definition='definition', term_image=name)
+        Card.objects.create(deck=self.deck, term='term', definition='definition', definition_image=name)
+        self.assertEqual(self.refcount(name), 2)
+
+        first.term_image = other
+        first.save()
+        self.assertEqual((self.refcount(name), self.refcount(other)), (1, 1))
+
+        Card.objects.filter(deck=self.deck).delete()
+        self.assertEqual((self.refcount(name), self.refcount(other)), (0, 0))
+
+        Card.objects.create(deck=self.deck, term='term', definition='definition', term_image=name)
+        StoredImage.objects.update(refcount=5)
+        recount()
+        self.assertEqual((self.refcount(name), self.refcount(other)), (1, 0))
+
+    def test_summaries_count_shared_images_once(self):
+        from unittest import mock
+        from . import summaries
+
+        name, other = self.store(b'image'), self.store(b'other image')
+        Card.objects.create(deck=self.deck, term='first', definition='definition', term_image=name)
+        Card.objects.create(deck=self.deck, term='second', definition='definition', definition_image=name)
+        Card.objects.create(deck=self.deck, term='third', definition='definition', definition_image=other)
+
+        # summed up from the stored sizes, the files aren't accessed
+        with mock.patch('os.stat', side_effect=AssertionError), self.assertNumQueries(3):
+            summary = summaries.compute(self.deck.pk)
+        self.assertEqual((summary['card_count'], summary['image_bytes']), (3, len(b'image') + len(b'other image')))
+
+    def test_collects_unreferenced_images_after_the_grace_period(self):
+        from .cleaner import collect_unreferenced
+        from .storage import image_storage
+
+        used, unused = self.store(b'used'), self.store(b'unused')
+        Card.objects.create(deck=self.deck, term='term', definition='definition', term_image=used)
+
+        report = collect_unreferenced()
+        self.assertEqual((report.removed, report.recent), (0, 1))
+
+        report = collect_unreferenced(dry_run=True, grace_period=-1)
+        self.assertEqual((report.removed, report.bytes_reclaimed), (1, len(b'unused')))
+        self.assertTrue(image_storage.exists(unused))
+
+        collect_unreferenced(grace_period=-1)
+        self.assertTrue(image_storage.exists(used))
+        self.assertFalse(image_storage.exists(unused))
+
+        # storing the image again brings back its file along with its row
+        self.assertEqual(self.store(b'unused'), unused)
+        self.assertTrue(image_storage.exists(unused))
+        self.assertEqual(self.refcount(unused), 0)
+
+
+@skipUnless(imaging.available(), 'Pillow is not installed.')
+class ImageProcessingTest(TemporaryMediaMixin, TestCase):
+    def test_oversized_images_get_capped_variants(self):
+        import json
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from io import BytesIO
+        from . import tasks
+        from .models import StoredImage
+        from .storage import image_storage
+        from .templatetags.media import media
+
+        content = BytesIO()
+        Image.new('RGB', (3000, 1500), 'red').save(content, 'PNG')
+        name = image_storage.save('image.png', SimpleUploadedFile('image.png', content.getvalue()))
+        self.assertEqual(StoredImage.objects.get(name=name).size, len(content.getvalue()))
+
+        # processed by a task, not while storing
+        self.assertEqual(imaging.widths(name), ())
+        job = tasks.claim()
+        self.assertEqual((job.name, json.loads(job.arguments)), ('main.imaging.process', [[name], {}]))
+        self.assertTrue(tasks.run(job))
+        self.assertFalse(imaging.process(name))     # already done
+
+        self.assertEqual(imaging.widths(name), imaging.WIDTHS)
+        for width in imaging.WIDTHS:
+            for extension, image_format in imaging.FORMATS.items():
+                with Image.open(imaging.variants_path(name) + f'/{width}.{extension}') as variant:
+                    self.assertEqual((variant.format, variant.size), (image_format, (width, width // 2)))
+
+        image = Card(term_image=name).term_image
+        self.assertEqual(media(image, 'thumbnail'), imaging.url(name, 128, 'jpg'))
+        self.assertEqual(media(image, 'webp').count('w, '), len(imaging.WIDTHS) - 1)
+
+    def test_images_pillow_cannot_read_are_served_as_uploaded(self):
+        from django.core.files.base import ContentFile
+        from .storage import image_storage
+
+        name = image_storage.save('image.png', ContentFile(b'not an image'))
+        self.assertFalse(imaging.process(name))
+        self.assertEqual(imaging.widths(name), ())
+
+
+class ChunkedUploadTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+        cls.other = User.objects.create(username='other', password='!')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def start(self, name='image.png', size=10):
+        from json import dumps
+        return self.client.post('/editor/uploads/', dumps({'name': name, 'size': size}), content_type='application/json')
+
+    def send(self, id, content, first, size=10):
+        path = f'/editor/uploads/{id}/'
+        return self.client.put(path, content, content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {first}-{first + len(content) - 1}/{size}')
+
+    def test_resumable_upload(self):
+        from .storage import image_storage
+
+        response = self.start()
+        self.assertEqual(response.status_code, 201)
+        id = response.json()['id']
+
+        self.assertEqual(self.send(id, b'01234', 0).json()['offset'], 5)
+        # a chunk leaving a gap is refused with the offset to resume from, a repeated chunk is fine
+        response = self.send(id, b'89', 8)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 5))
+        self.assertEqual(self.send(id, b'34', 3).json()['offset'], 5)
+        self.assertEqual(self.client.get(f'/editor/uploads/{id}/').json()['offset'], 5)
+
+        self.assertEqual(self.send(id, b'56789', 5).json()['offset'], 10)
+        upload = Upload.objects.get(uuid=id)
+        with image_storage.open(upload.image) as file:
+            self.assertEqual(file.read(), b'0123456789')
+
+    def test_invalid_uploads(self):
+        for name, size in (('image.gif', 10), ('image.png', 0), ('image.png', 'ten')):
+            with self.subTest(name=name, size=size):
+                self.assertEqual(self.start(name, size).status_code, 400)
+
+        id = self.start().json()['id']
+        self.assertEqual(self.send(id, b'0123456789', 0, size=20).status_code, 400)
+        self.assertEqual(self.client.put(f'/editor/uploads/{id}/', b'0').status_code, 400)
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(f'/editor/uploads/{id}/').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.start().status_code, 403)
+
+    def test_decks_only_use_finished_uploads_of_their_user(self):
+        from json import dumps
+
+        unfinished = self.start().json()['id']
+        card = {
+            'term': 'term', 'term_image': 'image.png', 'term_upload': unfinished,
+            'definition': 'definition', 'definition_image': '',
+        }
+        deck = {'name': 'deck', 'description': '', 'cards': [card]}
+
+        response = self.client.post('/editor/', {'deck': dumps(deck)})
+        self.assertRedirects(response, '/editor', fetch_redirect_response=False)
+        self.assertFalse(Deck.objects.exists())
+
+        id = self.start().json()['id']
+        self.send(id, b'0123456789', 0)
+        card['term_upload'] = id
+        self.assertRedirects(self.client.post('/editor/', {'deck': dumps(deck)}), '/user', target_status_code=301)
+        self.assertTrue(Card.objects.get().term_image.name.endswith('.png'))
+
+        operation = {'op': 'add', 'term': 'term', 'definition': 'definition', 'position': 1, 'term_upload': unfinished}
+        data = dumps({'uuid': str(Deck.objects.get().uuid), 'version': 0, 'operations': [operation]})
+        self.assertEqual(self.client.patch('/editor/', data, content_type='application/json').status_code, 400)
+
+        self.client.force_login(self.other)
+        self.assertRedirects(
+            self.client.post('/editor/', {'deck': dumps(deck)}), '/editor', fetch_redirect_response=False
+        )
+        self.assertEqual(Deck.objects.count(), 1)
+
+
+class EditorSaveTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='user', password='!')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def create_deck(self, size):
+        deck = Deck.objects.create(
+            user=self.user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        Card.objects.bulk_create(
+            Card(deck=deck, term=f'term {i}', definition=f'definition {i}', position=i) for i in range(size)
+        )
+        return deck
+
+    def save(self, deck, cards, files):
+        """Saves the deck like the editor does, new files are uploaded in the order of their cards."""
+
+        from json import dumps
+        data = {'uuid': str(deck.uuid), 'version': deck.version, 'name': 'saved', 'description': '', 'cards': cards}
+        return self.client.post('/editor/', {'deck': dumps(data), **files})
+
+    def edit(self, deck):
+        """
+        The cards of the deck with the first one changed and given a new term image, the last one deleted and a
+        new one added, with images, at the end. Files of a deck are told apart by its number of cards.
+        """
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        size = Card.objects.filter(deck=deck).count()
+        cards = [
+            {'pk': pk, 'term': term, 'term_image': '', 'definition': definition, 'definition_image': ''}
+            for pk, term, definition in Card.objects.filter(deck=deck).values_list('pk', 'term', 'definition')
+        ]
+        cards[0].update(term='changed', term_image='first.png')
+        cards[-1] = {'term': 'new', 'term_image': 'new.png', 'definition': 'card', 'definition_image': 'new.jpg'}
+
+        files = {
+            'term-image': [SimpleUploadedFile(name, f'{name} {size}'.encode()) for name in ('first.png', 'new.png')],
+            'definition-image': [SimpleUploadedFile('new.jpg', f'new.jpg {size}'.encode())],
+        }
+        return cards, files
+
+    def test_updates_deletes_and_creates_cards(self):
+        deck = self.create_deck(3)
+        self.assertRedirects(self.save(deck, *self.edit(deck)), '/user', target_status_code=301)
+
+        cards = list(Card.objects.filter(deck=deck).order_by('position'))
+        self.assertEqual([(card.term, card.position) for card in cards], [('changed', 0), ('term 1', 1), ('new', 2)])
+        contents = [
+            [image.read() if image else None for image in (card.term_image, card.definition_image)] for card in cards
+        ]
+        self.assertEqual(contents, [[b'first.png 3', None], [None, None], [b'new.png 3', b'new.jpg 3']])
+        deck.refresh_from_db()
+        self.assertEqual((deck.name, deck.version, deck.card_count), ('saved', 1, 3))
+
+    def test_query_count_does_not_depend_on_the_deck_size(self):
+        counts = []
+        for size in (3, 300):
+            deck = self.create_deck(size)
+            edit = self.edit(deck)
+            with CaptureQueriesContext(connection) as queries:
+                self.save(deck, *edit)
+
+            executed = Counter(query['sql'] for query in queries.captured_queries)
+            self.assertFalse([sql for sql, times in executed.items() if times > 1], 'Repeated queries')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+@task(max_attempts=2)
+def failing_task(message):
+    raise RuntimeError(message)
+
+
+class TaskQueueTest(TemporaryMediaMixin, TestCase):
+    def test_claimed_tasks_are_locked(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import tasks
+
+        job = tasks.enqueue('main.tests.failing_task', ['broken'])
+        claimed = tasks.claim()
+        self.assertEqual((claimed.pk, claimed.attempts), (job.pk, 1))
+        self.assertIsNone(tasks.claim())
+
+        # the lease of a dead worker runs out
+        self.assertEqual(tasks.claim(timezone.now() + tasks.LEASE + timedelta(seconds=1)).pk, job.pk)
+        with self.assertRaises(LookupError):
+            tasks.enqueue('main.tests.unknown')
+
+    def test_failed_tasks_back_off_then_fail(self):
+        from django.utils import timezone
+        from . import tasks
+
+        job = tasks.enqueue('main.tests.failing_task', ['broken'])
+        self.assertFalse(tasks.run(tasks.claim()))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_until), (Task.PENDING, None))
+        self.assertGreater(job.run_at, timezone.now() + tasks.BACKOFF / 2)
+        self.assertIn('RuntimeError: broken', job.error)
+
+        self.assertFalse(tasks.run(tasks.claim(job.run_at)))
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+        self.assertIsNone(tasks.claim(job.run_at))
+
+        self.assertEqual(tasks.retry_failed(), 1)
+        self.assertEqual(tasks.claim().attempts, 1)
+
+    def test_each_occurrence_is_queued_once(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from unittest import mock
+        from . import cron
+        from .models import Schedule
+
+        later = timezone.now() + timedelta(days=8)
+        cron.sync()
+        due = Schedule.objects.get(name='media-cleanup').next_run
+
+        # a process failing to queue the run leaves the occurrence to the others
+        with mock.patch.object(cron.run_job, 'delay', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            cron.tick(later, force=True)
+        self.assertEqual(Schedule.objects.get(name='media-cleanup').next_run, due)
+
+        self.assertEqual(cron.tick(later, force=True), ['media-cleanup'])
+        self.assertEqual(cron.tick(later, force=True), [])
+        self.assertEqual(Task.objects.filter(name='main.cron.run_job').count(), 1)
+        self.assertGreater(Schedule.objects.get(name='media-cleanup').next_run, later)
+
+    def test_missing_workers_are_reported(self):
+        from .checks import check_task_workers
+
+        with self.settings(TASK_WORKERS=0):
+            self.assertEqual([message.id for message in check_task_workers(None)], ['main.W001'])
+        with self.settings(TASK_WORKERS=1):
+            self.assertEqual(check_task_workers(None), [])
+
+    def test_scheduled_cleanup_removes_unreferenced_images(self):
+        import os
+        from datetime import timedelta
+        from django.core.files.base import ContentFile
+        from django.utils import timezone
+        from . import cleaner, cron, tasks
+        from .models import StoredImage
+        from .storage import image_storage
+
+        used, unused, recent = (image_storage.save('image.png', ContentFile(content)) for content in (b'1', b'2', b'3'))
+        user = User.objects.create(username='user', password='!')
+        deck = Deck.objects.create(
+            user=user, name='deck', uuid=uuid4(), date_created=date(2021, 1, 1), last_modified=date(2021, 1, 1)
+        )
+        Card.objects.create(deck=deck, term='term', definition='definition', term_image=used)
+        StoredImage.objects.exclude(name=recent).update(
+            created=timezone.now() - timedelta(seconds=2 * cleaner.GRACE_PERIOD)
+        )
+        Task.objects.all().delete()     # the processing of the stored images
+
+        later = timezone.now() + timedelta(days=8)
+        cron.sync()
+        self.assertEqual(cron.tick(later, force=True), ['media-cleanup'])
+        self.assertTrue(tasks.run(tasks.claim(later)))
+
+        self.assertEqual([image_storage.exists(name) for name in (used, unused, recent)], [True, False, True])
+        self.assertEqual(set(StoredImage.objects.values_list('name', flat=True)), {used, recent})
+
+        # where the references aren't counted every file is checked against the cards instead
+        orphan = image_storage.save('image.png', ContentFile(b'4'))
+        for name in (used, orphan):
+            os.utime(image_storage.path(name), (0, 0))
+        self.assertEqual(cleaner.file_cleanup().removed, 1)
+        self.assertEqual([image_storage.exists(name) for name in (used, orphan, recent)], [True, False, True])
+
+    def test_runs_are_recorded_once(self):
+        from unittest import mock
+        from . import cron
+        from .models import JobRun
+
+        cron.sync()
+        with mock.patch('main.cleaner.cleanup') as cleanup:
+            cron.run_job('media-cleanup', '2021-01-01T17:00:00+00:00')
+            cron.run_job('media-cleanup', '2021-01-01T17:00:00+00:00')
+        self.assertEqual(cleanup.call_count, 1)
+        self.assertEqual(JobRun.objects.get().error, '')
+
+
+class SensitiveFormTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('sensitive', 'sensitive@example.com', 'password')
+
+    def test_undecryptable_forms_are_sent_back(self):
+        from django.contrib.messages import get_messages
+
+        forms = [
+            ('/login/', {'username': 'sensitive', 'password': 'not encrypted'}),
+            ('/register/', {'username': 'new', 'password1': f'{uuid4().hex}:AAAA', 'password2': 'AAAA'}),
+            # no field key in the session
+            ('/user/manage/', {'change': 'password', 'old_password': 'aes:AAAA:AAAA'}),
+        ]
+        self.client.force_login(self.user)
+        for path, data in forms:
+            with self.subTest(path):
+                response = self.client.post(path, data)
+                self.assertRedirects(response, path, fetch_redirect_response=False)
+                self.assertTrue([str(message) for message in get_messages(response.wsgi_request)])
+        self.assertFalse(User.objects.filter(username='new').exists())
+
+
+class RSAKeyTest(TestCase):
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+        from unittest import mock
+        from .crypto import Crypto
+
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patch = mock.patch.object(Crypto, 'RSA_KEY', f'{directory.name}/rsa.pem')
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.crypto = Crypto(1024)
+
+    def encrypt(self, text, key=None, prefix=True):
+        from Crypto.Cipher import PKCS1_v1_5
+        from base64 import b64encode
+
+        key = key or self.crypto.current
+        ciphertext = b64encode(PKCS1_v1_5.new(key.keypair.public_key()).encrypt(text.encode())).decode()
+        return f'{key.id}:{ciphertext}' if prefix else ciphertext
+
+    def test_decrypt_many(self):
+        self.assertEqual(self.crypto.decrypt_many([self.encrypt('a:b'), self.encrypt('c', prefix=False)]), ['a:b', 'c'])
+
+        from base64 import b64encode
+
+        # a truncated ciphertext, not base64 and invalid padding
+        padding = f'{self.crypto.current.id}:{b64encode(bytes(128)).decode()}'
+        for invalid in (self.encrypt('a')[:-4], 'not base64!', padding):
+            with self.subTest(invalid), self.assertRaises(ValueError):
+                self.crypto.decrypt_many([self.encrypt('a'), invalid])
+        self.assertEqual(self.crypto.metrics()['failures'], 3)
+
+    def test_rotation(self):
+        from .crypto import Crypto, RELOAD_INTERVAL
+
+        other = Crypto(1024).warm_up()     # another process
+        first = self.crypto.current
+        encrypted = self.encrypt('first')
+
+        self.crypto.rotate()
+        self.assertNotEqual(self.crypto.current.id, first.id)
+        self.assertEqual(self.crypto.decrypt(encrypted), 'first')
+        self.assertEqual([key['id'] for key in self.crypto.public_keys()], [self.crypto.current.id, first.id])
+
+        # other processes load the new key when they first see its id, at most every RELOAD_INTERVAL seconds
+        second = self.encrypt('second')
+        with self.assertRaises(ValueError):
+            other.decrypt(second)
+        other._loaded_at -= RELOAD_INTERVAL
+        self.assertEqual(other.decrypt(second), 'second')
+
+        self.crypto.rotate()
+        with self.assertRaises(ValueError):
+            self.crypto.decrypt(encrypted)
+        self.assertEqual(self.crypto.decrypt(second), 'second')
+
+    def test_other_processes_pick_up_rotations(self):
+        from .crypto import Crypto, RELOAD_INTERVAL
+
+        other = Crypto(1024).warm_up()     # another process
+        first = other.current.id
+
+        self.crypto.rotate()
+        self.assertEqual(other.public_keys()[0]['id'], first)
+        other._checked_at -= RELOAD_INTERVAL
+        self.assertEqual(other.public_keys()[0]['id'], self.crypto.current.id)
+
+        # forms encrypted with keys it has never seen, unlike the previous one
+        self.crypto.rotate()
+        self.crypto.rotate()
+        other._checked_at -= RELOAD_INTERVAL
+        self.assertEqual(other.decrypt(self.encrypt('latest')), 'latest')
+        self.assertEqual(len(other.public_keys()), 2)
+        self.assertNotIn(first, other.keys)
+
+
+class FieldKeyTest(TestCase):
+    def open_session(self, secret):
+        from Crypto.Cipher import PKCS1_v1_5
+        from base64 import b64encode
+
+        key = crypto.current
+        ciphertext = PKCS1_v1_5.new(key.keypair.public_key()).encrypt(secret)
+        return self.client.post('/key/session/', {'key': f'{key.id}:{b64encode(ciphertext).decode()}'})
+
+    def encrypt(self, secret, name, value):
+        """A field encrypted like the browser does, see crypto.js."""
+
+        from Crypto.Cipher import AES
+        from base64 import b64encode
+        from hashlib import sha256
+        from .crypto import FIELD_PREFIX
+
+        cipher = AES.new(sha256(secret).digest(), AES.MODE_GCM)
+        cipher.update(name.encode())
+        ciphertext, tag = cipher.encrypt_and_digest(value.encode())
+        return f'{FIELD_PREFIX}{b64encode(cipher.nonce).decode()}:{b64encode(ciphertext + tag).decode()}'
+
+    def test_fields_are_decrypted_with_the_session_key(self):
+        from base64 import b64decode, b64encode
+        from .crypto import decrypt_fields
+
+        secret = b'secret of the session'
+        self.assertEqual(self.open_session(secret).status_code, 200)
+        session = self.client.session
+        password = self.encrypt(secret, 'password', 'p&ss')
+        self.assertEqual(decrypt_fields(session, {'password': password}), {'password': 'p&ss'})
+
+        nonce, ciphertext = password.rsplit(':', 1)
+        tampered = f'{nonce}:{b64encode(bytes([b64decode(ciphertext)[0] ^ 1]) + b64decode(ciphertext)[1:]).decode()}'
+        # swapped between fields, tampered with and encrypted with another key
+        other_key = self.encrypt(b'', 'password', 'p&ss')
+        for fields in ({'password2': password}, {'password': tampered}, {'password': other_key}):
+            with self.subTest(fields), self.assertRaises(ValueError):
+                decrypt_fields(session, fields)
+        with self.assertRaises(ValueError):
+            decrypt_fields(self.client.session.__class__(), {'password': password})
+
+    def test_errors_tell_nothing_about_the_secret(self):
+        from base64 import b64encode
+
+        invalid = [{}, {'key': 'unknown:AAAA'}, {'key': f'{crypto.current.id}:not base64!'}]
+        bodies = {self.client.post('/key/session/', data).content for data in invalid}
+        self.assertEqual(bodies, {b'{"error": "Invalid request."}'})
+
+        # invalid padding gives a key the browser doesn't know, and an id as random as any other
+        ciphertext = b64encode(bytes(crypto.current.keypair.size_in_bytes())).decode()
+        padding = self.client.post('/key/session/', {'key': f'{crypto.current.id}:{ciphertext}'})
+        ids = {self.open_session(b'secret').json()['id'] for _ in range(2)} | {padding.json()['id']}
+        self.assertEqual(len(ids), 3)
@@ -0,0 +1,164 @@
+"""
+Resumable, chunked image uploads for the editor.
+
+Instead of sending every image along with the deck in one multipart request, the editor uploads each new
+image on its own, in chunks, and refers to the finished upload by its id in the deck JSON. Chunks carry a
+``Content-Range`` header and are written at their offset, so a failed chunk can simply be sent again after
+asking for the current offset. Partial files live in ``UPLOAD_DIR`` inside the image storage, which lets a
+finished upload be moved into place instead of copied.
+"""
+
+import os
+import re
+from datetime import timedelta
+from uuid import UUID, uuid4
+from django.db.transaction import atomic
+from django.utils import timezone
+from .models import SHORT_LENGTH, Upload
+from .storage import CHUNK_SIZE, image_storage
+
+UPLOAD_DIR = '.uploads'
+MAX_SIZE = 10 * 1024 * 1024         # bytes
+EXTENSIONS = ('.png', '.jpg', '.jpeg')
+STALE_AFTER = timedelta(days=1)     # unfinished or unused uploads are removed after this
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)$')
+
+
+class OutOfOrder(Exception):
+    """A chunk would leave a gap in the file. The client should resume from ``offset``."""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+def partial_path(upload):
+    return image_storage.path(os.path.join(UPLOAD_DIR, upload.uuid.hex))
+
+
+def start(user, name, size):
+    """Registers a new upload and creates its empty partial file. Raises ValueError for invalid files."""
+
+    name = os.path.basename(str(name))
+    size = int(size)
+
+    if os.path.splitext(name)[1].lower() not in EXTENSIONS:
+        raise ValueError(f'Only {", ".join(EXTENSIONS)} images can be uploaded.')
+    if not 0 < size <= MAX_SIZE:
+        raise ValueError(f'Images have to be smaller than {MAX_SIZE // (1024 * 1024)} MB.')
+
+    upload = Upload.objects.create(user=user, uuid=uuid4(), name=name[-SHORT_LENGTH:], size=size)
+    os.makedirs(os.path.dirname(partial_path(upload)), exist_ok=True)
+    open(partial_path(upload), 'wb').close()
+    return upload
+
+
+def offset(upload):
+    """Number of contiguous bytes received so far."""
+
+    if upload.image:
+        return upload.size
+
+    try:
+        return os.path.getsize(partial_path(upload))
+    except FileNotFoundError:
+        return 0
+
+
+def write(upload, content_range, stream):
+    """
+    Parameters
+    ----------
+    upload : Upload
+            The upload the chunk belongs to.
+    content_range : str
+            Value of the Content-Range header, e.g. "bytes 0-1048575/5000000".
+    stream :
+            File-like object the chunk is read from, e.g. the request.
+
+    Returns
+    -------
+    int
+            The new offset. The upload is finished once it reaches the size of the upload.
+    """
+
+    match = _CONTENT_RANGE.match(content_range or '')
+    if match is None:
+        raise ValueError('Missing or invalid Content-Range header.')
+
+    first, last, total = map(int, match.groups())
+    if total != upload.size or not first <= last < total:
+        raise ValueError(f'Invalid range {content_range!r} for an upload of {upload.size} bytes.')
+
+    if upload.image:
+        return upload.size
+
+    current = offset(upload)
+    if first > current:
+        raise OutOfOrder(current)
+
+    remaining = last - first + 1
+    with open(partial_path(upload), 'r+b') as file:
+        file.seek(first)
+        while remaining:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            file.write(chunk)
+            remaining -= len(chunk)
+
+    if remaining:
+        raise ValueError(f'The chunk ended {remaining} bytes early.')
+
+    if last + 1 == total:
+        finish(upload)
+    return offset(upload)
+
+
+@atomic
+def finish(upload):
+    """Moves the complete file into the image storage. Only the first of concurrent calls does."""
+
+    locked = Upload.objects.select_for_update().get(pk=upload.pk)
+    if not locked.image:
+        locked.image = image_storage.adopt(partial_path(locked), locked.name)
+        locked.save(update_fields=['image'])
+    upload.image = locked.image
+
+
+def images(user, ids):
+    """
+    Maps the ids of finished uploads of the user to their stored images, in a single query.
+    Raises ValueError if any of them is unknown, unfinished or expired.
+    """
+
+    ids = {str(UUID(str(id))) for id in ids if id}  # raises ValueError if malformed
+    if not ids:
+        return dict()
+
+    rows = Upload.objects.filter(user=user, uuid__in=ids).exclude(image='').values_list('uuid', 'image')
+    # images unused for longer than the grace period of the cleaner may be gone
+    found = {str(uuid): image for uuid, image in rows if image_storage.exists(image)}
+
+    missing = ids - found.keys()
+    if missing:
+        raise ValueError(f'Unknown or unfinished uploads: {", ".join(sorted(missing))}.')
+    return found
+
+
+def remove_stale(age=STALE_AFTER):
+    """Forgets uploads older than ``age`` and removes their partial files. Returns the number of uploads removed."""
+
+    stale = Upload.objects.filter(created__lt=timezone.now() - age)
+    removed = 0
+
+    for upload in stale.iterator():
+        try:
+            os.remove(partial_path(upload))
+        except FileNotFoundError:
+            pass    # finished, the file was moved into the storage
+        removed += 1
+
+    stale.delete()
+    return removed
@@ -17,9 +17,15 @@ urlpatterns = [
     path('checkout/<page>', CheckoutView.as_view(), name='page'),
 
     path('editor/', EditorView.as_view()),
+    path('editor/uploads/', UploadView.as_view()),
+    path('editor/uploads/<uuid:uuid>/', UploadView.as_view()),
 
     path('flashcards/', FlashcardsView.as_view()),
     path('learn/', LearnView.as_view()),
+    path('learn/questions/', QuestionsView.as_view()),
+    path('review/', ReviewView.as_view()),
+    path('review/answers/', AnswersView.as_view()),
 
     path('key/', CryptoView.as_view()),
+    path('key/session/', SessionKeyView.as_view()),
 ]
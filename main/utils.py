@@ -1,10 +1,6 @@
 USER_VIEW_PAGE_SIZE = 7
 SEARCH_VIEW_PAGE_SIZE = 10
-
-
-def django_thread():
-    from threading import enumerate
-    return next(filter(lambda thread: thread.name == 'django-main-thread', enumerate()))
+QUIZ_PAGE_SIZE = 10
 
 
 def auth_required(get_request):
@@ -21,32 +17,60 @@ def auth_required(get_request):
 
 
 def sensitive(post_request):
-    """Decrypt passwords in POST."""
+    """Decrypt passwords in POST. Forms which can't be decrypted, e.g. after a key rotation, are sent back."""
 
-    from django.http import QueryDict
-    from .crypto import crypto
+    from django.contrib import messages
+    from django.shortcuts import redirect
+    from django.utils.translation import gettext as _
 
     def decorator(view, request, *args, **kwargs):
-        post = dict(request.POST.items())
+        try:
+            request.POST = decrypt_post(request)
+        except ValueError:
+            messages.error(request, _('The form could not be read, please submit it again.'))
+            return redirect(request.path)
+        return post_request(view, request, *args, **kwargs)
 
-        # decrypt encrypted values
-        for key, value in post.items():
-            if 'password' in key:
-                post[key] = crypto.decrypt(value)
+    return decorator
 
-        # concat key value pairs
-        pairs = map(lambda pair: '='.join(pair), post.items())
-        query_str = '&'.join(pairs)
 
-        request.POST = QueryDict(query_str)
-        return post_request(view, request)
+def decrypt_post(request):
+    """
+    Parameters
+    ----------
+    request : HttpRequest
+            Request with encrypted password fields, see crypto.decrypt_fields.
 
-    return decorator
+    Returns
+    -------
+    QueryDict
+            The POST data of the request, with the password fields decrypted in place rather than in a copy.
+            Values are set as they are, so they may contain any character, including "&", "=" and "+". Raises
+            ValueError if decryption fails, the POST data is left as it was then.
+    """
+
+    from .crypto import decrypt_fields
+
+    post = request.POST
+    encrypted = {key: post[key] for key in post if 'password' in key}
+    decrypted = decrypt_fields(request.session, encrypted)
+
+    post._mutable = True
+    try:
+        for key, value in decrypted.items():
+            post[key] = value
+    finally:
+        post._mutable = False   # like request.POST
+    return post
 
 
 def session_clean_up(view, request):
     from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
-    allowed_keys = view.session_keys + (BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY)
+    from .crypto import SESSION_KEY as FIELD_KEY, SESSION_KEY_ID as FIELD_KEY_ID
+    from .routers import PIN_KEY
+    allowed_keys = view.session_keys + (
+        BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, FIELD_KEY, FIELD_KEY_ID, PIN_KEY,
+    )
 
     for key in dict(request.session).keys():
         if key not in allowed_keys:
@@ -59,38 +83,21 @@ def random_string(length):
     return ''.join(choice(ascii_letters + digits) for _ in range(length))
 
 
-def validate_datetime(day, hour, minute):
-    if not 1 <= day <= 7:
-        raise ValueError(day)
-    if not 0 <= hour <= 23:
-        raise ValueError(hour)
-    if not 0 <= minute <= 59:
-        raise ValueError(minute)
-
-
 def get_decks_from_query(user, query, local):
     from django.db.models import Q
-    from .models import Deck
+    from . import search
 
     if not user.is_authenticated:
         # non logged in user's global search
-        return Deck.objects.filter(
-            Q(name__icontains=query) | Q(description__icontains=query)
-        )
+        return search.decks(query)
 
     if query is None:
         # logged in user's deck pagination
-        return Deck.objects.filter(user=user)
+        return search.decks(None, Q(user=user))
 
     if local:
         # logged in user's local search
-        return Deck.objects.filter(
-            Q(user=user),
-            Q(name__icontains=query) | Q(description__icontains=query)
-        )
+        return search.decks(query, Q(user=user))
     else:
         # logged in user's global search
-        return Deck.objects.filter(
-            ~Q(user=user),
-            Q(name__icontains=query) | Q(description__icontains=query)
-        )
+        return search.decks(query, ~Q(user=user))
@@ -1,20 +1,31 @@
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
-from django.core.mail import send_mail
-from django.core.paginator import Paginator
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import QuerySet
 from django.db.transaction import atomic
+from django.http import Http404
 from django.shortcuts import redirect, render as django_render
 from django.utils.translation import gettext as _
 from django.views.generic import View
 from abc import ABCMeta, abstractmethod
 from datetime import date
-from . import forms, testgen, utils
+from uuid import UUID
+from . import caching, forms, loaders, routers, summaries, testgen, utils
+from .paging import KeysetPaginator
 from .models import *
 
 
 class BaseView(View, metaclass=ABCMeta):
     template_name = ''
     session_keys = tuple()
+    replica_reads = False   # the view only reads decks, those may come from a read replica, see routers.py
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.replica_reads:
+            return super().dispatch(request, *args, **kwargs)
+
+        with routers.replica_reads(request):
+            return super().dispatch(request, *args, **kwargs)
 
     def render(self, request, **kwargs):
         utils.session_clean_up(self, request)
@@ -36,6 +47,41 @@ class PagingView(BaseView, metaclass=ABCMeta):
     def init_page_manager(self, request):
         pass
 
+    def create_page_manager(self, decks, per_page):
+        """
+        Deck listings are paginated with cursors, so deep pages cost the same as the first one.
+        Ranked search results keep numbered pages: their order is a computed rank, which has no column to
+        seek on, so every page of them still costs a COUNT and an OFFSET, see search.SearchResults.
+        """
+
+        if isinstance(decks, QuerySet):
+            return KeysetPaginator(decks, per_page)
+        return Paginator(decks, per_page)
+
+    def get_page(self, page):
+        """Page number or cursor from the URL to page object."""
+
+        try:
+            return self.page_manager.page(page)
+        except InvalidPage:
+            raise Http404
+
+    def get_cached_page(self, request, page, scope, *vary_on):
+        """Same as get_page, but the page is cached until a deck of the scope changes, see caching.py."""
+        from django.conf import settings
+
+        if not settings.CACHE_PAGES:
+            self.init_page_manager(request)
+            return self.get_page(page)
+
+        key = caching.key('pages', scope, caching.generation(scope), page, *vary_on)
+
+        def get_page():
+            self.init_page_manager(request)
+            return self.get_page(page)
+
+        return caching.get_or_set('pages', key, get_page, caching.PAGE_TIMEOUT)
+
 
 class IndexView(BaseView):
     template_name = 'main/index/index.html'
@@ -89,21 +135,12 @@ class IndexView(BaseView):
         username = request.POST['username']
         email = request.POST['email']
 
+        from .mail import send_new_password
+
         try:
-            # refresh user's password
-            user = User.objects.select_for_update().get(username=username, email=email)
-            new_password = utils.random_string(32)
-            user.set_password(new_password)
-            user.save()
-
-            # inform user about the changes
-            send_mail(
-                'Password Recovery',
-                _('Dear %s!\nWe\'ve refreshed your password.\nYou can login with: %s\n\nSincerely\nQuizcards Support')
-                % (user.username, new_password),   # format string
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[user.email],
-            )
+            # the password is refreshed and mailed by a background task
+            user = User.objects.get(username=username, email=email)
+            send_new_password.delay(user.pk)
             msg = _('We\'ve sent an email containing your new password.')
             messages.success(request, msg)
             return redirect('/login')
@@ -116,6 +153,7 @@ class IndexView(BaseView):
 class SearchView(PagingView):
     template_name = 'main/search.html'
     session_keys = ('global_search', )
+    replica_reads = True
 
     def get(self, request, **kwargs):
         return super().render(request, **kwargs)
@@ -125,12 +163,15 @@ class SearchView(PagingView):
         return super().render(request, **kwargs)
 
     def get_context(self, request, **kwargs):
-        self.init_page_manager(request)
-        return self._create_context(page=self.page_manager.page(kwargs['page']))
+        # logged in users don't find their own decks
+        page = self.get_cached_page(
+            request, kwargs['page'], caching.SEARCH_SCOPE, request.session['global_search'], request.user.pk
+        )
+        return self._create_context(page=page)
 
     def init_page_manager(self, request):
         decks = utils.get_decks_from_query(request.user, request.session['global_search'], local=False)
-        self.page_manager = Paginator(decks, utils.SEARCH_VIEW_PAGE_SIZE)
+        self.page_manager = self.create_page_manager(decks, utils.SEARCH_VIEW_PAGE_SIZE)
 
 
 class UserView(PagingView):
@@ -175,14 +216,14 @@ class UserView(PagingView):
         else:
             if kwargs.get('page'):
                 self.init_page_manager(request)
-                context.update(page=self.page_manager.page(kwargs['page']))
+                context.update(page=self.get_page(kwargs['page']))
 
         return context
 
     def init_page_manager(self, request):
         query = request.session.get('local_search')
         decks = utils.get_decks_from_query(request.user, query, local=True)
-        self.page_manager = Paginator(decks, utils.USER_VIEW_PAGE_SIZE)
+        self.page_manager = self.create_page_manager(decks, utils.USER_VIEW_PAGE_SIZE)
 
     @atomic
     def handle_deck_delete(self, request):
@@ -190,6 +231,7 @@ class UserView(PagingView):
         deck = Deck.objects.select_for_update().get(pk=deck_id)
         name = deck.name
         deck.delete()
+        routers.pin(request)
         messages.success(request, _(f'Deck "{name}" was successfully deleted.'))
 
     @utils.sensitive
@@ -210,28 +252,35 @@ class UserView(PagingView):
 
 class CheckoutView(PagingView):
     template_name = 'main/user/checkout.html'
-    session_keys = ('checkout', )
+    session_keys = ('checkout', 'checkout_user')
+    replica_reads = True
 
     def get(self, request, **kwargs):
         if request.GET.get('checkout'):
+            checkout_user = User.objects.filter(username=request.GET['checkout']).values_list('pk', flat=True).first()
+            if checkout_user is None:
+                raise Http404
+
             request.session['checkout'] = request.GET['checkout']
+            request.session['checkout_user'] = checkout_user
             return redirect('/checkout/1')
 
         return super().render(request, **kwargs)
 
     def get_context(self, request, **kwargs):
-        self.init_page_manager(request)
-        return self._create_context(page=self.page_manager.page(kwargs['page']))
+        checkout_user = request.session['checkout_user']
+        page = self.get_cached_page(request, kwargs['page'], caching.checkout_scope(checkout_user), checkout_user)
+        return self._create_context(page=page)
 
     def init_page_manager(self, request):
-        checkout_user = User.objects.get(username=request.session['checkout'])
-        decks = Deck.objects.filter(user=checkout_user)
-        self.page_manager = Paginator(decks, utils.USER_VIEW_PAGE_SIZE)
+        decks = Deck.objects.filter(user_id=request.session['checkout_user'])
+        self.page_manager = self.create_page_manager(decks, utils.USER_VIEW_PAGE_SIZE)
 
 
 class EditorView(BaseView):
     template_name = 'main/editor/editor.html'
     session_keys = ('uuid', )
+    card_fields = ('term', 'term_image', 'definition', 'definition_image', 'position')
 
     @utils.auth_required
     def get(self, request):
@@ -243,18 +292,53 @@ class EditorView(BaseView):
 
     def post(self, request):
         from json import loads
-        data = loads(request.POST['deck'])
-        update = data.get('uuid')   # if exists a uuid in POST we update
 
-        self._make_unique(request.FILES)
+        try:
+            data = loads(request.POST['deck'])
+            update = data.get('uuid')   # if exists a uuid in POST we update
 
-        if update:
-            self.update_deck(request, data)
-        else:
-            self.save_deck(request, data)
+            if update:
+                self.update_deck(request, data)
+            else:
+                self.save_deck(request, data)
+        except (KeyError, TypeError, ValueError) as e:
+            # e.g. an unknown or unfinished upload, the transaction of the save is rolled back
+            messages.error(request, _(f'The deck was not saved: {e}'))
+            return redirect('/editor')
 
         return redirect('/user')
 
+    @utils.auth_required
+    def patch(self, request):
+        """Incremental save of an existing deck. The body is JSON, see ``apply_operations``."""
+
+        from django.http import JsonResponse
+        from json import loads
+
+        try:
+            data = loads(request.body)
+            with atomic():
+                deck = Deck.objects.select_for_update().get(user=request.user, uuid=data['uuid'])
+
+                if deck.version != data['version']:
+                    msg = _(f'Deck "{deck.name}" was modified meanwhile. Reload the editor to see the changes.')
+                    return JsonResponse({'error': msg, 'version': deck.version}, status=409)
+
+                self.apply_operations(deck, data.get('operations', []))
+                self._assign(deck, data, *(key for key in ('name', 'description') if key in data))
+                deck.version += 1
+                deck.last_modified = date.today()
+                deck.save()
+                summaries.refresh(deck)
+            routers.pin(request)
+        except Deck.DoesNotExist:
+            raise Http404
+        except (KeyError, TypeError, ValueError) as e:
+            return JsonResponse({'error': f'Invalid request: {e!r}'}, status=400)
+
+        messages.success(request, _(f'Deck "{deck.name}" updated successfully.'))
+        return JsonResponse({'version': deck.version})
+
     def get_context(self, request, **kwargs):
         if request.session.get('uuid'):
             # load deck
@@ -278,66 +362,182 @@ class EditorView(BaseView):
         )
         deck.save()
         self.save_cards(request, deck, data)
+        summaries.refresh(deck)
+        routers.pin(request)
         messages.success(request, _(f'Deck "{deck.name}" created successfully.'))
 
     def save_cards(self, request, deck, data):
-        term_images = request.FILES.getlist('term-image')
-        definition_images = request.FILES.getlist('definition-image')
+        uploads = self._get_uploads(request, data['cards'])
 
-        for card in data['cards']:
-            term_image = term_images.pop(0) if card['term_image'] else None
-            definition_image = definition_images.pop(0) if card['definition_image'] else None
+        for position, card in enumerate(data['cards']):
+            card['position'] = position
 
-            Card(
-                deck=deck,
-                term=card['term'],
-                term_image=term_image,
-                definition=card['definition'],
-                definition_image=definition_image
-            ).save()
+        Card.objects.bulk_create([self.create_card(deck, card, uploads) for card in data['cards']])
 
     @atomic
     def update_deck(self, request, data):
         deck = Deck.objects.select_for_update().get(uuid=data['uuid'])
+
+        if data.get('version', deck.version) != deck.version:
+            messages.error(request, _(f'Deck "{deck.name}" was modified meanwhile, your changes were not saved.'))
+            return
+
         data['last_modified'] = date.today()
-        self._update(deck, data, 'name', 'description', 'last_modified')
+        data['version'] = deck.version + 1
+        self._update(deck, data, 'name', 'description', 'last_modified', 'version')
         self.update_cards(request, deck, data)
+        summaries.refresh(deck)
+        routers.pin(request)
         messages.success(request, _(f'Deck "{deck.name}" updated successfully.'))
 
     def update_cards(self, request, deck, data):
-        cards = Card.objects.filter(deck=deck)
-
-        for card in cards:
-            # get corresponding card by primary key from POST
-            new = list(filter(lambda post: card.pk == post['pk'], data['cards']))
-            if len(new) != 0:
-                new = new.pop()
-                self._update(card, new, 'term', 'definition')
-                self.update_images(request, card, new)
-            else:
-                # card is not present in POST because it was deleted
-                card.delete()
+        """Diffs POST against the stored cards by primary key, then writes the changes in bulk."""
+
+        uploads = self._get_uploads(request, data['cards'])
+        cards = {card.pk: card for card in Card.objects.filter(deck=deck)}
+        created, updated = list(), list()
+
+        # walk cards in editor order, so uploaded files are matched to the right cards
+        for position, new in enumerate(data['cards']):
+            new['position'] = position
+            card = cards.pop(new.get('pk'), None)
+            if card is None:
+                created.append(self.create_card(deck, new, uploads))
+            elif self.update_card(card, new, uploads):
+                updated.append(card)
+
+        # remaining cards are not present in POST because they were deleted
+        if cards:
+            Card.objects.filter(pk__in=cards.keys()).delete()
+        Card.objects.bulk_update(updated, self.card_fields)
+        Card.objects.bulk_create(created)
+
+    def create_card(self, deck, data, uploads):
+        return Card(
+            deck=deck,
+            term=data['term'],
+            term_image=self._new_image(data, 'term', uploads) if data['term_image'] else None,
+            definition=data['definition'],
+            definition_image=self._new_image(data, 'definition', uploads) if data['definition_image'] else None,
+            position=data['position']
+        )
 
-        # filter out and save newly added cards
-        data['cards'] = list(filter(lambda card: card['pk'] is None, data['cards']))
-        self.save_cards(request, deck, data)
+    def update_card(self, card, new, uploads):
+        """Applies changes to the card without saving it. Returns whether the card was modified."""
+
+        modified = self._assign(card, new, 'term', 'definition', 'position')
+
+        for face in ('term', 'definition'):
+            image = getattr(card, face + '_image')
+            if basename(image.name) != new[face + '_image']:
+                upload = self._new_image(new, face, uploads) if new[face + '_image'] else None
+                if isinstance(upload, str):
+                    # already stored by a chunked upload
+                    setattr(card, face + '_image', upload)
+                elif upload:
+                    # bulk_update doesn't commit files to the storage
+                    image.save(upload.name, upload, save=False)
+                else:
+                    setattr(card, face + '_image', None)
+                modified = True
 
-    def update_images(self, request, card, new):
-        modified = False
-        term_images = request.FILES.getlist('term-image')
-        definition_images = request.FILES.getlist('definition-image')
+        return modified
 
-        if basename(card.term_image.name) != new['term_image']:
-            term_image = term_images.pop(0) if new['term_image'] else None
-            card.term_image = term_image
-            modified = True
-        if basename(card.definition_image.name) != new['definition_image']:
-            definition_image = definition_images.pop(0) if new['definition_image'] else None
-            card.definition_image = definition_image
-            modified = True
+    def apply_operations(self, deck, operations):
+        """
+        Applies a batch of card operations in a fixed number of queries.
 
-        if modified:
-            card.save()
+        Parameters
+        ----------
+        deck : Deck
+                The deck being edited, locked by the caller.
+        operations : list
+                Dicts with an "op" key, one of:
+                    add - new card with "term", "definition" and "position", optionally "term_upload" and
+                          "definition_upload" holding the ids of finished chunked uploads, see uploads.py
+                    update - "pk" of the card and any of "term" and "definition" to change,
+                             "term_image" or "definition_image" set to an empty string to remove the image,
+                             "term_upload" or "definition_upload" to replace it
+                    remove - "pk" of the card
+                    reorder - "positions" mapping primary keys to their new positions
+        """
+
+        from . import uploads
+
+        batch = {'add': [], 'update': [], 'remove': [], 'reorder': []}
+        for operation in operations:
+            batch[operation['op']].append(operation)
+
+        images = uploads.images(deck.user, (
+            operation.get(face + '_upload') for operation in batch['add'] + batch['update'] for face in ('term', 'definition')
+        ))
+
+        removed = {int(operation['pk']) for operation in batch['remove']}
+        positions = {int(pk): position for op in batch['reorder'] for pk, position in op['positions'].items()}
+        updates = {int(operation['pk']): operation for operation in batch['update']}
+
+        # only cards of this deck can be modified
+        cards = Card.objects.filter(deck=deck).in_bulk((updates.keys() | positions.keys()) - removed)
+        modified = dict()
+
+        for pk, operation in updates.items():
+            card = cards.get(pk)
+            if card is None:
+                continue
+
+            if self._assign(card, operation, *(key for key in ('term', 'definition') if key in operation)):
+                modified[pk] = card
+
+            for face in ('term', 'definition'):
+                if operation.get(face + '_upload'):
+                    setattr(card, face + '_image', images[str(UUID(operation[face + '_upload']))])
+                    modified[pk] = card
+                elif face + '_image' in operation and not operation[face + '_image']:
+                    setattr(card, face + '_image', None)
+                    modified[pk] = card
+
+        for pk, position in positions.items():
+            card = cards.get(pk)
+            if card is not None and self._assign(card, {'position': int(position)}, 'position'):
+                modified[pk] = card
+
+        if removed:
+            Card.objects.filter(deck=deck, pk__in=removed).delete()
+        Card.objects.bulk_update(modified.values(), self.card_fields)
+        Card.objects.bulk_create([
+            Card(
+                deck=deck,
+                term=op['term'],
+                term_image=images[str(UUID(op['term_upload']))] if op.get('term_upload') else None,
+                definition=op['definition'],
+                definition_image=images[str(UUID(op['definition_upload']))] if op.get('definition_upload') else None,
+                position=int(op['position'])
+            )
+            for op in batch['add']
+        ])
+
+    def _get_uploads(self, request, cards):
+        """
+        Images uploaded along with the deck in editor order, to be consumed by the cards having a new image,
+        and the stored images of the chunked uploads the cards refer to.
+        """
+
+        from . import uploads
+
+        return {
+            'term': iter(request.FILES.getlist('term-image')),
+            'definition': iter(request.FILES.getlist('definition-image')),
+            'chunked': uploads.images(request.user, (
+                card.get(face + '_upload') for card in cards for face in ('term', 'definition')
+            )),
+        }
+
+    def _new_image(self, data, face, uploads):
+        """Name of the stored image if the card refers to a chunked upload, otherwise the next uploaded file."""
+
+        if data.get(face + '_upload'):
+            return uploads['chunked'][str(UUID(data[face + '_upload']))]
+        return next(uploads[face], None)
 
     def _update(self, model, data, *keys):
         """
@@ -350,6 +550,13 @@ class EditorView(BaseView):
         *keys :
                 Which fields are need to be updated.
         """
+
+        if self._assign(model, data, *keys):
+            model.save()
+
+    def _assign(self, model, data, *keys):
+        """Same as _update, but leaves saving to the caller. Returns whether the model was modified."""
+
         modified = False
 
         for key in keys:
@@ -357,17 +564,7 @@ class EditorView(BaseView):
                 model.__dict__[key] = data[key]
                 modified = True
 
-        if modified:
-            model.save()
-
-    def _make_unique(self, files, unique_id_length=7):
-        for image in ('term-image', 'definition-image'):
-            for file in files.getlist(image):
-                if file:
-                    name, ext = file.name.split('.')
-                    unique_id = utils.random_string(unique_id_length)
-                    name = name + '_' + unique_id
-                    file.name = name + '.' + ext
+        return modified
 
 
 class StudyView(BaseView):
@@ -391,7 +588,7 @@ class StudyView(BaseView):
 
     def get_context(self, request, **kwargs):
         settings = request.session['settings']
-        deck = Deck.objects.get(uuid=request.session['uuid'])
+        deck = loaders.deck(request, request.session['uuid'], *loaders.STUDY_FIELDS)
         return self._create_context(settings=settings, deck=deck)
 
     def redirect_to(self):
@@ -400,33 +597,175 @@ class StudyView(BaseView):
 
 class FlashcardsView(StudyView):
     template_name = 'main/study/flashcards/flashcards.html'
+    replica_reads = True
 
     def get_context(self, request, **kwargs):
-        deck = Deck.objects.get(uuid=request.session['uuid'])
         context = super().get_context(request)
-        context.update(cards=Card.objects.filter(deck=deck))
+        context.update(cards=Card.objects.filter(deck=context['deck']))
         return context
 
 
 class LearnView(StudyView):
     template_name = 'main/study/learn/learn.html'
+    session_keys = StudyView.session_keys + ('seed', 'version')
+    replica_reads = True
 
     def get_context(self, request, **kwargs):
-        uuid = request.session['uuid']
-        answer_with = request.session['settings']['answer_with']
+        from random import getrandbits
+
+        # questions are fetched page by page from QuestionsView, a new seed makes every visit a new quiz
         context = super().get_context(request, **kwargs)
-        context.update(questions=testgen.generate_questions(uuid, answer_with))
+        request.session['seed'] = getrandbits(32)
+        request.session['version'] = context['deck'].version
         return context
 
 
+class QuestionsView(View):
+    """Serves the questions of the current learn session as rendered html, page by page. Available through GET request."""
+
+    def get(self, request):
+        from django.http import JsonResponse
+        from django.template.loader import render_to_string
+
+        try:
+            uuid, version, study_settings, seed = (
+                request.session[key] for key in ('uuid', 'version', 'settings', 'seed')
+            )
+            start = max(int(request.GET.get('start', 0)), 0)
+        except (KeyError, ValueError):
+            raise Http404
+
+        questions = testgen.generate_questions(uuid, version, study_settings['answer_with'], seed)
+        end = min(start + utils.QUIZ_PAGE_SIZE, len(questions))
+        rendered = [
+            render_to_string('main/study/learn/question.html', {'q': question, 'settings': study_settings})
+            for question in questions[start:end]
+        ]
+
+        return JsonResponse({'questions': rendered, 'total': len(questions)})
+
+
+class ReviewView(StudyView):
+    """Spaced repetition session over the due cards of the deck."""
+
+    template_name = 'main/study/review/review.html'
+
+    @utils.auth_required
+    def get(self, request):
+        return super().get(request)
+
+    def get_context(self, request, **kwargs):
+        from . import scheduler
+        context = super().get_context(request, **kwargs)
+        context.update(cards=scheduler.due_cards(request.user, context['deck']))
+        return context
+
+
+class AnswersView(View):
+    """Records a batch of study answers for the scheduler. Available through POST request."""
+
+    def post(self, request):
+        from django.http import JsonResponse
+        from json import loads
+        from . import scheduler
+
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required.'}, status=403)
+
+        try:
+            recorded = scheduler.record(request.user, loads(request.POST['answers']))
+        except (KeyError, TypeError, ValueError) as e:
+            return JsonResponse({'error': f'Invalid request: {e!r}'}, status=400)
+
+        return JsonResponse({'recorded': recorded})
+
+
+class UploadView(View):
+    """
+    Chunked, resumable image uploads for the editor, see uploads.py. A POST request starts an upload,
+    PUT requests send its chunks and a GET request tells where to resume from.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        from django.http import JsonResponse
+
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required.'}, status=403)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request, uuid):
+        from django.http import JsonResponse
+        from . import uploads
+
+        upload = self._get_upload(request, uuid)
+        return JsonResponse({'id': str(upload.uuid), 'offset': uploads.offset(upload), 'size': upload.size})
+
+    def post(self, request):
+        from django.http import JsonResponse
+        from json import loads
+        from . import uploads
+
+        try:
+            data = loads(request.body)
+            upload = uploads.start(request.user, data['name'], data['size'])
+        except (KeyError, TypeError, ValueError) as e:
+            return JsonResponse({'error': f'Invalid request: {e}'}, status=400)
+
+        return JsonResponse({'id': str(upload.uuid), 'offset': 0}, status=201)
+
+    def put(self, request, uuid):
+        from django.http import JsonResponse
+        from . import uploads
+
+        upload = self._get_upload(request, uuid)
+
+        try:
+            offset = uploads.write(upload, request.headers.get('Content-Range'), request)
+        except uploads.OutOfOrder as e:
+            return JsonResponse({'error': 'Chunk out of order.', 'offset': e.offset}, status=409)
+        except ValueError as e:
+            return JsonResponse({'error': f'Invalid request: {e}'}, status=400)
+
+        return JsonResponse({'id': str(upload.uuid), 'offset': offset, 'size': upload.size})
+
+    def _get_upload(self, request, uuid):
+        try:
+            return Upload.objects.get(user=request.user, uuid=uuid)
+        except Upload.DoesNotExist:
+            raise Http404
+
+
 class CryptoView(View):
-    """Grants access to RSA public key. Available through PUT request."""
+    """
+    Grants access to the RSA public keys, the current one first, with the ids to prefix their ciphertexts with.
+    Available through PUT request.
+    """
 
     def get(self, request):
         from django.http import Http404
         raise Http404
 
     def put(self, request):
-        from django.http import HttpResponse
-        from .crypto import crypto
-        return HttpResponse(crypto.public_key())
+        from django.http import JsonResponse
+        from .crypto import crypto, session_key_id
+        # the id of the session's AES key lets the browser tell whether its copy of the key is still valid
+        return JsonResponse({'keys': crypto.public_keys(), 'session': session_key_id(request.session)})
+
+
+class SessionKeyView(View):
+    """
+    Receives the AES key encrypting the sensitive fields of the session, see crypto.open_session.
+    Available through POST request.
+    """
+
+    def post(self, request):
+        from django.http import JsonResponse
+        from .crypto import open_session
+
+        try:
+            key_id = open_session(request.session, request.POST['key'])
+        except (KeyError, ValueError):
+            # the same response for every error, see Crypto.derive_key
+            return JsonResponse({'error': 'Invalid request.'}, status=400)
+
+        return JsonResponse({'id': key_id})
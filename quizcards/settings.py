@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 from django.contrib.messages import constants as messages
-from decouple import config
+from decouple import Csv, config
 from os import path
 from pathlib import Path
 from socket import gethostbyname as ipv4
@@ -37,6 +37,9 @@ ALLOWED_HOSTS = [
     'localhost'
 ]
 
+# e.g. the warnings of main/checks.py which don't apply to a deployment
+SILENCED_SYSTEM_CHECKS = config('SILENCED_SYSTEM_CHECKS', default='', cast=Csv())
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -52,6 +55,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'main.middleware.DuplicateQueryMiddleware',     # DEBUG only, sees the queries of the middleware below too
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -84,14 +88,55 @@ WSGI_APPLICATION = 'quizcards.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
+# SQLite by default, tuned for concurrent requests in main/backends/sqlite3. For PostgreSQL set DATABASE_ENGINE
+# to django.db.backends.postgresql (requires psycopg2) along with the connection details.
+
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='main.backends.sqlite3')
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': DATABASE_ENGINE,
+        'NAME': config('DATABASE_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        'USER': config('DATABASE_USER', default=''),
+        'PASSWORD': config('DATABASE_PASSWORD', default=''),
+        'HOST': config('DATABASE_HOST', default=''),
+        'PORT': config('DATABASE_PORT', default=''),
+        # seconds a connection is reused across requests, 0 closes it after every request
+        'CONN_MAX_AGE': config('DATABASE_CONN_MAX_AGE', default=60, cast=int),
+        # SQLite: seconds to wait for the write lock of another connection instead of failing at once
+        'OPTIONS': {'timeout': config('SQLITE_TIMEOUT', default=20, cast=int)} if 'sqlite' in DATABASE_ENGINE else {},
     }
 }
 
+# Read replicas of the default database, which the study, search and browsing views read the decks from, see
+# main/routers.py. Comma separated database names for SQLite (e.g. copies kept up to date by LiteFS), hosts otherwise.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv()), 1):
+    location = 'NAME' if 'sqlite' in DATABASE_ENGINE else 'HOST'
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], location: replica}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['main.routers.ReplicaRouter']
+
+# seconds a user reads from the default database after saving a deck, at least the delay of the replication
+DATABASE_REPLICATION_LAG = config('DATABASE_REPLICATION_LAG', default=5, cast=float)
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# the file based cache (django.core.cache.backends.filebased.FileBasedCache) is shared by every process
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# Caches the search and checkout pages, see main/caching.py. Their invalidations have to reach every process, so
+# this needs a shared backend and is off with the per-process default, see the check main.E001.
+CACHE_PAGES = config('CACHE_PAGES', default='locmem' not in CACHES['default']['BACKEND'], cast=bool)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -131,6 +176,14 @@ EMAIL_HOST_USER = config('EMAIL_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_PASSWORD')
 
 
+# Background tasks, see main/tasks.py
+
+# The queue and the scheduled jobs are run by "manage.py tasks work", a process of its own. Worker threads in
+# every web process are opt-in, e.g. for a single process development server. Without either nothing runs,
+# see main.W001 in main/checks.py.
+TASK_WORKERS = config('TASK_WORKERS', default=0, cast=int)
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
@@ -7,14 +7,29 @@ For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
+from django.core import checks
 from django.core.wsgi import get_wsgi_application
-from main import cleaner
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quizcards.settings')
 
 application = get_wsgi_application()
 
-# run file cleanup every FRIDAY at 17:00
-cleaner.start_cleanup_thread(5, 17, 0)
+# the app's modules import its models, so only once the apps are loaded
+from main import tasks  # noqa: E402
+from main.checks import TAG  # noqa: E402
+
+# background tasks (mail, image processing) and the scheduled jobs (file cleanup) run in "manage.py tasks work",
+# unless worker threads in the web processes are configured
+tasks.start_workers(settings.TASK_WORKERS)
+
+# the web server doesn't run the checks of management commands, a misconfigured deployment is logged instead
+for message in checks.run_checks(tags=[TAG]):
+    if not message.is_silenced():
+        logging.getLogger('quizcards').warning('%s', message)
+
+# the RSA keys are loaded on first use, or ahead of it after forking a worker (see gunicorn.conf.py), never here as
+# the module may be imported before forking